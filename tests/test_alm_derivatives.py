@@ -0,0 +1,87 @@
+'''
+This code checks the analytic yaw and chord derivatives of the actuator line
+force against central differences of the forward force
+'''
+
+import pathlib
+import pytest
+import os
+import numpy as np
+
+### Located Inputs ###
+home_path = os.getcwd()
+reg_path = pathlib.Path(__file__, "../9-Regression/").resolve()
+yaml_file = pathlib.Path(__file__, "../10-ALM_Derivatives/ALM_Derivatives.yaml").resolve()
+
+
+###############################################################
+######################### Setup Problem #######################
+###############################################################
+
+@pytest.fixture(scope="module")
+def problem():
+    pytest.importorskip("dolfin")
+
+    ### Build the problem from the yaml, the turbine data paths are relative to the regression folder ###
+    os.chdir(reg_path)
+    try:
+        from windse_driver import driver_functions
+        params = driver_functions.Initialize(yaml_file.as_posix())
+        dom, farm = driver_functions.BuildDomain(params)
+        problem = driver_functions.BuildProblem(params,dom,farm)
+    finally:
+        os.chdir(home_path)
+
+    return problem
+
+def alm_force(problem, dfd=None):
+    from windse.helper_functions import UpdateActuatorLineForce
+
+    ### Evaluate the first turbine at the first time step using the fluid sampled while building the problem ###
+    output = UpdateActuatorLineForce(problem, problem.mpi_u_fluid_constant, 0, problem.dt, 0, dfd=dfd)
+
+    if dfd is None:
+        return output.vector().get_local()
+    else:
+        return output
+
+
+###############################################################
+######################### Define Tests ########################
+###############################################################
+
+def test_alm_yaw_derivative(problem):
+    from dolfin import Constant
+    dfd = alm_force(problem, dfd="yaw")
+
+    ### Central difference of the forward force ###
+    h = 1e-6
+    yaw = problem.farm.myaw[0]
+    problem.farm.myaw[0] = Constant(float(yaw)+h)
+    force_plus = alm_force(problem)
+    problem.farm.myaw[0] = Constant(float(yaw)-h)
+    force_minus = alm_force(problem)
+    problem.farm.myaw[0] = yaw
+    fd = (force_plus-force_minus)/(2.0*h)
+
+    assert np.max(np.abs(fd)) > 0.0
+    assert np.max(np.abs(dfd-fd)) <= 1e-4*np.max(np.abs(fd))
+
+def test_alm_chord_derivative(problem):
+    from dolfin import Constant
+    dfd = alm_force(problem, dfd="chord")
+
+    ### Central difference of the forward force with respect to the chord of each segment ###
+    h = 1e-4
+    fd = np.zeros(np.shape(dfd))
+    for k in range(problem.num_blade_segments):
+        chord = problem.mchord[0][k]
+        problem.mchord[0][k] = Constant(float(chord)+h)
+        force_plus = alm_force(problem)
+        problem.mchord[0][k] = Constant(float(chord)-h)
+        force_minus = alm_force(problem)
+        problem.mchord[0][k] = chord
+        fd[:, k] = (force_plus-force_minus)/(2.0*h)
+
+    assert np.max(np.abs(fd)) > 0.0
+    assert np.max(np.abs(dfd-fd)) <= 1e-6*np.max(np.abs(fd))
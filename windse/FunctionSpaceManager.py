@@ -40,6 +40,8 @@ class GenericFunctionSpace(object):
 
         if self.turbine_space == "Quadrature" and (self.turbine_degree != self.quadrature_degree):
             raise ValueError("When using the numpy representation with the 'Quadrature' space, the turbine degree and quadrature degree must be equal.")
+        if self.turbine_method == "numpy" and self.turbine_space == "Quadrature" and self.quadrature_turbine not in [None,"auto"] and int(self.quadrature_turbine) != self.turbine_degree:
+            raise ValueError("When using the numpy representation with the 'Quadrature' space, quadrature_turbine must be Null, auto, or equal to the turbine degree.")
 
     def SetupSubspaces(self):
         self.V = self.W.sub(0).collapse()
@@ -60,8 +62,62 @@ class GenericFunctionSpace(object):
             tf_V = VectorElement(self.turbine_space,self.mesh.ufl_cell(),degree=self.turbine_degree,quad_scheme="default")
             self.tf_V = FunctionSpace(self.mesh, tf_V)
             self.tf_V0 = self.tf_V.sub(0).collapse() 
+            self.tf_coordinates = None
+            self.tf_dof_index = None
+            self.tf_disk_cache = None
             self.fprint("Quadrature DOFS: {:d}".format(self.tf_V.dim()))
 
+    def QuadratureDegree(self,term,turbulence_model=None):
+        """
+        Returns the quadrature degree used to integrate one group of terms in
+        the variational problem, which is set by the quadrature_<term>
+        parameter. Null uses quadrature_degree, and "auto" estimates the
+        polynomial degree of the integrand from the element degrees. The
+        turbine kernels are not polynomial, so the auto degree of the
+        turbine term is only lowered when the force is a Function in the
+        velocity space.
+
+        Args:
+            term (str): one of "base", "turbulence", "stabilization", or "turbine"
+            turbulence_model (str): the turbulence model of the problem
+
+        Returns:
+            degree (int): the quadrature degree
+        """
+        degree = getattr(self,"quadrature_"+term)
+        if degree is None:
+            return self.quadrature_degree
+        elif degree != "auto":
+            return int(degree)
+
+        ### Polynomial degrees of the velocity and pressure ###
+        p = self.V.ufl_element().degree()
+        p_q = self.Q.ufl_element().degree()
+
+        if term == "base":
+            # convection inner(grad(u)*u,v) dominates the diffusion and pressure terms
+            degree = max(3*p-1,(p-1)+p_q,2*p-2)
+        elif term == "turbulence":
+            # nu_T*inner(grad(u),grad(v)) with nu_T ~ l_mix**2*|grad(u)|
+            degree = 3*(p-1)
+            if turbulence_model == "mixing_length":
+                degree += 2*p_q
+        elif term == "stabilization":
+            # eps*inner(grad(q),grad(p)) and eps*inner(grad(q),grad(u)*u)
+            degree = max(2*(p_q-1),(p_q-1)+(p-1)+p)
+        elif term == "turbine":
+            if self.turbine_method == "numpy":
+                # the quadrature space has to be integrated at its own degree
+                degree = self.turbine_degree
+            elif self.turbine_method in ["alm","rotating_disk","disabled"]:
+                degree = 2*p
+            else:
+                degree = self.quadrature_degree
+        else:
+            raise ValueError("Unknown quadrature term: "+term)
+
+        return max(int(degree),1)
+
     def DebugOutput(self):
         if self.debug_mode:
             self.tag_output("velocity_dofs",self.V.dim())
@@ -277,7 +277,7 @@ class Optimizer(object):
 
         self.fprint("Define Optimizing Functional")
         self.J = self.solver.J
-        self.Jhat = ReducedFunctional(self.J, self.controls, eval_cb_post=self.ReducedFunctionalCallback)
+        self.Jhat = ReducedFunctional(self.J, self.controls, eval_cb_pre=self.ReducedFunctionalPreCallback, eval_cb_post=self.ReducedFunctionalCallback)
 
         self.Jcurrent = self.J
 
@@ -315,10 +315,20 @@ class Optimizer(object):
     def RecomputeReducedFunctional(self):
         self.CreateControls()
         self.J = self.solver.J
-        self.Jhat = ReducedFunctional(self.J, self.controls, eval_cb_post=self.ReducedFunctionalCallback)
+        self.Jhat = ReducedFunctional(self.J, self.controls, eval_cb_pre=self.ReducedFunctionalPreCallback, eval_cb_post=self.ReducedFunctionalCallback)
 
         self.Jcurrent = self.J
 
+    def ReducedFunctionalPreCallback(self, m):
+        ### Move the turbine force markers with the turbines before the tape is replayed ###
+        if "layout" in self.control_types and self.problem.turbine_markers is not None:
+            m_f = np.array(m if isinstance(m,(list,tuple)) else [m],dtype=float)
+            x = np.array(self.farm.mx,dtype=float)
+            y = np.array(self.farm.my,dtype=float)
+            x[list(self.solver.opt_turb_id)] = m_f[self.indexes[0]]
+            y[list(self.solver.opt_turb_id)] = m_f[self.indexes[1]]
+            self.problem.UpdateTurbineMarkers(x=x,y=y)
+
     def ReducedFunctionalCallback(self, j, m):
         self.Jcurrent = j 
 
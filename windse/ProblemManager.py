@@ -18,10 +18,10 @@ if not main_file in ["sphinx-build", "__main__.py"]:
     import numpy as np
     import time
     import scipy.interpolate as interp
-    import glob
 
     ### Import the cumulative parameters ###
     from windse import windse_parameters
+    from windse.helper_functions import LoadAirfoilPolars, BladeSegmentFractions, ActuatorLineHistory
     # from memory_profiler import memory_usage
 
     ### Check if we need dolfin_adjoint ###
@@ -46,6 +46,7 @@ class GenericProblem(object):
         self.fs   = function_space 
         self.bd  = boundary_data
         self.tf_first_save = True
+        self.turbine_markers = None
         self.fprint = self.params.fprint
         self.tag_output = self.params.tag_output
         self.debug_mode = self.params.debug_mode
@@ -80,7 +81,7 @@ class GenericProblem(object):
                 self.tag_output("int_tf_z", int_tf_z)
 
 
-            if self.farm.turbine_method == 'alm':
+            if self.farm.turbine_method in ['alm', 'rotating_disk']:
                 self.tag_output("min_chord", np.min(self.chord))
                 self.tag_output("max_chord", np.max(self.chord))
                 self.tag_output("avg_chord", np.mean(self.chord))
@@ -114,7 +115,7 @@ class GenericProblem(object):
             self.tf1, self.tf2, self.tf3 = self.farm.NumpyTurbineForce(self.fs,self.dom.mesh,inflow_angle=inflow_angle)
             tf = -(self.tf1*u[0]**2+self.tf2*u[1]**2+self.tf3*u[0]*u[1]) #negative or otherwise we get jets
 
-        elif self.farm.turbine_method == 'alm':
+        elif self.farm.turbine_method in ['alm', 'rotating_disk']:
             self.rpm = self.params["wind_farm"]["rpm"]
 
             hmin = self.dom.mesh.hmin()/np.sqrt(3)
@@ -130,13 +131,37 @@ class GenericProblem(object):
 
             # self.num_blade_segments = 10
             # self.num_blade_segments = int(10.0*self.farm.radius[0]/hmin)
-            if self.farm.blade_segments == "computed":
+            if not isinstance(self.farm.blade_spacing, str):
+                # Explicit radial stations set the number of segments
+                self.num_blade_segments = len(self.farm.blade_spacing)
+                self.farm.blade_segments = self.num_blade_segments
+            elif self.farm.blade_segments == "computed":
                 self.num_blade_segments = int(2.0*self.farm.radius[0]/self.gaussian_width)
                 self.farm.blade_segments = self.num_blade_segments
             else:
                 self.num_blade_segments = self.farm.blade_segments
             self.fprint('Num blade segments: %d' % (self.num_blade_segments))
 
+            # Radial position of each actuator node as a fraction of the blade length
+            self.blade_fractions = BladeSegmentFractions(self.farm.blade_spacing, self.num_blade_segments)
+
+            # The rotating disk spreads the time-averaged load of the three blades over
+            # stationary blades placed around the rotor, so the timestep does not need to
+            # resolve the blade passage
+            if self.farm.turbine_method == 'rotating_disk':
+                if self.farm.disk_azimuths == "computed":
+                    self.num_blades = max(int(np.ceil(2.0*np.pi*self.farm.radius[0]/self.gaussian_width)), 3)
+                else:
+                    self.num_blades = int(self.farm.disk_azimuths)
+                self.blade_rotation = False
+                self.fprint('Num disk azimuths: %d' % (self.num_blades))
+            else:
+                self.num_blades = 3
+                self.blade_rotation = True
+
+            # Fraction of the load of a real blade carried by each modeled blade
+            self.blade_share = 3.0/self.num_blades
+
             self.mchord = []
             self.mtwist = []
             self.mcl = []
@@ -144,10 +169,8 @@ class GenericProblem(object):
 
             self.num_times_called = 0
             self.first_call_to_alm = True
-            self.blade_pos_previous = [[], [], []]
-            self.simTime_list = []
-            self.dt_list = []
-            self.rotor_torque_dolfin_time = []
+            self.blade_pos_previous = [[] for k in range(self.num_blades)]
+            self.alm_history = ActuatorLineHistory(self.farm.numturbs)
             self.simTime_id = 0
 
             ### create output files for alm data ###
@@ -160,72 +183,16 @@ class GenericProblem(object):
             self.aoa_files = []
             self.force_files = []
             for i in range(self.farm.numturbs):
-                self.aoa_files.append(aoa_folder+"aoa_turb_"+repr(i)+".csv")
+                self.aoa_files.append(aoa_folder+"aoa_turb_"+repr(i)+".npy")
                 temp = ["x","y","z"]
                 self.force_files.append([])
                 for j in range(3):
-                    self.force_files[i].append(force_folder+temp[j]+"_force_turb_"+repr(i)+".csv")
-
-                ### Create header for angle of attack 
-                fp = open(self.aoa_files[i], 'w')
-                fp.write('time, ')
-                for j in range(3):
-                    for k in range(self.num_blade_segments):
-                        fp.write('r%d_n%03d, ' % (j, k))
-                fp.write('\n')
-                fp.close()
-
-                ### Create header for force files ###
-                for dir_file in self.force_files[i]:
-                    fp = open(dir_file, 'w')
-                    fp.write('time, ')
-                    for j in range(3):
-                        for k in range(self.num_blade_segments):
-                            fp.write('r%d_n%03d, ' % (j, k))
-                    fp.write('\n')
-                    fp.close()
-
-            # Initialize the lift and drag files
-            for fn in ['lift', 'drag']:
-                fp = open('./output/%s/nodal_%s.csv' % (self.params.name, fn), 'w')
-                fp.write('sim_time, theta, ')
-
-                for j in range(self.num_blade_segments):
-                    if j < self.num_blade_segments-1:
-                        fp.write('%s_%02d, ' % (fn, j))
-                    else:
-                        fp.write('%s_%02d\n' % (fn, j))
-                fp.close()
+                    self.force_files[i].append(force_folder+temp[j]+"_force_turb_"+repr(i)+".npy")
 
             turb_data = self.params["wind_farm"]["read_turb_data"]
 
             if turb_data:
 
-                def build_lift_and_drag_tables(airfoil_data_path):
-
-                    # Determine the number of files in airfoil_data_path
-                    num_files = len(glob.glob('%s/*.txt' % (airfoil_data_path)))
-
-                    for file_id in range(num_files):
-                        # print('Reading Airfoil Data #%d' % (file_id))
-                        data = np.genfromtxt('%s/af_station_%d.txt' % (airfoil_data_path, file_id), skip_header=1, delimiter=' ')
-
-                        if file_id == 0:
-                            # If this is the first file, store the angle data
-                            interp_angles = data[:, 0]
-                            num_angles = np.size(interp_angles)
-                            
-                            # If this is the first file, allocate space for the tables        
-                            lift_table = np.zeros((num_angles, num_files))
-                            drag_table = np.zeros((num_angles, num_files))
-                            
-                        # Store all the lift and drag data in the file_id column
-                        lift_table[:, file_id] = data[:, 1]
-                        drag_table[:, file_id] = data[:, 2]
-
-                    return lift_table, drag_table, interp_angles
-
-
                 self.fprint('Setting chord, lift, and drag from file \'%s\'' % (turb_data))
 
                 actual_turbine_data = np.genfromtxt(turb_data, delimiter = ',', skip_header = 1)
@@ -241,11 +208,16 @@ class GenericProblem(object):
                 actual_cd = actual_turbine_data[:, 4]
 
 
-                lift_table, drag_table, interp_angles = build_lift_and_drag_tables('airfoil_polars')
+                lift_table, drag_table, interp_angles = LoadAirfoilPolars('airfoil_polars', self.params.comm, self.params.rank, self.params["wind_farm"]["alm_polar_cache"])
                 self.lift_table = lift_table
                 self.drag_table = drag_table
                 self.interp_angles = interp_angles
 
+                # Build the lift-drag table interpolators now instead of inside the first alm step
+                rdim_all = np.linspace(0, self.farm.radius[0], np.shape(self.lift_table)[1])
+                self.interp_lift = interp.RectBivariateSpline(self.interp_angles, rdim_all, self.lift_table)
+                self.interp_drag = interp.RectBivariateSpline(self.interp_angles, rdim_all, self.drag_table)
+
 
                 modify_chord = False
 
@@ -370,7 +342,7 @@ class GenericProblem(object):
                     chord_interp_override = interp.interp1d(actual_x_override, actual_chord_override)
 
                 # Construct the points at which to generate interpolated values
-                interp_points = np.linspace(0.0, 1.0, self.num_blade_segments)
+                interp_points = self.blade_fractions
 
                 # Generate the interpolated values
                 chord = chord_interp(interp_points)
@@ -428,9 +400,77 @@ class GenericProblem(object):
 
         else:
             raise ValueError("Unknown turbine method: "+self.farm.turbine_method)
+
+        ### Integrate the dolfin turbine force only over the cells near the turbines ###
+        metadata = {"quadrature_degree": self.fs.QuadratureDegree("turbine")}
+        self.tf_dx = dx(metadata=metadata)
+        if self.farm.turbine_method == "dolfin" and self.farm.numturbs > 0 and self.farm.turbine_support is not None:
+            self.UpdateTurbineMarkers()
+            self.tf_dx = dx(1, domain=self.dom.mesh, subdomain_data=self.turbine_markers, metadata=metadata)
         
         return tf
 
+    def SetupQuadrature(self):
+        """
+        Creates the measures for each group of terms in the functional so
+        that only the terms that need it pay for a high quadrature degree,
+        see :meth:`windse.FunctionSpaceManager.GenericFunctionSpace.QuadratureDegree`.
+        The turbine measure is made along with the turbine force.
+        """
+        self.dx_base = dx(metadata={"quadrature_degree": self.fs.QuadratureDegree("base")})
+        self.dx_turbulence = dx(metadata={"quadrature_degree": self.fs.QuadratureDegree("turbulence",self.turbulence_model)})
+        self.dx_stabilization = dx(metadata={"quadrature_degree": self.fs.QuadratureDegree("stabilization")})
+
+        self.fprint("Quadrature Degrees:        base {:d}, turbulence {:d}, stabilization {:d}, turbine {:d}".format(
+                    self.dx_base.metadata()["quadrature_degree"],
+                    self.dx_turbulence.metadata()["quadrature_degree"],
+                    self.dx_stabilization.metadata()["quadrature_degree"],
+                    self.fs.QuadratureDegree("turbine")))
+
+    def UpdateTurbineMarkers(self,x=None,y=None):
+        """
+        Marks the cells that overlap the box around each turbine with 1 so
+        that the turbine force only needs to be integrated there. The box
+        has a half width of turbine_support kernel widths, where the
+        kernel width is the larger of the rotor radius and the disk
+        thickness, so the tail of the kernel is not clipped along either
+        axis.
+        The markers are changed in place, so forms already built with
+        them pick up moved turbines.
+
+        Args:
+            x (list): the x locations of the turbines, the farm's if None
+            y (list): the y locations of the turbines, the farm's if None
+        """
+        mesh = self.dom.mesh
+        dim = self.dom.dim
+        if self.turbine_markers is None or self.turbine_markers.mesh().id() != mesh.id():
+            self.turbine_markers = MeshFunction("size_t", mesh, dim, 0)
+
+        ### Get the turbine boxes, following the ground under moved turbines ###
+        if x is None:
+            x = self.farm.mx
+        if y is None:
+            y = self.farm.my
+        x = np.array(x,dtype=float)
+        y = np.array(y,dtype=float)
+        z = [self.dom.Ground(x[i],y[i])+float(self.farm.HH[i]) for i in range(self.farm.numturbs)]
+        center = np.array([x,y,z],dtype=float)[:dim].T
+        kernel_width = np.maximum(np.array(self.farm.RD,dtype=float)/2.0,np.array(self.farm.thickness,dtype=float))
+        half_width = float(self.farm.turbine_support)*kernel_width*np.ones(self.farm.numturbs)
+
+        ### Mark every cell whose bounding box overlaps a turbine box ###
+        cell_coords = mesh.coordinates()[mesh.cells()]
+        cell_min = np.min(cell_coords,axis=1)
+        cell_max = np.max(cell_coords,axis=1)
+        marked = np.zeros(len(cell_coords),dtype=bool)
+        for i in range(self.farm.numturbs):
+            lower = center[i]-half_width[i]
+            upper = center[i]+half_width[i]
+            marked |= np.logical_and(np.all(cell_max > lower,axis=1),np.all(cell_min < upper,axis=1))
+
+        self.turbine_markers.array()[:] = marked
+
     def ComputeTurbulenceModel(self, u):
         self.fprint(f"Using Turbulence Model: {self.turbulence_model}")
         if self.turbulence_model is not None:
@@ -610,12 +650,15 @@ class StabilizedProblem(GenericProblem):
         self.ReyStress=self.nu_T*grad(self.u_k)
         self.vertKE= self.ReyStress[0,2]*self.u_k[0]
 
+        ### Set the quadrature degree of each group of terms ###
+        self.SetupQuadrature()
+
         ### Create the functional ###
         # if self.farm.yaw[0]**2 > 1e-4:
         #     self.F = inner(grad(self.u_k)*self.u_k, v)*dx + (nu+self.nu_T)*inner(grad(self.u_k), grad(v))*dx - inner(div(v),self.p_k)*dx - inner(div(self.u_k),q)*dx - inner(f,v)*dx - inner(self.tf,v)*dx 
         # else :
         # self.F = inner(grad(self.u_k)*self.u_k, v)*dx + Sx*Sx*inner(grad(self.u_k), grad(v))*dx - inner(div(v),self.p_k)*dx - inner(div(self.u_k),q)*dx - inner(f,v)*dx# - inner(self.tf,v)*dx 
-        self.F = inner(grad(self.u_k)*self.u_k, v)*dx + Sx*Sx*(nu+self.nu_T)*inner(grad(self.u_k), grad(v))*dx - inner(div(v),self.p_k)*dx - inner(div(self.u_k),q)*dx - inner(f,v)*dx - inner(self.tf,v)*dx 
+        self.F = inner(grad(self.u_k)*self.u_k, v)*self.dx_base + Sx*Sx*nu*inner(grad(self.u_k), grad(v))*self.dx_base + Sx*Sx*self.nu_T*inner(grad(self.u_k), grad(v))*self.dx_turbulence - inner(div(v),self.p_k)*self.dx_base - inner(div(self.u_k),q)*self.dx_base - inner(f,v)*self.dx_base - inner(self.tf,v)*self.tf_dx 
         
         ################ THIS IS A CHEAT ####################
 
@@ -627,7 +670,7 @@ class StabilizedProblem(GenericProblem):
             extra_nu_T = extra_l_mix**2.*extra_S
             extra_DP =dot(self.bd.u0,grad(self.bd.u0)) - div((nu+extra_nu_T)*grad(self.bd.bc_velocity))
 
-            self.F += inner(extra_DP,v)*dx
+            self.F += inner(extra_DP,v)*self.dx_base
         ########################################################
 
         # self.F_sans_tf =  (1.0)*inner(grad(self.u_k), grad(v))*dx - inner(div(v),self.p_k)*dx - inner(div(self.u_k),q)*dx - inner(f,v)*dx
@@ -635,7 +678,7 @@ class StabilizedProblem(GenericProblem):
 
         ### Add in the Stabilizing term ###
         # stab = - eps*inner(grad(q), grad(self.p_k))*dx - eps*inner(grad(q), dot(grad(self.u_k), self.u_k))*dx 
-        stab = - eps*inner(grad(q), grad(self.p_k))*dx - eps*inner(grad(q), dot(grad(self.u_k), self.u_k))*dx 
+        stab = - eps*inner(grad(q), grad(self.p_k))*self.dx_stabilization - eps*inner(grad(q), dot(grad(self.u_k), self.u_k))*self.dx_stabilization 
         # stab_sans_tf = - eps*inner(grad(q), grad(self.p_k))*dx 
 
         self.F += stab
@@ -650,9 +693,9 @@ class StabilizedProblem(GenericProblem):
             dvdy = Dx(self.u_next[1], 1)
 
             if inflow_angle is None:
-                term25 = dvdy*q*dx
+                term25 = dvdy*q*self.dx_base
             else:
-                term25 = (abs(sin(inflow_angle))*dudx*q + abs(cos(inflow_angle))*dvdy*q)*dx
+                term25 = (abs(sin(inflow_angle))*dudx*q + abs(cos(inflow_angle))*dvdy*q)*self.dx_base
 
             self.F -= term25
 
@@ -704,8 +747,11 @@ class TaylorHoodProblem(GenericProblem):
         ### Create the turbine force ###
         self.tf = self.ComputeTurbineForce(self.u_k,inflow_angle)
 
+        ### Set the quadrature degree of each group of terms ###
+        self.SetupQuadrature()
+
         ### Create the functional ###
-        self.F = inner(grad(self.u_k)*self.u_k, v)*dx + (nu+self.nu_T)*inner(grad(self.u_k), grad(v))*dx - inner(div(v),self.p_k)*dx - inner(div(self.u_k),q)*dx - inner(f,v)*dx - inner(self.tf,v)*dx 
+        self.F = inner(grad(self.u_k)*self.u_k, v)*self.dx_base + nu*inner(grad(self.u_k), grad(v))*self.dx_base + self.nu_T*inner(grad(self.u_k), grad(v))*self.dx_turbulence - inner(div(v),self.p_k)*self.dx_base - inner(div(self.u_k),q)*self.dx_base - inner(f,v)*self.dx_base - inner(self.tf,v)*self.tf_dx 
 
         if self.use_25d_model:
             if self.dom.dim == 3:
@@ -716,9 +762,9 @@ class TaylorHoodProblem(GenericProblem):
             dvdy = Dx(self.u_k[1], 1)
 
             if inflow_angle is None:
-                term25 = dvdy*q*dx
+                term25 = dvdy*q*self.dx_base
             else:
-                term25 = (abs(sin(inflow_angle))*dudx*q + abs(cos(inflow_angle))*dvdy*q)*dx
+                term25 = (abs(sin(inflow_angle))*dudx*q + abs(cos(inflow_angle))*dvdy*q)*self.dx_base
 
             self.F -= term25
 
@@ -806,7 +852,7 @@ class IterativeSteady(GenericProblem):
         # Solve for u_hat, a velocity estimate which doesn't include pressure gradient effects
         F1 = inner(dot(self.u_k, nabla_grad(u)), v)*dx \
            + (nu+self.nu_T)*inner(grad(u), grad(v))*dx \
-           - inner(self.tf, v)*dx 
+           - inner(self.tf, v)*self.tf_dx 
 
         self.F1_lhs = lhs(F1)
         self.F1_rhs = rhs(F1)
@@ -823,7 +869,7 @@ class IterativeSteady(GenericProblem):
         # Solve for u_star, a predicted velocity which includes the pressure gradient
         F3 = inner(dot(self.u_k, nabla_grad(u)), v)*dx \
            + (nu+self.nu_T)*inner(grad(u), grad(v))*dx \
-           - inner(self.tf, v)*dx \
+           - inner(self.tf, v)*self.tf_dx \
            + inner(grad(self.p_k), v)*dx \
            + self.dt_1*inner(u - self.u_k, v)*dx
 
@@ -973,11 +1019,15 @@ class UnsteadyProblem(GenericProblem):
         #    + dot(nabla_grad(self.p_k1), v)*dx \
         #    - dot(self.tf, v)*dx
 
-        F1 = (1.0/self.dt_c)*inner(u - self.u_k1, v)*dx \
-           + inner(dot(U_AB, nabla_grad(U_CN)), v)*dx \
-           + (nu_c+self.nu_T)*inner(grad(U_CN), grad(v))*dx \
-           + inner(grad(self.p_k1), v)*dx \
-           - dot(self.tf, v)*dx
+        ### Set the quadrature degree of each group of terms ###
+        self.SetupQuadrature()
+
+        F1 = (1.0/self.dt_c)*inner(u - self.u_k1, v)*self.dx_base \
+           + inner(dot(U_AB, nabla_grad(U_CN)), v)*self.dx_base \
+           + nu_c*inner(grad(U_CN), grad(v))*self.dx_base \
+           + self.nu_T*inner(grad(U_CN), grad(v))*self.dx_turbulence \
+           + inner(grad(self.p_k1), v)*self.dx_base \
+           - dot(self.tf, v)*self.tf_dx
 
         self.a1 = lhs(F1)
         self.L1 = rhs(F1)
@@ -985,8 +1035,8 @@ class UnsteadyProblem(GenericProblem):
         # Define variational problem for step 2: pressure correction
         # self.a2 = dot(nabla_grad(p), nabla_grad(q))*dx
         # self.L2 = dot(nabla_grad(self.p_k1), nabla_grad(q))*dx - (1.0/self.dt_c)*div(self.u_k)*q*dx
-        self.a2 = inner(grad(p), grad(q))*dx
-        self.L2 = inner(grad(self.p_k1), grad(q))*dx - (1.0/self.dt_c)*div(self.u_k)*q*dx
+        self.a2 = inner(grad(p), grad(q))*self.dx_base
+        self.L2 = inner(grad(self.p_k1), grad(q))*self.dx_base - (1.0/self.dt_c)*div(self.u_k)*q*self.dx_base
 
         # phi = p - self.p_k
         # F2 = inner(grad(q), grad(phi))*dx - (1.0/self.dt_c)*div(u_k)*q*dx
@@ -996,8 +1046,8 @@ class UnsteadyProblem(GenericProblem):
         # Define variational problem for step 3: velocity update
         # self.a3 = dot(u, v)*dx
         # self.L3 = dot(self.u_k, v)*dx - self.dt_c*dot(nabla_grad(self.p_k - self.p_k1), v)*dx
-        self.a3 = inner(u, v)*dx
-        self.L3 = inner(self.u_k, v)*dx - self.dt_c*inner(grad(self.p_k - self.p_k1), v)*dx
+        self.a3 = inner(u, v)*self.dx_base
+        self.L3 = inner(self.u_k, v)*self.dx_base - self.dt_c*inner(grad(self.p_k - self.p_k1), v)*self.dx_base
 
         # F3 = inner(u, v)*dx - inner(self.u_k, v)*dx + self.dt_c*inner(phi, v)*dx
         # self.a3 = lhs(F3)
@@ -935,6 +935,7 @@ class UnsteadySolver(GenericSolver):
         simIter = 0
         stable = False
 
+        # Only the moving blades of the alm limit the timestep, the rotating disk blades stay put
         if self.problem.farm.turbine_method == "alm":
             tip_speed = self.problem.rpm*2.0*np.pi*self.problem.farm.radius[0]/60.0
         else:
@@ -1028,7 +1029,7 @@ class UnsteadySolver(GenericSolver):
 
             # Update the turbine force
             tic = time.time()
-            if self.problem.farm.turbine_method == "alm":
+            if self.problem.farm.turbine_method in ["alm", "rotating_disk"]:
                 # t1 = time.time()
                 pr.enable()
                 new_tf_list = self.problem.farm.CalculateActuatorLineTurbineForces(self.problem, self.simTime)
@@ -1157,6 +1158,9 @@ class UnsteadySolver(GenericSolver):
             self.fprint("%8.2f | %7.2f | %5.2f" % (self.simTime, self.problem.dt, u_max))
             simIter+=1
 
+        if self.problem.farm.turbine_method in ["alm", "rotating_disk"]:
+            self.problem.alm_diagnostics.Finalize()
+
         if self.pseudo_steady:
             self.J = self.EvaluateObjective()
 
@@ -1206,7 +1210,7 @@ class UnsteadySolver(GenericSolver):
         self.DebugOutput(simTime,simIter)
         ### TODO THIS NEED TO BE CLEAN TO ACCOUNT FOR DISKS
 
-        if self.problem.farm.turbine_method == "alm":
+        if self.problem.farm.turbine_method in ["alm", "rotating_disk"]:
             if hasattr(self.problem,"tf_save"):
                 self.problem.tf_save.vector()[:] = 0
                 for fun in self.problem.tf_list:
@@ -22,9 +22,11 @@ if not main_file in ["sphinx-build", "__main__.py"]:
     import shutil, copy
     from scipy.special import gamma
     import scipy.interpolate as interp
+    from scipy.spatial import cKDTree
 
     ### Import the cumulative parameters ###
     from windse import windse_parameters, BaseHeight, CalculateDiskTurbineForces, UpdateActuatorLineForce, RadialChordForce
+    from windse.helper_functions import ActuatorLineDiagnostics, ActuatorLineWorkspace, UpdateActuatorLineForces, AdvanceActuatorLineForces, SparseActuatorDisks
 
     ### Check if we need dolfin_adjoint ###
     if windse_parameters.dolfin_adjoint:
@@ -362,7 +364,7 @@ class GenericWindFarm(object):
             self.ground[i] = self.z[i] - self.HH[i]       
 
             # Update blade level controls
-            if self.turbine_method == "alm" or self.force == "chord": 
+            if self.turbine_method in ["alm", "rotating_disk"] or self.force == "chord": 
                 for k in range(self.num_blade_segments):
                     self.mcl[i][k] = Constant(self.cl[i][k])
                     self.mcd[i][k] = Constant(self.cd[i][k])
@@ -843,14 +845,19 @@ class GenericWindFarm(object):
         self.fprint("Using a Numpy Representation")
 
         self.inflow_angle = inflow_angle
-        x = fs.tf_V0.tabulate_dof_coordinates().T
+
+        ### Tabulate the dof coordinates once per mesh ###
+        if fs.tf_coordinates is None:
+            fs.tf_coordinates = fs.tf_V0.tabulate_dof_coordinates().T
+        x = fs.tf_coordinates
         [tf1, tf2, tf3], sparse_ids, actuator_array = CalculateDiskTurbineForces(x, self, fs, save_actuators=True)
 
         self.fprint("Turbine Force Space:  {}".format(fs.turbine_space))
         self.fprint("Turbine Force Degree: {:d}".format(fs.turbine_degree))
         self.fprint("Quadrature DOFS:      {:d}".format(fs.tf_V.dim()))
-        self.fprint("Turbine DOFs:         {:d}".format(len(sparse_ids)))
-        self.fprint("Compression:          {:1.4f} %".format(len(sparse_ids)/fs.tf_V.dim()*100))
+        num_sparse_ids = len(np.unique(np.concatenate(sparse_ids)))
+        self.fprint("Turbine DOFs:         {:d}".format(num_sparse_ids))
+        self.fprint("Compression:          {:1.4f} %".format(num_sparse_ids/fs.tf_V.dim()*100))
 
         ### Rename for Identification ###
         tf1.rename("tf1","tf1")
@@ -860,15 +867,12 @@ class GenericWindFarm(object):
         ### Construct the actuator disks for post processing ###
         # self.actuator_disks_list = actuator_disks
         self.actuator_disks = Function(fs.tf_V)
-        self.actuator_disks.vector()[:] = np.sum(actuator_array,axis=1)
+        self.actuator_disks.vector()[:] = np.asarray(actuator_array.sum(axis=0)).ravel()
         self.fprint("Projecting Turbine Force")
         self.actuator_disks = project(self.actuator_disks,fs.V,solver_type='mumps',form_compiler_parameters={'quadrature_degree': fs.turbine_degree},**self.extra_kwarg)
         
-        self.actuator_disks_list = []
-        for i in range(self.numturbs):
-            temp = Function(fs.tf_V)
-            temp.vector()[:] = np.array(actuator_array[:,i])
-            self.actuator_disks_list.append(temp)
+        ### Only keep the dofs of each turbine, tf1, tf2, and tf3 stay full size for the variational form ###
+        self.actuator_disks_list = SparseActuatorDisks(actuator_array,fs.tf_V)
 
         tf_stop = time.time()
         self.fprint("Turbine Force Calculated: {:1.2f} s".format(tf_stop-tf_start),special="footer")
@@ -1051,21 +1055,19 @@ class GenericWindFarm(object):
 
             # Create unit-length blade 1, oriented along the positive y-axis
             blade_1_pos = np.vstack((np.zeros(problem.num_blade_segments),
-                                     np.linspace(0.0, 1.0, problem.num_blade_segments),
+                                     problem.blade_fractions,
                                      np.zeros(problem.num_blade_segments)))
 
+            # Create the other unit-length blades, evenly spaced around the x-axis
+            # (120* and 240* for the three blades of the alm)
+            blade_pos_list = [blade_1_pos]
+            for k in range(1, problem.num_blades):
+                theta_k = k*360.0/problem.num_blades/180.0*np.pi
+                blade_pos_list.append(np.dot(rot_x(theta_k), blade_1_pos))
 
-            # Create unit-length blade 2, rotated 120* around the x-axis
-            theta_2 = 120.0/180.0*np.pi
-            blade_2_pos = np.dot(rot_x(theta_2), blade_1_pos)
-
-            # Create unit-length blade 3, rotated 240* around the x-axis
-            theta_3 = 240.0/180.0*np.pi
-            blade_3_pos = np.dot(rot_x(theta_3), blade_1_pos)
-
-            # Combine all the blades into a single array, dim = [3, num_blade_segments*3]
+            # Combine all the blades into a single array, dim = [3, num_blade_segments*num_blades]
             # This should be shared with updateActuatorLineForce
-            problem.blade_pos_base = np.hstack((blade_1_pos, blade_2_pos, blade_3_pos))
+            problem.blade_pos_base = np.hstack(blade_pos_list)
 
             # Get the coordinates of the vector function space
             coords = problem.fs.V.tabulate_dof_coordinates()
@@ -1076,8 +1078,35 @@ class GenericWindFarm(object):
             # Resape a linear copy of the coordinates for every mesh point
             problem.coordsLinear = np.copy(coords.reshape(-1, 1))
 
+            # Build a KD-tree over the coordinates so each actuator node only needs to
+            # evaluate its Gaussian kernel at the nearby mesh points
+            problem.coords_tree = cKDTree(coords)
+
             bbox = problem.dom.mesh.bounding_box_tree()
 
+            # Cache the mesh data used to probe the velocity at the actuator nodes, the cell
+            # containing each node is remembered between steps (-1 means not on this rank)
+            problem.probe_tree = bbox
+            problem.probe_cells = -np.ones(problem.farm.numturbs*problem.num_blades*problem.num_blade_segments, dtype=int)
+            problem.probe_global_dofs = problem.fs.V.dofmap().tabulate_local_to_global_dofs()
+            problem.probe_mesh_bounds = [np.min(problem.dom.mesh.coordinates(), axis=0), np.max(problem.dom.mesh.coordinates(), axis=0)]
+
+            # Nodes that leave their cell are first tested against the cells with the nearest centers,
+            # a node farther than probe_cell_radius from every center is not on this rank
+            problem.probe_cell_coords = problem.dom.mesh.coordinates()[problem.dom.mesh.cells()]
+            cell_centers = np.mean(problem.probe_cell_coords, axis=1)
+            problem.probe_center_tree = cKDTree(cell_centers)
+            problem.probe_num_near = min(16, len(cell_centers))
+            problem.probe_cell_radius = 0.0
+            if len(cell_centers) > 0:
+                problem.probe_cell_radius = np.max(np.linalg.norm(problem.probe_cell_coords - cell_centers[:, np.newaxis, :], axis=2))
+
+            # The dofs of the cell holding each node, only looked up again when the node changes cell
+            problem.probe_dofs = np.zeros((len(problem.probe_cells), problem.fs.V.element().space_dimension()), dtype=np.intc)
+
+            # The basis functions of linear Lagrange elements are the barycentric coordinates of the node
+            problem.probe_linear = problem.fs.V.ufl_element().family() == "Lagrange" and problem.fs.V.ufl_element().degree() == 1
+
             problem.min_dist = []
 
             for k in range(problem.farm.numturbs):
@@ -1085,8 +1114,32 @@ class GenericWindFarm(object):
                 min_dist_node_id, dist = bbox.compute_closest_entity(turbine_loc_point)
                 problem.min_dist.append(dist)
 
+            # The lowest rank close enough to compute a turbine is the one that records its diagnostics
+            local_owner = np.zeros(problem.farm.numturbs)
+            for k in range(problem.farm.numturbs):
+                if problem.min_dist[k] > 2.0*(2.0*problem.farm.radius[k]):
+                    local_owner[k] = self.params.num_procs
+                else:
+                    local_owner[k] = self.params.rank
+
+            data_in_owner = np.zeros((self.params.num_procs, problem.farm.numturbs))
+            self.params.comm.Gather(local_owner, data_in_owner, root=0)
+
+            if self.params.rank == 0:
+                local_owner = np.min(data_in_owner, axis=0)
+
+            self.params.comm.Bcast(local_owner, root=0)
+            problem.alm_owner_rank = local_owner
+
+            problem.alm_diagnostics = ActuatorLineDiagnostics(problem.aoa_files, problem.force_files, problem.alm_owner_rank, self.params.rank,
+                                                              problem.num_blades*problem.num_blade_segments, self.alm_output_interval,
+                                                              convert_csv=self.alm_output_csv, num_blades=problem.num_blades)
+
+            # Preallocate the buffers and blade geometry reused by every alm evaluation
+            problem.alm_workspace = ActuatorLineWorkspace(problem, num_blades=problem.num_blades)
+
             # Create a Constant "wrapper" to enable dolfin to track mpi_u_fluid
-            problem.mpi_u_fluid_constant = Constant(np.zeros((problem.farm.numturbs, 3*3*problem.num_blade_segments)),name="mpi_u_fluid")
+            problem.mpi_u_fluid_constant = Constant(np.zeros((problem.farm.numturbs, 3*problem.num_blades*problem.num_blade_segments)),name="mpi_u_fluid")
 
 
         def init_unsteady_alm_terms(problem):
@@ -1096,32 +1149,107 @@ class GenericWindFarm(object):
             problem.rotor_torque_dolfin = np.zeros(problem.farm.numturbs)
 
 
-        def init_mpi_alm(problem):
+        def probe_velocity(problem, points):
+            # points is [numPoints x 3], returns the velocity at each point [numPoints x 3]
+            # and how many ranks found it [numPoints]
+            mesh = problem.dom.mesh
+            element = problem.fs.V.element()
+            dofmap = problem.fs.V.dofmap()
+            cells = problem.probe_cells
+            num_points = np.shape(points)[0]
+            num_cells = mesh.num_cells()
+
+            def barycentric(cell_ids, cell_points):
+                # Barycentric coordinates of each point in its cell, [numPoints x num_vertices]
+                verts = problem.probe_cell_coords[cell_ids]
+                edges = np.transpose(verts[:, 1:, :] - verts[:, 0:1, :], (0, 2, 1))
+                bary = np.linalg.solve(edges, (cell_points - verts[:, 0, :])[:, :, np.newaxis])[:, :, 0]
+                return np.column_stack((1.0 - np.sum(bary, axis=1), bary))
+
+            # Check all the cached cells at once
+            cached = np.where(cells >= 0)[0]
+            if len(cached) > 0:
+                inside = np.all(barycentric(cells[cached], points[cached]) >= -1e-12, axis=1)
+                cells[cached[~inside]] = -1
+
+            # Only search for uncached nodes that fall inside this rank's portion of the mesh
+            in_bounds = np.all((points >= problem.probe_mesh_bounds[0]) & (points <= problem.probe_mesh_bounds[1]), axis=1)
+            moved = np.where((cells < 0) & in_bounds)[0]
+            if len(moved) > 0 and num_cells > 0:
+                # Test the cells with the nearest centers of every moved node in a single batch
+                num_near = problem.probe_num_near
+                dist, near = problem.probe_center_tree.query(points[moved], k=num_near)
+                dist = dist.reshape(len(moved), num_near)
+                near = near.reshape(len(moved), num_near)
+                inside = np.all(barycentric(near.reshape(-1), np.repeat(points[moved], num_near, axis=0)) >= -1e-12, axis=1)
+                inside = inside.reshape(len(moved), num_near)
+                found = np.any(inside, axis=1)
+                cells[moved[found]] = near[found, np.argmax(inside[found], axis=1)]
+
+                # Only the rare node that could still be inside a cell further away falls back on the tree
+                for j in moved[~found & (dist[:, 0] <= problem.probe_cell_radius)]:
+                    cell_id = problem.probe_tree.compute_first_entity_collisions(Point(*points[j]))
+                    if cell_id < num_cells:
+                        cells[j] = cell_id
+
+                # Look up the dofs of the nodes that changed cell
+                for j in moved[cells[moved] >= 0]:
+                    problem.probe_dofs[j] = problem.probe_global_dofs[dofmap.cell_dofs(int(cells[j]))]
+
+            # Collect the coefficients of every located node in a single call
+            owned = np.where(cells >= 0)[0]
+            space_dim = element.space_dimension()
+            value_size = element.value_dimension(0)
+            coefficients = problem.u_k1.vector().gather(problem.probe_dofs[owned].reshape(-1)).reshape(len(owned), space_dim)
+
+            u_probe = np.zeros((num_points, value_size))
+            if problem.probe_linear:
+                # The dofs of a vector element are blocked by component, each weighted by the barycentric coordinates
+                bary = barycentric(cells[owned], points[owned])
+                u_probe[owned] = np.einsum('ncv,nv->nc', coefficients.reshape(len(owned), value_size, -1), bary)
+            else:
+                # Higher order elements evaluate their basis functions node by node
+                basis = np.zeros((len(owned), space_dim, value_size))
+                for n, j in enumerate(owned):
+                    cell = Cell(mesh, int(cells[j]))
+                    basis_all = element.evaluate_basis_all(points[j], cell.get_vertex_coordinates(), cell.orientation())
+                    basis[n] = basis_all.reshape(space_dim, value_size)
+                u_probe[owned] = np.einsum('nij,ni->nj', basis, coefficients)
+
+            u_count = np.zeros(num_points)
+            u_count[owned] = 1.0
+
+            return u_probe, u_count
 
-            # Create an empty array to hold all the components of velocity
-            mpi_u_fluid = np.zeros((problem.farm.numturbs, 3*3*problem.num_blade_segments))
-            mpi_u_fluid_count = np.zeros((problem.farm.numturbs, 3*3*problem.num_blade_segments))
+        def init_mpi_alm(problem):
 
             # Calculate the angular position of the blades at the current time
             period = 60.0/problem.rpm
             # theta = (simTime+0.5*problem.dt)/period*2.0*np.pi
 
             # Current time at the end of the fluid solve
-            simTime = problem.simTime_list[problem.simTime_id]
+            simTime = problem.alm_history.Time(problem.simTime_id)
 
 
             # Time at the end of the previous fluid solve
             time_offset = 1
 
             try:
-                prevTime = problem.simTime_list[problem.simTime_id - time_offset]
+                prevTime = problem.alm_history.Time(problem.simTime_id - time_offset)
             except:
-                prevTime = problem.simTime_list[0]
+                prevTime = problem.alm_history.Time(0)
 
             # The velocity should be probed at the time location midway between this
             # step and the previous step
             theta = 0.5*(prevTime + simTime)/period*2.0*np.pi
 
+            # The blades of the rotating disk stay put
+            if not problem.blade_rotation:
+                theta = 0.0
+
+            # Collect the position of every actuator node, [numturbs x num_blades*num_blade_segments x 3]
+            points = np.zeros((problem.farm.numturbs, problem.num_blades*problem.num_blade_segments, 3))
+
             # Each turbine must be treated individually to account for varying 
             # radii, heights, positions, etc.
             for k in range(problem.farm.numturbs):
@@ -1141,52 +1269,30 @@ class GenericWindFarm(object):
                 blade_pos = np.dot(rot_z(yaw), blade_pos)
 
                 # Get the position of this turbine and shift the blade positions there
-                x_pos = problem.farm.x[k]
-                y_pos = problem.farm.y[k]
-                z_pos = problem.farm.z[k]
-                blade_pos[0, :] += x_pos
-                blade_pos[1, :] += y_pos
-                blade_pos[2, :] += z_pos
-
-                # Need to probe the velocity point at each actuator node,
-                # where actuator nodes are individual columns of blade_pos
-                for j in range(np.shape(blade_pos)[1]):
-                    # If using the local velocity, measure at the blade
-                    if problem.farm.use_local_velocity:
-                        xi = blade_pos[0, j]
-                    else:
-                        xi = problem.dom.x_range[0]
-
-                    yi = blade_pos[1, j]
-                    zi = blade_pos[2, j]
-
-                    # Try to access the fluid velocity at this actuator point
-                    # If this rank doesn't own that point, an error will occur,
-                    # in which case zeros should be reported
-                    try:
-                        fn_val = problem.u_k1(np.array([xi, yi, zi]))
-                        mpi_u_fluid[k, 3*j:3*j+3] = fn_val
-                        mpi_u_fluid_count[k, 3*j:3*j+3] = [1, 1, 1]
-                    except:
-                        pass
-
-            data_in_fluid = np.zeros((self.params.num_procs, np.shape(mpi_u_fluid)[0], np.shape(mpi_u_fluid)[1]))
-            self.params.comm.Gather(mpi_u_fluid, data_in_fluid, root=0)
-
-            data_in_count = np.zeros((self.params.num_procs, np.shape(mpi_u_fluid_count)[0], np.shape(mpi_u_fluid_count)[1]))
-            self.params.comm.Gather(mpi_u_fluid_count, data_in_count, root=0)
+                blade_pos[0, :] += problem.farm.x[k]
+                blade_pos[1, :] += problem.farm.y[k]
+                blade_pos[2, :] += problem.farm.z[k]
 
-            if self.params.rank == 0:
-                mpi_u_fluid = np.sum(data_in_fluid, axis=0)
-                mpi_u_fluid_count = np.sum(data_in_count, axis=0)
+                # If not using the local velocity, measure at the inflow instead of at the blade
+                if not problem.farm.use_local_velocity:
+                    blade_pos[0, :] = problem.dom.x_range[0]
 
-                # This removes the possibility of a velocity shared between multiple nodes being reported
-                # multiple times and being effectively doubled (or worse) when summing mpi_u_fluid across processes
-                mpi_u_fluid = mpi_u_fluid/mpi_u_fluid_count
+                points[k] = blade_pos.T
 
-            self.params.comm.Bcast(mpi_u_fluid, root=0)
+            # Probe the fluid velocity at every actuator node owned by this rank
+            u_probe, u_count = probe_velocity(problem, points.reshape(-1, 3))
 
-            return mpi_u_fluid
+            # Combine the values and counts from every rank in a single reduction
+            mpi_buff = np.vstack((u_probe.T, u_count))
+            mpi_buff_sum = np.zeros(np.shape(mpi_buff))
+            self.params.comm.Allreduce(mpi_buff, mpi_buff_sum)
+
+            # This removes the possibility of a velocity shared between multiple nodes being reported
+            # multiple times and being effectively doubled (or worse) when summing across processes
+            u_count = np.maximum(mpi_buff_sum[-1], 1.0)
+            mpi_u_fluid = (mpi_buff_sum[:-1]/u_count).T
+
+            return mpi_u_fluid.reshape(problem.farm.numturbs, -1)
 
         # ================================================================
 
@@ -1218,9 +1324,7 @@ class GenericWindFarm(object):
         # ================================================================
 
         tic = time.time()
-        problem.simTime_list.append(simTime)
-        problem.dt_list.append(problem.dt)
-        problem.rotor_torque_dolfin_time.append(0.0)
+        problem.alm_history.Append(simTime, problem.dt)
 
         # If this is the first call to the function, set some things up before proceeding
         if problem.simTime_id == 0:
@@ -1229,18 +1333,30 @@ class GenericWindFarm(object):
         # Initialize summation, counting, etc., variables for alm solve
         init_unsteady_alm_terms(problem)
 
-        # Call the function to build the complete mpi_u_fluid array
-        mpi_u_fluid = init_mpi_alm(problem)
+        # Sub-cycled steps are never taped, and only run between full updates
+        subcycle = dfd is None and not self.params.dolfin_adjoint and problem.alm_workspace.Subcycle(problem.simTime_id, problem.dt)
 
-        # Populate the Constant "wrapper" with the velocity values to enable dolfin to track mpi_u_fluid
-        problem.mpi_u_fluid_constant.assign(Constant(mpi_u_fluid,name="temp_u_f"))
+        if subcycle:
+            # Rotate the loads held from the last full update instead of sampling the fluid
+            alm_output_list = AdvanceActuatorLineForces(problem, problem.simTime_id, problem.dt)
+
+        else:
+            # Call the function to build the complete mpi_u_fluid array
+            mpi_u_fluid = init_mpi_alm(problem)
 
-        # Call the ALM function for each turbine individually
-        alm_output_list = []
-        for turb_index in range(problem.farm.numturbs):
-            alm_output_list.append(UpdateActuatorLineForce(problem, problem.mpi_u_fluid_constant, problem.simTime_id, problem.dt, turb_index, dfd=dfd))
-            # alm_output_list.append(UpdateActuatorLineForce_deprecated(problem, problem.u_k1, problem.simTime_id, problem.dt, turb_index, mpi_u_fluid, dfd=dfd))
-            # print("tf   = "+repr(np.mean(alm_output_list[-1].vector()[:])))
+            # Populate the Constant "wrapper" with the velocity values to enable dolfin to track mpi_u_fluid
+            problem.mpi_u_fluid_constant.assign(Constant(mpi_u_fluid,name="temp_u_f"))
+
+            if dfd is None and not self.params.dolfin_adjoint:
+                # Nothing is being taped, so project the actuator nodes of all turbines together
+                alm_output_list = UpdateActuatorLineForces(problem, problem.mpi_u_fluid_constant, problem.simTime_id, problem.dt)
+
+            else:
+                # Call the ALM function for each turbine individually
+                alm_output_list = []
+                for turb_index in range(problem.farm.numturbs):
+                    alm_output_list.append(UpdateActuatorLineForce(problem, problem.mpi_u_fluid_constant, problem.simTime_id, problem.dt, turb_index, dfd=dfd))
+                    # print("tf   = "+repr(np.mean(alm_output_list[-1].vector()[:])))
 
         # Do some sharing of information when everything is finished
         finalize_mpi_alm(problem)
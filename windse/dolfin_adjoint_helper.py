@@ -188,30 +188,21 @@ class ActuatorDiskForceBlock(Block):
         self.old_x = np.array(self.farm.mx,dtype=float)
         self.old_y = np.array(self.farm.my,dtype=float)
 
-        ### map ids to vector ids ###
-        self.VectorSparseIDs()
-
     def __str__(self):
         return "ActuatorLineForceBlock"
 
     def CheckTurbineLocations(self,x,y):
         new_x = np.array(x,dtype=float)
         new_y = np.array(y,dtype=float)
-        moved = max(max(abs(new_x-self.old_x)),max(abs(new_y-self.old_y)))
+        moved = np.maximum(abs(new_x-self.old_x),abs(new_y-self.old_y))
         # print(moved,self.move_tol, moved > self.move_tol)
-        if moved > self.move_tol:
-            self.sparse_ids = None
+
+        ### Only the turbines that moved need their dofs found again ###
+        if self.sparse_ids is not None and any(moved > self.move_tol):
+            self.sparse_ids = [None if moved[i] > self.move_tol else ids for i, ids in enumerate(self.sparse_ids)]
         self.old_x = new_x
         self.old_y = new_y
 
-    def VectorSparseIDs(self):
-        self.all_ids = np.zeros(len(self.sparse_ids)*self.dim,dtype=int)
-        self.all_ids[0::self.dim] = self.dim*(self.sparse_ids)+0
-        self.all_ids[1::self.dim] = self.dim*(self.sparse_ids)+1
-        if self.dim == 3:
-            self.all_ids[2::self.dim] = self.dim*(self.sparse_ids)+2
-        self.all_ids = list(self.all_ids)
-
     def prepare_recompute_component(self, inputs, relevant_outputs):
         ### update the new controls inside the windfarm ###
         x = inputs[0::4]
@@ -243,19 +234,20 @@ class ActuatorDiskForceBlock(Block):
         ### determine if we need to recalculate sparse_ids ###
         self.CheckTurbineLocations(x,y)
 
-        prepared = {}
-        for name in self.control_types:
-            # pr = cProfile.Profile()
-            # pr.enable()
-            # print("calculating "+name+" derivatives")
-            prepared[name], self.sparse_ids, actuator_array = backend_CalculateDiskTurbineForces(self.x,self.farm,self.fs,dfd=name,sparse_ids=self.sparse_ids,sparse_RDs=self.sparse_RDs)
-            # pr.disable()
-            # pr.print_stats()
+        ### Differentiate with respect to every control type at once, [len(control_types)*numturbs x N*dim] ###
+        d_tfs, self.sparse_ids, actuator_array = backend_CalculateDiskTurbineForces(self.x,self.farm,self.fs,dfd=self.control_types,sparse_ids=self.sparse_ids,sparse_RDs=self.sparse_RDs)
 
-            # exit()
+        ### Apply the derivatives to the adjoint of tf1, tf2, and tf3 and sum over the ranks in one reduction ###
+        adj_output = np.zeros(len(self.control_types)*self.farm.numturbs, dtype=np.float64)
+        for i in range(3):
+            adj_output += d_tfs[i].dot(adj_inputs[i].get_local())
+        recv_buff = np.zeros(len(adj_output), dtype=np.float64)
+        self.farm.params.comm.Allreduce(adj_output, recv_buff)
 
-        ### map ids to vector ids ###
-        self.VectorSparseIDs()
+        ### Split the sensitivities back up by control type ###
+        prepared = {}
+        for k, name in enumerate(self.control_types):
+            prepared[name] = recv_buff[k*self.farm.numturbs:(k+1)*self.farm.numturbs]
 
         return prepared
 
@@ -264,18 +256,9 @@ class ActuatorDiskForceBlock(Block):
         ### Get the control type and turbine index ###
         name, turb_idx, _ = block_variable.tag
         print("Calculating Derivative: " +name+"_"+repr(turb_idx))
-        ### Apply derivative to previous in tape ###
-        adj_output = 0
-        for i in range(3):
-            adj_output += np.inner(adj_inputs[i].get_local(self.all_ids),prepared[name][i][:,turb_idx])
-
-        adj_output = np.float64(adj_output)
-        recv_buff = np.zeros(1, dtype=np.float64)
-        self.farm.params.comm.Allreduce(adj_output, recv_buff)
-        adj_output = recv_buff
 
-        # adj_output = dolfin.MPI.sum(dolfin.MPI.comm_world,adj_output)
-        return np.array(adj_output)
+        ### The derivative was already applied and reduced for all controls ###
+        return np.array(prepared[name][turb_idx:turb_idx+1])
 
 
 
@@ -371,7 +354,7 @@ class ControlUpdaterBlock(Block):
         # Add dependencies on the controls
         self.num_dependancies = 0
         for i in range(self.problem.farm.numturbs):
-            if self.farm.turbine_method == "alm" or self.farm.force == "chord": 
+            if self.farm.turbine_method in ["alm", "rotating_disk"] or self.farm.force == "chord": 
                 for j in range(self.problem.num_blade_segments):
                     self.farm.mcl[i][j].block_variable.tag = ("c_lift", i, j)
                     self.add_dependency(self.farm.mcl[i][j])
@@ -509,7 +492,7 @@ class ActuatorLineForceBlock(Block):
 
         self.problem = problem
         self.simTime_id = copy.copy(simTime_id)
-        self.simTime = self.problem.simTime_list[simTime_id]
+        self.simTime = self.problem.alm_history.Time(simTime_id)
         self.dt = dt
         self.turb_i = turb_i
         self.u_local = problem.u_k
@@ -606,11 +589,8 @@ class ActuatorLineForceBlock(Block):
         ### Calculate the exact current value of the objective function
         ### ONLY WORKS WITH ALM POWER OBJECTIVE AND ONE TURBINE 
         if self.simTime>=self.problem.record_time and self.problem.farm.numturbs==1:
-            t_ids = np.logical_and(np.array(self.problem.simTime_list)>=self.problem.record_time,np.array(self.problem.simTime_list)<=self.simTime)
-            dts = np.array(self.problem.dt_list)[t_ids]
-            tos = np.array(self.problem.rotor_torque_dolfin_time)[t_ids]
-            val = dts*tos 
-            self.obj_value = (2.0*np.pi*self.problem.rpm/60.0)*np.sum(val)/np.sum(dts)/1.0e6
+            torque = self.problem.alm_history.WindowTorque(self.problem.record_time, self.simTime_id)
+            self.obj_value = (2.0*np.pi*self.problem.rpm/60.0)*torque[self.turb_i]/1.0e6
             self.problem.fprint("Current Power: "+repr(self.obj_value),tab=2)
 
 
@@ -639,11 +619,8 @@ class ActuatorLineForceBlock(Block):
         self.problem.fprint("Current Yaw:   "+repr(float(self.problem.farm.myaw[self.turb_i])),tab=2)
         self.problem.fprint("Current Chord: "+str(np.array(self.problem.mchord[self.turb_i],dtype=float)),tab=2)
         if self.simTime>=self.problem.record_time and self.problem.farm.numturbs==1:
-            t_ids = np.logical_and(np.array(self.problem.simTime_list)>=self.problem.record_time,np.array(self.problem.simTime_list)<=self.simTime)
-            dts = np.array(self.problem.dt_list)[t_ids]
-            tos = np.array(self.problem.rotor_torque_dolfin_time)[t_ids]
-            val = dts*tos 
-            self.obj_value = (2.0*np.pi*self.problem.rpm/60.0)*np.sum(val)/np.sum(dts)/1.0e6
+            torque = self.problem.alm_history.WindowTorque(self.problem.record_time, self.simTime_id)
+            self.obj_value = (2.0*np.pi*self.problem.rpm/60.0)*torque[self.turb_i]/1.0e6
             self.problem.fprint("Current Power: "+repr(self.obj_value),tab=2)
         # self.problem.fprint("",special="footer")
 
@@ -664,44 +641,13 @@ class ActuatorLineForceBlock(Block):
         #     # exit()
 
 
-        if "chord" in self.control_types:
-            prepared["chord"] = []
-            for i in range(self.problem.num_blade_segments):
-                old_chord_value = copy.copy(chord[i])
-                h_mag = 0.0001#*old_chord_value
-                chord[i] = old_chord_value+h_mag
-                self.problem.UpdateActuatorLineControls(chord = chord, turb_i=self.turb_i)
-                # temp_uph = backend_UpdateActuatorLineForce(self.problem, u_k1, self.simTime_id, self.dt, self.turb_i, self.mpi_u_fluid)
-                temp_uph = backend_UpdateActuatorLineForce(self.problem, mpi_u_fluid, self.simTime_id, self.dt, self.turb_i)
-                chord[i] = old_chord_value-h_mag
-                self.problem.UpdateActuatorLineControls(chord = chord, turb_i=self.turb_i)
-                # temp_umh = backend_UpdateActuatorLineForce(self.problem, u_k1, self.simTime_id, self.dt, self.turb_i, self.mpi_u_fluid)
-                temp_umh = backend_UpdateActuatorLineForce(self.problem, mpi_u_fluid, self.simTime_id, self.dt, self.turb_i)
-                chord[i] = old_chord_value
-                self.problem.UpdateActuatorLineControls(chord = chord, turb_i=self.turb_i)
-                dtf_dc = (temp_uph.vector().get_local()-temp_umh.vector().get_local())/(2.0*h_mag)
-                prepared["chord"].append(dtf_dc)
-            #FIXME: combine all these vectors onto rank 0, sum them, then broadcast that as the prepared vector
-            prepared["chord"] = np.array(prepared["chord"]).T
-
-        if "yaw" in self.control_types:
-            prepared["yaw"] = []
-            old_yaw_value = copy.copy(yaw)
-            h_mag = 0.0001#*old_chord_value
-            yaw = old_yaw_value+h_mag
-            self.problem.UpdateActuatorLineControls(yaw = yaw, turb_i=self.turb_i)
-            # temp_uph = backend_UpdateActuatorLineForce(self.problem, u_k1, self.simTime_id, self.dt, self.turb_i, self.mpi_u_fluid)
-            temp_uph = backend_UpdateActuatorLineForce(self.problem, mpi_u_fluid, self.simTime_id, self.dt, self.turb_i)
-            yaw = old_yaw_value-h_mag
-            self.problem.UpdateActuatorLineControls(yaw = yaw, turb_i=self.turb_i)
-            # temp_umh = backend_UpdateActuatorLineForce(self.problem, u_k1, self.simTime_id, self.dt, self.turb_i, self.mpi_u_fluid)
-            temp_umh = backend_UpdateActuatorLineForce(self.problem, mpi_u_fluid, self.simTime_id, self.dt, self.turb_i)
-            yaw = old_yaw_value
-            self.problem.UpdateActuatorLineControls(yaw = yaw, turb_i=self.turb_i)
-            dyaw_dc = (temp_uph.vector().get_local()-temp_umh.vector().get_local())/(2.0*h_mag)
-            # print(min(temp_uph.vector().get_local()),max(temp_uph.vector().get_local()))
-            # print(min(temp_umh.vector().get_local()),max(temp_umh.vector().get_local()))
-            prepared["yaw"] = dyaw_dc
+        # The force is linear in the chord, so the derivative of every segment comes out of a single pass,
+        # [numPts*ndim x num_blade_segments], while the yaw derivative is carried forward through the blade
+        # rotation, aoa and projection, [numPts*ndim]. The two are independent and can run concurrently.
+        dfd_names = [name for name in ["chord", "yaw"] if name in self.control_types]
+        dfd_arrays = self.problem.alm_workspace.Map(lambda name: backend_UpdateActuatorLineForce(self.problem, mpi_u_fluid, self.simTime_id, self.dt, self.turb_i, dfd=name), dfd_names)
+        for name, dfd_array in zip(dfd_names, dfd_arrays):
+            prepared[name] = dfd_array
 
 
 
@@ -11,15 +11,22 @@ else:
 if not main_file in ["sphinx-build", "__main__.py"]:
     from windse import windse_parameters
     if windse_parameters.dolfin_adjoint:
-        from dolfin import dx, File, dot
+        from dolfin import dx, File, dot, TestFunction
         from dolfin_adjoint import Constant, Function, Expression, assemble
     else:
-        from dolfin import Constant, Function, Expression, dot, dx, assemble, File, MPI, Point
+        from dolfin import Constant, Function, Expression, dot, dx, assemble, File, MPI, Point, TestFunction
 
     import numpy as np
     import scipy.interpolate as interp
+    import scipy.sparse as sparse
     import time
+    import glob
+    import hashlib
+    import warnings
+    from collections import OrderedDict
+    from concurrent.futures import ThreadPoolExecutor
     from scipy.special import gamma
+    from scipy.spatial import cKDTree
     from sys import platform
     # from mpi4py import MPI as pyMPI
 
@@ -131,15 +138,165 @@ def Transform(x,x0,HH,yaw,ground,dfd=None):
 
     return [xrot,yrot,zrot]
 
+class DiskDofIndex(object):
+    """
+    Spatial index over the coordinates of the turbine force dofs, used to
+    find the dofs inside the bounding box of each actuator disk without
+    comparing every coordinate against every turbine. The index is built
+    once per mesh, and the dofs found for each turbine are kept until that
+    turbine's box changes.
+
+    Args:
+        x (array): the dof coordinates, [dim x N]
+    """
+    def __init__(self, x):
+        self.x = x
+        self.tree = cKDTree(x.T)
+        self.boxes = {}
+
+    def Query(self, turb_i, center, half_width):
+        """
+        Returns the dofs strictly inside the box of half width half_width
+        around center.
+        """
+        key = (tuple(center), half_width)
+
+        if turb_i not in self.boxes or self.boxes[turb_i][0] != key:
+            # An infinity-norm ball is the box, widened slightly so rounding cannot drop a dof
+            ids = np.array(self.tree.query_ball_point(center, half_width*(1.0+1e-10), p=np.inf), dtype=int)
+
+            # Apply the same strict bounds as the dense comparison
+            local_x = self.x[:, ids]
+            inside = np.all(np.logical_and(local_x > (center-half_width)[:, np.newaxis],
+                                           local_x < (center+half_width)[:, np.newaxis]), axis=0)
+            self.boxes[turb_i] = (key, ids[inside])
+
+        return self.boxes[turb_i][1]
+
+
+class DiskForceCache(object):
+    """
+    Keeps the force of each actuator disk along with the summed turbine
+    force, so that only the turbines whose controls changed since the last
+    evaluation need their kernels evaluated again. The version of each
+    turbine is its column of controls. The summed force is rebuilt from
+    the cached rows of every turbine on each update, so it does not depend
+    on the order in which the turbines changed.
+    """
+    def __init__(self):
+        self.controls = None
+
+    def Changed(self, x, force, controls, requeried):
+        """
+        Returns the turbines that need to be evaluated again, which is all of
+        them if the dofs, force type, or number of turbines changed.
+        """
+        if self.controls is None or self.shape != x.shape or self.force != force or self.controls.shape != controls.shape:
+            self.shape = x.shape
+            self.force = force
+            self.controls = controls
+            self.rows = [None]*controls.shape[1]
+            self.normals = np.zeros((3,controls.shape[1]))
+            self.sums = np.zeros((3,x.size))
+            return list(range(controls.shape[1]))
+
+        changed = np.any(controls != self.controls, axis=0)
+        changed[list(requeried)] = True
+        self.controls = controls
+        return list(np.flatnonzero(changed))
+
+    def Update(self, turbines, cols, data, normals):
+        """
+        Replaces the force of each turbine in turbines with the new values
+        data placed at cols, and sums the force of every turbine weighted
+        by its normals.
+        """
+        for j, turb_cols, turb_data in zip(turbines, cols, data):
+            self.rows[j] = (turb_cols, turb_data)
+            for i in range(3):
+                self.normals[i,j] = normals[i][j]
+
+        ### Accumulate the turbines in order so the sum only depends on the current rows ###
+        counts = [len(turb_cols) for turb_cols, turb_data in self.rows]
+        all_cols = np.concatenate([np.zeros(0,dtype=int)]+[turb_cols for turb_cols, turb_data in self.rows])
+        all_data = np.concatenate([np.zeros(0)]+[turb_data for turb_cols, turb_data in self.rows])
+        for i in range(3):
+            self.sums[i] = -np.bincount(all_cols, weights=all_data*np.repeat(self.normals[i],counts), minlength=self.sums.shape[1])
+
+    def ActuatorArray(self):
+        """
+        Returns the force of each turbine as a csr matrix [numturbs x N*dim].
+        """
+        rows = np.repeat(np.arange(len(self.rows)),[len(turb_cols) for turb_cols, turb_data in self.rows])
+        cols = np.concatenate([np.zeros(0,dtype=int)]+[turb_cols for turb_cols, turb_data in self.rows])
+        data = np.concatenate([np.zeros(0)]+[turb_data for turb_cols, turb_data in self.rows])
+        return sparse.csr_matrix((data,(rows,cols)),shape=(len(self.rows),self.sums.shape[1]))
+
+
+class SparseActuatorDisks(object):
+    """
+    Read only list of the actuator disk of each turbine. Only the dofs of
+    each turbine are stored, so the disks of a large farm do not each hold
+    a copy of the whole turbine force space. Indexing a disk still builds
+    a full size Function, so consumers should use actuator_array directly.
+    Only the per-turbine storage shrinks. The summed forces tf1, tf2, and
+    tf3 used by the variational form remain full size Functions, so the
+    peak memory of the solve is unchanged.
+
+    Args:
+        actuator_array (csr_matrix): the force of each turbine [numturbs x N*dim]
+        V (dolfin.FunctionSpace): the turbine force space
+    """
+    def __init__(self, actuator_array, V):
+        self.actuator_array = actuator_array
+        self.V = V
+
+    def __len__(self):
+        return self.actuator_array.shape[0]
+
+    def __getitem__(self, i):
+        if i < -len(self) or i >= len(self):
+            raise IndexError("actuator disk index out of range")
+        disk = Function(self.V)
+        disk.vector()[:] = self.actuator_array[i].toarray().ravel()
+        return disk
+
+
 def CalculateDiskTurbineForces(x,wind_farm,fs,dfd=None,save_actuators=False,sparse_ids=None,sparse_RDs=1.5,tfs=None):
+    """
+    Builds the numpy actuator disk forces, or their derivatives with respect
+    to dfd. Each turbine only evaluates its kernel on the dofs inside its
+    own bounding box, and every per-turbine field is returned as a csr
+    matrix with one row per turbine over the local vector dofs, so memory
+    grows linearly with the size of the farm. The force itself is kept in
+    a :meth:`DiskForceCache` on fs, and only the turbines whose controls
+    changed since the last call are evaluated again.
+
+    Args:
+        x (array): the coordinates of the turbine force dofs, [dim x N]
+        wind_farm (:meth:`windse.WindFarmManager.GenericWindFarm`): the wind farm
+        fs (:meth:`windse.FunctionSpaceManager.GenericFunctionSpace`): the function spaces
+        dfd (str): None for the force, otherwise one of "x", "y", "a", or "yaw", or a list of
+            these to differentiate with respect to all of them in a single pass
+        save_actuators (bool): also return the force of each turbine
+        sparse_ids (list): the dofs of each turbine, found if None or for the turbines that are None
+        sparse_RDs (float): half width of each bounding box in rotor radii
+        tfs (list): Functions to fill with the force instead of creating new ones
+
+    Returns:
+        [tf1,tf2,tf3] (list): the force Functions, or csr derivatives [numturbs x N*dim] with
+            the rows of each listed name stacked in order [len(dfd)*numturbs x N*dim]
+        sparse_ids (list): the dofs of each turbine
+        actuator_array (csr_matrix): the force of each turbine [numturbs x N*dim], or None
+    """
     
     ### Collect the relevant turbine data ###
     x0 = np.array([wind_farm.mx,wind_farm.my,wind_farm.mz],dtype=float)
     yaw = np.array(wind_farm.myaw,dtype=float)+wind_farm.inflow_angle
     a = np.array(wind_farm.ma,dtype=float)
-    HH = wind_farm.HH
-    W = wind_farm.thickness
-    R = wind_farm.RD/2.0
+    HH = wind_farm.HH*np.ones(wind_farm.numturbs)
+    W = wind_farm.thickness*np.ones(wind_farm.numturbs)
+    R = wind_farm.RD/2.0*np.ones(wind_farm.numturbs)
     dim, N = x.shape
 
     ### Set up some dim dependent values ###
@@ -153,32 +310,29 @@ def CalculateDiskTurbineForces(x,wind_farm,fs,dfd=None,save_actuators=False,spar
         D_norm = 2.0*gamma(7.0/6.0)
     volNormalization = T_norm*D_norm*W*R**(dim-1)
 
-    ### Calculate relevant dofs that will be nonzero ###
+    ### Calculate relevant dofs that will be nonzero, each turbine keeps its own ###
     if sparse_ids is None:
+        sparse_ids = [None]*wind_farm.numturbs
+    requeried = [i for i in range(wind_farm.numturbs) if sparse_ids[i] is None]
+    if len(requeried) > 0:
         # print("recalc sparse")
-        ### Create the bounding box for each turbine ###
-        bounding_limit = [sparse_RDs*R]*3
-        bl = x0-bounding_limit
-        bu = x0+bounding_limit
-
-        if dim == 3:
-            ### Check all coordinate for which if above lower limits ###
-            gt = np.greater.outer(x[0],bl[0])*np.greater.outer(x[1],bl[1])*np.greater.outer(x[2],bl[2])
-
-            ### Check all coordinate for which if below upper limits ###
-            lt = np.less.outer(x[0],bu[0])*np.less.outer(x[1],bu[1])*np.less.outer(x[2],bu[2])
-        else:
-            ### Check all coordinate for which if above lower limits ###
-            gt = np.greater.outer(x[0],bl[0])*np.greater.outer(x[1],bl[1])
-
-            ### Check all coordinate for which if below upper limits ###
-            lt = np.less.outer(x[0],bu[0])*np.less.outer(x[1],bu[1])
+        ### Build the spatial index of the dofs the first time it is needed on this mesh ###
+        if fs.tf_dof_index is None:
+            fs.tf_dof_index = DiskDofIndex(x)
 
-        ### Check which coordinate are in bounding boxes ###
-        sparse_ids = np.where(np.any(np.logical_and(gt,lt),axis=1))[0]
+        ### Collect the dofs inside the bounding box of each turbine that needs them ###
+        bounding_limit = sparse_RDs*R
+        sparse_ids = list(sparse_ids)
+        for i in requeried:
+            sparse_ids[i] = fs.tf_dof_index.Query(i,x0[:dim,i],bounding_limit[i])
 
-    ### Select sparse x values ###
-    x=x[:,sparse_ids]
+    ### Only the turbines that changed since the cached force need to be evaluated ###
+    if dfd is None:
+        if fs.tf_disk_cache is None:
+            fs.tf_disk_cache = DiskForceCache()
+        turbines = fs.tf_disk_cache.Changed(x,wind_farm.force,np.vstack((x0,yaw,a,HH,W,R)),requeried)
+    else:
+        turbines = range(wind_farm.numturbs)
 
     ### Define Radial Force Functions ###
     if wind_farm.force == "constant":
@@ -190,194 +344,1006 @@ def CalculateDiskTurbineForces(x,wind_farm,fs,dfd=None,save_actuators=False,spar
     else:
         ValueError("Unknown force type: "+wind_farm.force)
 
+    ### Several control types can be differentiated in one pass that shares the kernel ###
+    names = list(dfd) if isinstance(dfd,(list,tuple)) else [dfd]
+    for name in names:
+        if name not in [None,"x","y","a","yaw"] or (name is None and len(names) > 1):
+            raise ValueError("Cannot take the derivative with respect to: "+str(name))
+
+    ### Create the normal ###
+    n1 = np.cos(yaw)**2
+    n2 = np.sin(yaw)**2
+    n3 = 2.0*np.cos(yaw)*np.sin(yaw)
+    d_n1 = (-2)*np.cos(yaw)*np.sin(yaw)
+    d_n2 = 2*np.sin(yaw)*np.cos(yaw)
+    d_n3 = 2.0*(np.cos(2*yaw))
+    n=[n1,n2,n3]
+    d_n=[d_n1,d_n2,d_n3]
+
+    ### Evaluate each turbine on its own dofs, the x and y components of tf1, tf2, and tf3 for every name ###
+    values_x = [[[],[],[]] for name in names]
+    values_y = [[[],[],[]] for name in names]
+    for j in turbines:
+        t = slice(j,j+1)
+        xj = x[:,sparse_ids[j]]
+
+        xrot = Transform(xj,x0[:,t],HH[t],yaw[t],wind_farm.dom.Ground)
+        r = np.sqrt(np.power(xrot[1],2.0)+np.power(xrot[2],2.0))/R[t]
+        kernel = np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W[t],6.0)))
+        r_force = RForce(r)
+
+        if None in names or "yaw" in names:
+            disks = (
+                    # Force
+                    4.*0.5*A[t]*a[t]/(1.-a[t])*r_force * 
+                    # Disk Kernel
+                    kernel/volNormalization[t]
+                    )
+
+            ### Rotate the force for the yawed turbine ###
+            actuators_x = disks*np.cos(yaw[t])
+            actuators_y = disks*np.sin(yaw[t])
+
+        if "x" in names or "y" in names or "yaw" in names:
+            r_5 = np.power(r,5.0)
+            xrot_5 = np.power(xrot[0]/W[t],5.0)
+
+        for k, name in enumerate(names):
+            if name in ["x","y","yaw"]:
+                d_xrot = Transform(xj,x0[:,t],HH[t],yaw[t],wind_farm.dom.Ground,dfd=name)
+                d_r = 0.5/R[t]**2.0*(2.0*xrot[1]*d_xrot[1]+2.0*xrot[2]*d_xrot[2])/r
+                d_disks = (
+                          # # Force
+                          4.*0.5*A[t]*a[t]/(1.-a[t]) *
+                          (
+                            r_force *
+                            # # Derivative of Disk Kernel
+                            -(6.0*r_5*d_r+6.0*xrot_5*d_xrot[0]/W[t]) +
+                            # # Derivative of Force
+                            dRForce(r,d_r)
+                            # Disk Kernal
+                          ) *
+                          kernel/volNormalization[t]
+                          )
+
+            elif name == "a":
+                d_disks = (
+                          # Derivative of Force
+                          4*0.5*A[t]/(a[t]-1.)**2.0*r_force *
+                          # Disk Kernal
+                          kernel/volNormalization[t]
+                          )
+
+            if name is None:
+                ### The force itself is combined from the turbine fields below ###
+                values_x[k][0].append(np.ravel(actuators_x))
+                values_y[k][0].append(np.ravel(actuators_y))
+
+            elif name == "yaw":
+                d_actuators_x = d_disks*np.cos(yaw[t]) - disks*np.sin(yaw[t])
+                d_actuators_y = d_disks*np.sin(yaw[t]) + disks*np.cos(yaw[t])
+                for i in range(3):
+                    values_x[k][i].append(np.ravel(-(d_actuators_x*n[i][t]+actuators_x*d_n[i][t])))
+                    values_y[k][i].append(np.ravel(-(d_actuators_y*n[i][t]+actuators_y*d_n[i][t])))
+
+            else:
+                d_actuators_x = d_disks*np.cos(yaw[t])
+                d_actuators_y = d_disks*np.sin(yaw[t])
+                for i in range(3):
+                    values_x[k][i].append(np.ravel(-d_actuators_x*n[i][t]))
+                    values_y[k][i].append(np.ravel(-d_actuators_y*n[i][t]))
+
     if dfd is None:
-        xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground)
-        r = np.sqrt(np.power(xrot[1],2.0)+np.power(xrot[2],2.0))/R
-        disks = (
-                # Force
-                4.*0.5*A*a/(1.-a)*RForce(r) * 
-                # Disk Kernel
-                np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W,6.0)))/volNormalization
-                )
-
-        ### Rotate the force for the yawed turbine ###
-        actuators_x = disks*np.cos(yaw)
-        actuators_y = disks*np.sin(yaw)
-
-        ### Create the normal ###
-        n1 = np.cos(yaw)**2
-        n2 = np.sin(yaw)**2
-        n3 = 2.0*np.cos(yaw)*np.sin(yaw)
+        ### Swap the changed turbines into the cache and sum the turbines weighted by their normals ###
+        cols = [np.concatenate((dim*sparse_ids[j]+0,dim*sparse_ids[j]+1)) for j in turbines]
+        data = [np.concatenate((vx,vy)) for vx, vy in zip(values_x[0][0],values_y[0][0])]
+        fs.tf_disk_cache.Update(turbines,cols,data,n)
 
         if tfs is None:
             ### Initialize the output ###
-            tf1  = Function(fs.tf_V)
-            tf2  = Function(fs.tf_V)
-            tf3  = Function(fs.tf_V)
-            tfs = [tf1,tf2,tf3]
-
-        ### Fill the output
-        n=[n1,n2,n3]
-        temp = np.zeros((N*dim))
-        for i in range(3):
-            temp[dim*(sparse_ids)+0] = -np.sum(actuators_x*n[i],axis=1)
-            temp[dim*(sparse_ids)+1] = -np.sum(actuators_y*n[i],axis=1)
-            tfs[i].vector()[:] = temp
-
-    elif dfd in ["x","y"]:
-        xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground)
-        d_xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground,dfd=dfd)
-        r = np.sqrt(np.power(xrot[1],2.0)+np.power(xrot[2],2.0))/R
-        d_r = 0.5/R**2.0*(2.0*xrot[1]*d_xrot[1]+2.0*xrot[2]*d_xrot[2])/r
-        d_disks = (
-                  # # Force
-                  4.*0.5*A*a/(1.-a) *
-                  (
-                    RForce(r) *
-                    # # Derivative of Disk Kernel
-                    -(6.0*np.power(r,5.0)*d_r+6.0*np.power(xrot[0]/W,5.0)*d_xrot[0]/W) +
-                    # # Derivative of Force
-                    dRForce(r,d_r)
-                    # Disk Kernal
-                  ) *
-                  np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W,6.0)))/volNormalization
-                  )
-
-        d_actuators_x = d_disks*np.cos(yaw)
-        d_actuators_y = d_disks*np.sin(yaw)
-
-        ### Create the normal ###
-        n1 = np.cos(yaw)**2
-        n2 = np.sin(yaw)**2
-        n3 = 2.0*np.cos(yaw)*np.sin(yaw)
-
-        ### Initialize the output ###
-        tf1  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf2  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf3  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-
-        ### Fill the output
-        tfs = [tf1,tf2,tf3]
-        n=[n1,n2,n3]
-        for i in range(3):
-            tfs[i][0::dim] = -d_actuators_x*n[i]
-            tfs[i][1::dim] = -d_actuators_y*n[i]
-
-    elif dfd == "a":
-        xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground)
-        r = np.sqrt(np.power(xrot[1],2.0)+np.power(xrot[2],2.0))/R
-        d_disks = (
-                  # Derivative of Force
-                  4*0.5*A/(a-1.)**2.0*RForce(r) *
-                  # Disk Kernal
-                  np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W,6.0)))/volNormalization
-                  )
-
-        d_actuators_x = d_disks*np.cos(yaw)
-        d_actuators_y = d_disks*np.sin(yaw)
-
-        ### Create the normal ###
-        n1 = np.cos(yaw)**2
-        n2 = np.sin(yaw)**2
-        n3 = 2.0*np.cos(yaw)*np.sin(yaw)
-
-        ### Initialize the output ###
-        tf1  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf2  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf3  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-
-        ### Fill the output
-        tfs = [tf1,tf2,tf3]
-        n=[n1,n2,n3]
-        for i in range(3):
-            tfs[i][0::dim] = -d_actuators_x*n[i]
-            tfs[i][1::dim] = -d_actuators_y*n[i]
+            tfs = [Function(fs.tf_V),Function(fs.tf_V),Function(fs.tf_V)]
 
-    elif dfd == "yaw":
-        xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground)
-        d_xrot = Transform(x,x0,HH,yaw,wind_farm.dom.Ground,dfd=dfd)
-        r = np.sqrt(np.power(xrot[1],2.0)+np.power(xrot[2],2.0))/R
-        d_r = 0.5/R**2.0*(2.0*xrot[1]*d_xrot[1]+2.0*xrot[2]*d_xrot[2])/r
-        disks = (
-                # Force
-                4.*0.5*A*a/(1.-a)*RForce(r) * 
-                # Disk Kernel
-                np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W,6.0)))/volNormalization
-                )
-        d_disks = (
-                  # # Force
-                  4.*0.5*A*a/(1.-a) *
-                  (
-                    RForce(r) *
-                    # # Derivative of Disk Kernel
-                    -(6.0*np.power(r,5.0)*d_r+6.0*np.power(xrot[0]/W,5.0)*d_xrot[0]/W) +
-                    # # Derivative of Force
-                    dRForce(r,d_r)
-                    # Disk Kernal
-                  ) *
-                  np.exp(-(np.power(r,6.0)+np.power(xrot[0]/W,6.0)))/volNormalization
-                  )
-
-        actuators_x = disks*np.cos(yaw)
-        actuators_y = disks*np.sin(yaw)
-        d_actuators_x = d_disks*np.cos(yaw) - disks*np.sin(yaw)
-        d_actuators_y = d_disks*np.sin(yaw) + disks*np.cos(yaw)
-
-        ### Create the normal ###
-        n1 = np.cos(yaw)**2
-        n2 = np.sin(yaw)**2
-        n3 = 2.0*np.cos(yaw)*np.sin(yaw)
-        d_n1 = (-2)*np.cos(yaw)*np.sin(yaw)
-        d_n2 = 2*np.sin(yaw)*np.cos(yaw)
-        d_n3 = 2.0*(np.cos(2*yaw))
-
-        ### Initialize the output ###
-        tf1  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf2  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-        tf3  = np.zeros((len(sparse_ids)*dim,wind_farm.numturbs))
-
-        ### Fill the output
-        tfs = [tf1,tf2,tf3]
-        n=[n1,n2,n3]
-        d_n=[d_n1,d_n2,d_n3]
+        ### Fill the output from the cached sum ###
         for i in range(3):
-            tfs[i][0::dim] = -(d_actuators_x*n[i]+actuators_x*d_n[i])
-            tfs[i][1::dim] = -(d_actuators_y*n[i]+actuators_y*d_n[i])
+            tfs[i].vector()[:] = fs.tf_disk_cache.sums[i]
+        tf1, tf2, tf3 = tfs
 
     else:
-        raise ValueError("Cannot take the derivative with respect to: "+dfd)
+        ### Place the values of each turbine in its own row, stacking the names, [len(names)*numturbs x N*dim] ###
+        ids = np.concatenate([np.zeros(0,dtype=int)]+list(sparse_ids))
+        rows = np.repeat(np.arange(wind_farm.numturbs),[len(turb_ids) for turb_ids in sparse_ids])
+        rows = np.concatenate([k*wind_farm.numturbs+rows for k in range(len(names)) for comp in range(2)])
+        cols = np.concatenate([dim*ids+comp for k in range(len(names)) for comp in range(2)])
+        def TurbineField(i):
+            data = np.concatenate([np.zeros(0)]+[np.concatenate([np.zeros(0)]+values[k][i]) for k in range(len(names)) for values in [values_x,values_y]])
+            return sparse.csr_matrix((data,(rows,cols)),shape=(len(names)*wind_farm.numturbs,N*dim))
+
+        tf1, tf2, tf3 = [TurbineField(i) for i in range(3)]
 
     ### Output the actuator information if needed ###
     if save_actuators and dfd is None:
-        actuator_array = np.zeros((N*dim,wind_farm.numturbs))
-        actuator_array[dim*(sparse_ids)+0] = actuators_x
-        actuator_array[dim*(sparse_ids)+1] = actuators_y
+        actuator_array = fs.tf_disk_cache.ActuatorArray()
     else:
         actuator_array = None
 
     return [[tf1,tf2,tf3],sparse_ids,actuator_array]
 
 
-#================================================================
+def ReadAirfoilPolarTable(airfoil_data_path, cache_folder=None):
+    """
+    Reads the af_station_%d.txt polars in airfoil_data_path into a single
+    table whose columns are the angle, the lift of every station, and the
+    drag of every station. If cache_folder is given, the table is also saved
+    there as a binary npy file keyed on the path, size, and modification time
+    of every station file, which later runs load instead of parsing the text.
+
+    Args:
+        airfoil_data_path (str): the folder holding the station files
+        cache_folder (str): the folder compiled tables are cached in, None disables the cache
+
+    Returns:
+        table (array): [num_angles x 1+2*num_stations]
+    """
+
+    # Determine the number of files in airfoil_data_path
+    num_files = len(glob.glob('%s/*.txt' % (airfoil_data_path)))
+    station_files = ['%s/af_station_%d.txt' % (airfoil_data_path, file_id) for file_id in range(num_files)]
+
+    table_file = None
+    if cache_folder is not None:
+        # Key the compiled table on the identity of every station file without reading it
+        file_hash = hashlib.sha1()
+        for station_file in station_files:
+            stat = os.stat(station_file)
+            file_hash.update(('%s:%d:%d;' % (os.path.abspath(station_file), stat.st_size, stat.st_mtime_ns)).encode())
+        table_file = '%s/af_polars_%s.npy' % (cache_folder, file_hash.hexdigest())
+
+        if os.path.isfile(table_file):
+            return np.array(np.load(table_file, mmap_mode='r'))
+
+    for file_id, station_file in enumerate(station_files):
+        data = np.genfromtxt(station_file, skip_header=1, delimiter=' ')
+
+        if file_id == 0:
+            # If this is the first file, store the angle data and allocate space for the tables
+            table = np.zeros((np.shape(data)[0], 1+2*num_files))
+            table[:, 0] = data[:, 0]
+
+        # Store all the lift and drag data in the file_id columns
+        table[:, 1+file_id] = data[:, 1]
+        table[:, 1+num_files+file_id] = data[:, 2]
+
+    if table_file is not None:
+        # Write to a temporary file first so concurrent runs never see a partial table
+        temp_file = '%s.%d.tmp' % (table_file, os.getpid())
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            with open(temp_file, 'wb') as fp:
+                np.save(fp, table)
+            os.replace(temp_file, table_file)
+        except OSError as e:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+            warnings.warn("could not cache the airfoil polars in %s: %s" % (cache_folder, e))
+
+    return table
+
+
+def LoadAirfoilPolars(airfoil_data_path, comm, rank, cache_folder=None):
+    """
+    Loads the lift and drag tables of every airfoil station. Only rank 0
+    reads the files (see :meth:`ReadAirfoilPolarTable`), and the tables
+    are broadcast to the other ranks.
+
+    Args:
+        airfoil_data_path (str): the folder holding the station files
+        comm: the MPI communicator
+        rank (int): the rank of this process
+        cache_folder (str): the folder compiled tables are cached in, None disables the cache
+
+    Returns:
+        lift_table, drag_table (arrays): [num_angles x num_stations]
+        interp_angles (array): the angle of each row of the tables
+    """
+    shape = np.zeros(2, dtype=np.int64)
+    if rank == 0:
+        table = ReadAirfoilPolarTable(airfoil_data_path, cache_folder)
+        shape[:] = np.shape(table)
+
+    comm.Bcast(shape, root=0)
+    if rank != 0:
+        table = np.zeros(shape)
+    comm.Bcast(table, root=0)
+
+    num_files = (shape[1] - 1)//2
+    lift_table = np.array(table[:, 1:1+num_files])
+    drag_table = np.array(table[:, 1+num_files:])
+    interp_angles = np.array(table[:, 0])
+
+    return lift_table, drag_table, interp_angles
+
+
+def BladeSegmentFractions(spacing, num_segments):
+    """
+    Returns the radial position of each actuator node as a fraction of the
+    blade length.
+
+    Args:
+        spacing (str or list): "uniform", "cosine" (clustered at the root and the tip),
+            "tip" (clustered at the tip), or the radial fraction of every node
+        num_segments (int): number of actuator nodes along each blade
+
+    Returns:
+        fractions (array): increasing values between 0 and 1, [num_segments]
+    """
+    if isinstance(spacing, str):
+        s = np.linspace(0.0, 1.0, num_segments)
+
+        if spacing == "uniform":
+            return s
+        elif spacing == "cosine":
+            return 0.5*(1.0 - np.cos(np.pi*s))
+        elif spacing == "tip":
+            return np.sin(0.5*np.pi*s)
+        else:
+            raise ValueError("Unknown blade segment spacing: "+repr(spacing))
+
+    fractions = np.array(spacing, dtype=float)
+
+    if len(fractions) != num_segments:
+        raise ValueError("Expected %d radial stations in the blade segment spacing, got %d" % (num_segments, len(fractions)))
+    if np.any(np.diff(fractions) <= 0.0) or fractions[0] < 0.0 or fractions[-1] > 1.0:
+        raise ValueError("The radial stations of the blade segment spacing must be increasing fractions between 0 and 1")
+
+    return fractions
+
+
+def BatchedDot(a, b):
+    """
+    Computes the dot product of two stacks of 3-component vectors stored
+    along the last axis. The stacked matmul evaluates each product exactly
+    like np.dot would, unlike an elementwise multiply and sum.
+    """
+    return np.matmul(a[..., np.newaxis, :], b[..., :, np.newaxis])[..., 0, 0]
+
+
+def BladeElementCoefficients(problem, u_rel, blade_unit_vec, rdim, L, twist, d_u_rel=None, d_blade_unit_vec=None):
+    """
+    Computes the angle of attack, lift and drag coefficients, and tip-loss
+    factor of every actuator node at once. Any number of leading dimensions
+    (blades, turbines, ...) can be stacked on the inputs.
+
+    If the tangents d_u_rel and d_blade_unit_vec are supplied, the
+    directional derivatives of the four outputs are propagated alongside
+    them (forward mode) and returned after the values.
+
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the airfoil tables
+        u_rel (array): relative wind velocity, [... x 3 x num_blade_segments]
+        blade_unit_vec (array): blade-aligned unit vectors stored as columns, [... x 3 x 3]
+        rdim (array): radial position of each node, [... x num_blade_segments]
+        L (float): the blade length, which the tip loss is measured from even if the outermost node is inboard of the tip
+        twist (array): twist of each node, [... x num_blade_segments]
+        d_u_rel (array): optional tangent of u_rel, same shape as u_rel
+        d_blade_unit_vec (array): optional tangent of blade_unit_vec, same shape as blade_unit_vec
+
+    Returns:
+        aoa, cl, cd, tip_loss (arrays): each is [... x num_blade_segments]
+        d_aoa, d_cl, d_cd, d_tip_loss (arrays): only if the tangents are given
+    """
+
+    # If this is the first time calling the function...
+    if not hasattr(problem, 'interp_lift'):
+        # build the lift-drag table interpolators
+        rdim_all = np.linspace(0, L, np.shape(problem.lift_table)[1])
+        problem.interp_lift = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.lift_table)
+        problem.interp_drag = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.drag_table)
+
+    # Arrange the vectors with their components along the last axis, [... x num_blade_segments x 3]
+    wind_vec = np.swapaxes(u_rel, -1, -2)
+    span_vec = blade_unit_vec[..., np.newaxis, :, 1]
+    sweep_vec = blade_unit_vec[..., np.newaxis, :, 2]
+
+    # Remove the component in the radial direction (along the blade span)
+    wind_span = BatchedDot(wind_vec, span_vec)
+    wind_vec_full = wind_vec
+    wind_vec = wind_vec - wind_span[..., np.newaxis]*span_vec
+
+    # The aoa is the angle between
+    # a = in-plane vector pointing opposite rotation (blade sweep direction)
+    # b = relative wind vector at each node, including blade rotation effects (wind direction)
+    # measured about n = unit vector normal to plane of rotation, in this case, radially along span
+    a = -sweep_vec
+    b = wind_vec
+    n = -span_vec
+
+    a_x_b = BatchedDot(np.cross(n, a), b)
+
+    norm_a = np.sqrt(a[..., 0]*a[..., 0] + a[..., 1]*a[..., 1] + a[..., 2]*a[..., 2])
+    norm_b = np.sqrt(b[..., 0]*b[..., 0] + b[..., 1]*b[..., 1] + b[..., 2]*b[..., 2])
+
+    c1_raw = a_x_b/(norm_a*norm_b)
+    c1 = np.clip(c1_raw, -1.0, 1.0)
+    aoa = np.arcsin(c1)
+
+    c2 = BatchedDot(a, b)/(norm_a*norm_b)
+    c2 = np.clip(c2, -1.0, 1.0)
+    aoa_2 = np.arccos(c2)
+
+    # Unwrap angles where the wind comes from behind the blade
+    unwrap = aoa_2 > np.pi/2.0
+    aoa = np.where(unwrap, np.where(aoa < 0, -np.pi - aoa, np.pi - aoa), aoa)
+
+    # Compute tip-loss factor
+    rdim = np.broadcast_to(rdim, aoa.shape)
+    root = rdim < 1e-12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loss_exponent = 3.0/2.0*(L-rdim)/(rdim*np.sin(aoa))
+        acos_arg_raw = np.exp(-loss_exponent)
+    acos_arg = np.clip(acos_arg_raw, -1.0, 1.0)
+    tip_loss = np.where(root, 1.0, 2.0/np.pi*np.arccos(acos_arg))
+
+    # Remove the portion of the angle due to twist
+    aoa_geometric = aoa
+    aoa = aoa - twist
+
+    # Store the cl and cd by interpolating these (aoa, span) pairs from the tables
+    cl = problem.interp_lift(aoa, rdim, grid=False)
+    cd = problem.interp_drag(aoa, rdim, grid=False)
+
+    if d_u_rel is None:
+        return aoa, cl, cd, tip_loss
+
+    # ================================================================
+    # Forward-mode derivatives, each step mirrors the one above
+    # ================================================================
+
+    d_wind_vec = np.swapaxes(d_u_rel, -1, -2)
+    d_span_vec = d_blade_unit_vec[..., np.newaxis, :, 1]
+    d_sweep_vec = d_blade_unit_vec[..., np.newaxis, :, 2]
+
+    d_wind_span = BatchedDot(d_wind_vec, span_vec) + BatchedDot(wind_vec_full, d_span_vec)
+    d_wind_vec = d_wind_vec - d_wind_span[..., np.newaxis]*span_vec - wind_span[..., np.newaxis]*d_span_vec
+
+    d_a = -d_sweep_vec
+    d_b = d_wind_vec
+    d_n = -d_span_vec
+
+    d_a_x_b = BatchedDot(np.cross(d_n, a) + np.cross(n, d_a), b) + BatchedDot(np.cross(n, a), d_b)
+    d_norm_a = BatchedDot(a, d_a)/norm_a
+    d_norm_b = BatchedDot(b, d_b)/norm_b
+
+    # The derivative of arcsin vanishes wherever the argument was clipped
+    d_c1 = (d_a_x_b - c1_raw*(d_norm_a*norm_b + norm_a*d_norm_b))/(norm_a*norm_b)
+    unclipped = np.abs(c1_raw) < 1.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_aoa = np.where(unclipped, d_c1/np.sqrt(1.0 - c1*c1), 0.0)
+    d_aoa = np.where(unwrap, -d_aoa, d_aoa)
+
+    # The tip loss is flat at the root and wherever the arccos argument was clipped
+    valid = (~root) & (np.abs(acos_arg_raw) < 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_loss_exponent = -loss_exponent*np.cos(aoa_geometric)/np.sin(aoa_geometric)*d_aoa
+        d_acos_arg = -acos_arg*d_loss_exponent
+        d_tip_loss = np.where(valid, -2.0/np.pi*d_acos_arg/np.sqrt(1.0 - acos_arg*acos_arg), 0.0)
+
+    # Differentiate the splines along the aoa direction
+    d_cl = problem.interp_lift(aoa, rdim, dx=1, grid=False)*d_aoa
+    d_cd = problem.interp_drag(aoa, rdim, dx=1, grid=False)*d_aoa
+
+    return aoa, cl, cd, tip_loss, d_aoa, d_cl, d_cd, d_tip_loss
+
+
+class ActuatorLineWorkspace(object):
+    """
+    Owns the buffers and constant blade geometry used by
+    :meth:`UpdateActuatorLineForce` so that each step refills them in
+    place instead of allocating new arrays and Functions. The turbine
+    force Functions are only reused when dolfin_adjoint is off, since the
+    tape needs the output of every step.
+
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the function space and coordinates
+        num_blades (int): number of blades on each rotor
+    """
+    def __init__(self, problem, num_blades=3):
+        self.problem = problem
+        self.num_blades = num_blades
+        self.num_segments = problem.num_blade_segments
+        self.blade_fractions = problem.blade_fractions
+        self.blade_share = problem.blade_share
+        self.blade_rotation = problem.blade_rotation
+        self.uniform_spacing = isinstance(problem.farm.blade_spacing, str) and problem.farm.blade_spacing == "uniform"
+        self.reuse_functions = not problem.params.dolfin_adjoint
+
+        self.tf = [None]*problem.farm.numturbs
+        self.cyld = Function(problem.fs.V)
+
+        ### The force at every mesh point and the rows written since the last reset ###
+        self.turbine_force = np.zeros((np.shape(problem.coords)[0], problem.dom.dim))
+        self.touched_ids = np.zeros(0, dtype=int)
+
+        ### Geometry shared by every turbine ###
+        self.theta_vec = np.linspace(0.0, 2.0*np.pi, num_blades, endpoint=False)
+        self.blade_unit_vec_base = np.eye(3)
+        self.geometry = [None]*problem.farm.numturbs
+
+        ### Lever arm of each rotor, only rebuilt when the turbine moves or yaws ###
+        self.cyld_expr = [None]*problem.farm.numturbs
+        self.torque_weights = [None]*problem.farm.numturbs
+        self.lever_placement = [None]*problem.farm.numturbs
+        self.local_torque = np.zeros(problem.farm.numturbs)
+
+        ### Optional pool of threads that evaluates independent turbines concurrently ###
+        self.num_threads = max(int(problem.farm.alm_threads), 1)
+        self.pool = None
+
+        ### Optionally tabulate the projection of each rotor at fixed blade angles ###
+        self.projection_cache = None
+        if problem.farm.alm_cache_bins > 0:
+            self.projection_cache = ActuatorLineProjectionCache(self, problem.farm.alm_cache_bins, problem.farm.alm_cache_memory)
+
+        ### Optionally hold the nodal loads of the last full updates over the next few steps ###
+        self.subcycle_steps = max(int(problem.farm.alm_subcycle), 1)
+        self.subcycle_sweep = float(problem.farm.alm_subcycle_sweep)
+        self.held = []
+
+    def Map(self, function, items):
+        """
+        Applies function to every item and returns the results in order.
+        With more than one thread the items are evaluated concurrently, so
+        function must only touch state that belongs to its own item.
+        """
+        items = list(items)
+
+        if self.num_threads == 1 or len(items) < 2:
+            return [function(item) for item in items]
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+
+        return list(self.pool.map(function, items))
+
+    def TurbineForceFunction(self, turb_i):
+        """
+        Returns the Function that holds the force of turbine turb_i.
+        """
+        if not self.reuse_functions:
+            return Function(self.problem.fs.V)
+
+        if self.tf[turb_i] is None:
+            self.tf[turb_i] = Function(self.problem.fs.V)
+
+        return self.tf[turb_i]
+
+    def ResetTurbineForce(self):
+        """
+        Zeros the rows of the force buffer written by the previous call and
+        returns the buffer, [numGridPts x ndim].
+        """
+        self.turbine_force[self.touched_ids] = 0.0
+        self.touched_ids = np.zeros(0, dtype=int)
+
+        return self.turbine_force
+
+    def Geometry(self, turb_i, radius, rpm):
+        """
+        Returns the radial position and width of every actuator node along
+        with the base blade position and velocity. These are only rebuilt
+        when the radius or rpm of the turbine changes.
+        """
+        key = (float(radius), float(rpm))
+
+        if self.geometry[turb_i] is None or self.geometry[turb_i][0] != key:
+            L = key[0]
+            ns = self.num_segments
+
+            tip_speed = 2.0*np.pi*key[1]/60.0*L
+
+            if self.uniform_spacing:
+                # Calculate the radial position of each actuator node
+                rdim = np.linspace(0.0, L, ns)
+
+                # Calculate width of an individual blade segment
+                w = (rdim[1] - rdim[0])*np.ones(ns)
+                w[0] = w[0]/2.0
+                w[-1] = w[-1]/2.0
+
+                blade_speed = np.linspace(0.0, tip_speed, ns)
 
-def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_i, dfd=None, verbose=False):
+            else:
+                rdim = L*self.blade_fractions
+
+                # Each node covers half of the gap to each of its neighbours
+                w = np.zeros(ns)
+                w[:-1] += 0.5*np.diff(rdim)
+                w[1:] += 0.5*np.diff(rdim)
+
+                blade_speed = tip_speed*self.blade_fractions
+
+            # Each modeled blade carries its share of the load of the real blades
+            w = self.blade_share*w
+
+            # Calculate an array describing the x, y, z position of each actuator node
+            # Note: The basic blade is oriented along the +y-axis
+            blade_pos_base = np.vstack((np.zeros(ns), rdim, np.zeros(ns)))
+
+            # Specify the velocity vector at each actuator node
+            # Note: A blade with span oriented along the +y-axis moves in the +z direction
+            blade_vel_base = np.vstack((np.zeros(ns), np.zeros(ns), blade_speed))
+
+            self.geometry[turb_i] = (key, rdim, w, blade_pos_base, blade_vel_base)
+
+        return self.geometry[turb_i][1:]
+
+    def LeverArm(self, turb_i):
+        """
+        Returns the cylindrical expression of turbine turb_i along with its
+        lumped weight vector w on the local velocity dofs, so that the
+        torque of a turbine force tf is -w.tf. The weights are assembled
+        once and only rebuilt when the turbine moves or yaws.
+        """
+        farm = self.problem.farm
+        placement = (float(farm.myaw[turb_i]), float(farm.mx[turb_i]), float(farm.my[turb_i]), float(farm.z[turb_i]))
+        moved = self.lever_placement[turb_i] != placement
+
+        if self.cyld_expr[turb_i] is None or not self.reuse_functions:
+            # Create a cylindrical expression aligned with the position of this turbine
+            self.cyld_expr[turb_i] = Expression(('sin(yaw)*(x[2]-zs)', '-cos(yaw)*(x[2]-zs)', '(x[1]-ys)*cos(yaw)-(x[0]-xs)*sin(yaw)'),
+                degree=1,
+                yaw=farm.myaw[turb_i],
+                xs=farm.mx[turb_i],
+                ys=farm.my[turb_i],
+                zs=farm.z[turb_i])
+
+        elif moved:
+            self.cyld_expr[turb_i].yaw = placement[0]
+            self.cyld_expr[turb_i].xs = placement[1]
+            self.cyld_expr[turb_i].ys = placement[2]
+            self.cyld_expr[turb_i].zs = placement[3]
+
+        if moved:
+            v = TestFunction(self.problem.fs.V)
+            self.torque_weights[turb_i] = assemble(dot(v, self.cyld_expr[turb_i])*dx).get_local()
+            self.lever_placement[turb_i] = placement
+
+        return self.cyld_expr[turb_i], self.torque_weights[turb_i]
+
+    def NodePositions(self, turb_i, theta_offset):
+        """
+        Returns the position of every actuator node of turbine turb_i when
+        its blades are rotated by theta_offset, [3 x num_blades*num_blade_segments].
+        """
+        return self.RotorFrames(turb_i, theta_offset)[0]
+
+    def RotorFrames(self, turb_i, theta_offset):
+        """
+        Returns the position of every actuator node of turbine turb_i along
+        with the blade-aligned unit vectors of every blade when its blades
+        are rotated by theta_offset, [3 x num_blades*num_blade_segments] and
+        [num_blades x 3 x 3].
+        """
+        farm = self.problem.farm
+        rdim, w, blade_pos_base, blade_vel_base = self.Geometry(turb_i, farm.radius[turb_i], self.problem.rpm)
+
+        # Stack the rotation about the x-axis of every blade, [num_blades x 3 x 3]
+        theta = self.theta_vec + theta_offset
+        Rx = np.zeros((self.num_blades, 3, 3))
+        Rx[:, 0, 0] = 1.0
+        Rx[:, 1, 1] = np.cos(theta)
+        Rx[:, 1, 2] = -np.sin(theta)
+        Rx[:, 2, 1] = np.sin(theta)
+        Rx[:, 2, 2] = np.cos(theta)
+
+        yaw = float(farm.myaw[turb_i])
+        Rz = np.array([[np.cos(yaw), -np.sin(yaw), 0],
+                       [np.sin(yaw), np.cos(yaw), 0],
+                       [0, 0, 1]])
 
+        blade_pos = np.matmul(Rz, np.matmul(Rx, blade_pos_base))
+        node_pos = np.transpose(blade_pos, (1, 0, 2)).reshape(3, -1)
+        node_pos[0] += farm.x[turb_i]
+        node_pos[1] += farm.y[turb_i]
+        node_pos[2] += farm.z[turb_i]
+
+        blade_unit_vec = np.matmul(Rz, np.matmul(Rx, self.blade_unit_vec_base))
+
+        return node_pos, blade_unit_vec
+
+    def BladeAngle(self, simTime_id, dt):
+        """
+        Returns the rotation of the blades at the middle of step simTime_id,
+        which is always zero for the stationary blades of the rotating disk.
+        """
+        if not self.blade_rotation:
+            return 0.0
+
+        period = 60.0/self.problem.rpm
+
+        return (self.problem.alm_history.Time(simTime_id)+0.5*dt)/period*2.0*np.pi
+
+    def Placement(self):
+        """
+        Returns the position, yaw, and radius of every turbine along with
+        the rotor speed, used to tell when held loads are no longer valid.
+        """
+        farm = self.problem.farm
+        placement = [(float(farm.x[i]), float(farm.y[i]), float(farm.z[i]), float(farm.myaw[i]), float(farm.radius[i])) for i in range(farm.numturbs)]
+
+        return tuple(placement) + (float(self.problem.rpm),)
+
+    def HoldLoads(self, simTime_id, theta_offset, results):
+        """
+        Stores the nodal loads of a full update in the frame of each blade
+        so the following steps can be advanced without sampling the fluid.
+        The previous full update is kept as well, as long as no turbine has
+        moved since, so that the loads can be extrapolated in time.
+
+        Args:
+            simTime_id (int): index of the step of the full update
+            theta_offset (float): rotation of the blades during that step
+            results (list): the node positions and forces of each turbine, [3 x num_nodes] and [num_nodes x 3]
+        """
+        if self.subcycle_steps == 1:
+            return
+
+        loads = []
+        for turb_i, (turb_pos, turb_force, turb_projection) in enumerate(results):
+            if np.shape(turb_pos)[1] == 0:
+                loads.append(None)
+            else:
+                # Express the force of every node in the blade-aligned coordinate system, [num_blades x num_blade_segments x 3]
+                blade_unit_vec = self.RotorFrames(turb_i, theta_offset)[1]
+                loads.append(np.matmul(turb_force.reshape(self.num_blades, -1, 3), blade_unit_vec))
 
+        snapshot = (simTime_id, self.problem.alm_history.Time(simTime_id), theta_offset, self.Placement(), loads)
 
-    simTime = problem.simTime_list[simTime_id]
-    # print("debug data:", simTime,  mpi_u_fluid_constant.values())
+        if len(self.held) > 0 and self.held[-1][3] == snapshot[3]:
+            self.held = [self.held[-1], snapshot]
+        else:
+            self.held = [snapshot]
+
+    def Subcycle(self, simTime_id, dt):
+        """
+        Returns True if step simTime_id can be advanced from the held loads
+        instead of a full update. A full update is forced every
+        alm_subcycle steps, whenever a turbine moves, yaws, or changes
+        radius, and once the blade tips have swept more than
+        alm_subcycle_sweep gaussian widths since the last full update.
+        """
+        if self.subcycle_steps == 1 or len(self.held) == 0:
+            return False
+
+        held_id, held_time, held_theta, held_placement, held_loads = self.held[-1]
+
+        if not 0 < simTime_id - held_id < self.subcycle_steps:
+            return False
+
+        if held_placement != self.Placement():
+            return False
+
+        # Distance traveled by the tip of the longest blade since the last full update
+        sweep = abs(self.BladeAngle(simTime_id, dt) - held_theta)*np.max(self.problem.farm.radius)
+
+        return sweep <= self.subcycle_sweep*self.problem.gaussian_width
+
+    def HeldLoads(self, turb_i, simTime):
+        """
+        Returns the blade-frame loads of turbine turb_i at simTime, linearly
+        extrapolated from the last two full updates when both are held, or
+        None if the turbine had no actuator nodes on this rank.
+        """
+        loads = self.held[-1][4][turb_i]
+
+        if loads is None or len(self.held) < 2 or self.held[0][4][turb_i] is None:
+            return loads
+
+        t0 = self.held[0][1]
+        t1 = self.held[-1][1]
+        if t1 <= t0:
+            return loads
+
+        return loads + (loads - self.held[0][4][turb_i])*(simTime - t1)/(t1 - t0)
+
+
+class ActuatorLineProjectionCache(object):
+    """
+    Tabulates the truncated gaussian projection of each rotor at a fixed
+    number of blade angles (azimuth bins) per revolution. The projection at
+    any other angle is interpolated linearly between the two neighbouring
+    bins. Bins are computed the first time they are needed, and the least
+    recently used ones are evicted once the cache grows past its memory
+    cap. All the bins of a turbine are dropped if it moves, yaws or
+    changes radius.
+
+    Args:
+        workspace (:meth:`windse.helper_functions.ActuatorLineWorkspace`): the workspace providing the node positions
+        num_bins (int): number of azimuth bins per revolution
+        max_memory (float): memory cap in MB
+    """
+    def __init__(self, workspace, num_bins, max_memory):
+        self.workspace = workspace
+        self.num_bins = int(num_bins)
+        self.max_bytes = max_memory*1.0e6
+        self.num_bytes = 0
+        self.bins = OrderedDict()
+        self.placement = {}
+
+    def Projection(self, turb_i, theta_offset):
+        """
+        Returns the projection of turbine turb_i at the blade angle
+        theta_offset as row, column, and weight arrays.
+        """
+        farm = self.workspace.problem.farm
+        placement = (float(farm.x[turb_i]), float(farm.y[turb_i]), float(farm.z[turb_i]),
+                     float(farm.myaw[turb_i]), float(farm.radius[turb_i]))
+        if self.placement.get(turb_i) != placement:
+            self.Discard(turb_i)
+            self.placement[turb_i] = placement
+
+        # Find the neighbouring bins and the interpolation weight between them
+        position = (theta_offset/(2.0*np.pi) % 1.0)*self.num_bins
+        lower = int(np.floor(position))
+        alpha = position - lower
+        lower = lower % self.num_bins
+        upper = (lower + 1) % self.num_bins
+
+        rows_0, cols_0, weights_0 = self.Bin(turb_i, lower)
+        rows_1, cols_1, weights_1 = self.Bin(turb_i, upper)
+
+        rows = np.concatenate((rows_0, rows_1))
+        cols = np.concatenate((cols_0, cols_1))
+        weights = np.concatenate(((1.0 - alpha)*weights_0, alpha*weights_1))
+
+        return rows, cols, weights
+
+    def Bin(self, turb_i, bin_id):
+        """
+        Returns the tabulated projection of one bin, computing it if needed.
+        """
+        key = (turb_i, bin_id)
+
+        if key in self.bins:
+            self.bins.move_to_end(key)
+        else:
+            node_pos = self.workspace.NodePositions(turb_i, 2.0*np.pi*bin_id/self.num_bins)
+            entry = GaussianProjectionWeights(self.workspace.problem, node_pos)
+            self.bins[key] = entry
+            self.num_bytes += sum(array.nbytes for array in entry)
+
+            # Evict the least recently used bins, but never the two needed for this step
+            while self.num_bytes > self.max_bytes and len(self.bins) > 2:
+                old_key, old_entry = self.bins.popitem(last=False)
+                self.num_bytes -= sum(array.nbytes for array in old_entry)
+
+        return self.bins[key]
+
+    def Discard(self, turb_i):
+        """
+        Drops every bin of turbine turb_i.
+        """
+        for key in [key for key in self.bins if key[0] == turb_i]:
+            self.num_bytes -= sum(array.nbytes for array in self.bins.pop(key))
+
+
+class ActuatorLineHistory(object):
+    """
+    Stores the time, step size, and dolfin torque of every alm turbine at
+    each time step. The arrays are preallocated and doubled when full, and
+    running sums of dt and dt*torque are kept so that the time-averaged
+    torque over any window is found without revisiting the history. A
+    torque that is recorded again for an earlier step, e.g. while the
+    adjoint recomputes the tape, only invalidates the running sums from
+    that step on.
+
+    Args:
+        num_turbs (int): number of turbines
+        capacity (int): number of steps allocated up front
+    """
+    def __init__(self, num_turbs, capacity=1024):
+        self.num_steps = 0
+        self.time = np.zeros(capacity)
+        self.dt = np.zeros(capacity)
+        self.torque = np.zeros((capacity, num_turbs))
+
+        ### sum_dt[k] and sum_torque[k] hold the sums over the steps before k, valid up to k = valid ###
+        self.sum_dt = np.zeros(capacity+1)
+        self.sum_torque = np.zeros((capacity+1, num_turbs))
+        self.valid = 0
+
+        ### The first step of the last window that was asked for ###
+        self.window_start = None
+        self.window_step = 0
+
+    def Append(self, simTime, dt):
+        """
+        Adds a time step and returns its index.
+        """
+        if self.num_steps == len(self.time):
+            self.Grow()
+
+        step = self.num_steps
+        self.time[step] = simTime
+        self.dt[step] = dt
+        self.torque[step] = 0.0
+        self.num_steps += 1
+        self.valid = min(self.valid, step)
+
+        return step
+
+    def Grow(self):
+        """
+        Doubles the number of steps that fit in the arrays.
+        """
+        extra = len(self.time)
+
+        for name in ['time', 'dt', 'torque', 'sum_dt', 'sum_torque']:
+            old = getattr(self, name)
+            new = np.zeros((len(old)+extra,)+np.shape(old)[1:])
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def Time(self, step):
+        """
+        Returns the time of step, negative steps count back from the latest
+        one like a list index.
+        """
+        return self.time[:self.num_steps][step]
+
+    def SetTorque(self, step, turb_ids, torque):
+        """
+        Records the dolfin torque of the listed turbines at step.
+        """
+        self.torque[step, turb_ids] = torque
+        self.valid = min(self.valid, step)
+
+    def Accumulate(self, stop):
+        """
+        Brings the running sums up to date through index stop.
+        """
+        if self.valid < stop:
+            k = self.valid
+            self.sum_dt[k+1:stop+1] = self.sum_dt[k] + np.cumsum(self.dt[k:stop])
+            self.sum_torque[k+1:stop+1] = self.sum_torque[k] + np.cumsum(self.dt[k:stop, np.newaxis]*self.torque[k:stop], axis=0)
+            self.valid = stop
+
+    def WindowTorque(self, start_time, step):
+        """
+        Returns the time-averaged torque of every turbine over the steps
+        from start_time up to and including step.
+        """
+        if self.window_start != start_time or self.window_step >= self.num_steps:
+            self.window_step = np.searchsorted(self.time[:self.num_steps], start_time)
+            self.window_start = start_time
+
+        self.Accumulate(step+1)
+        first = self.window_step
+
+        return (self.sum_torque[step+1]-self.sum_torque[first])/(self.sum_dt[step+1]-self.sum_dt[first])
+
+
+class ActuatorLineDiagnostics(object):
+    """
+    Buffers the angle of attack and rotor-plane forces of each alm turbine
+    in memory and writes them to disk in blocks. Only the rank that owns a
+    turbine records it, and each flush appends a single npy record to that
+    turbine's files, which can be turned back into csv with
+    :meth:`ConvertALMDiagnosticsToCSV`.
+
+    Args:
+        aoa_files (list): the angle of attack file of each turbine
+        force_files (list): the x, y, and z force files of each turbine
+        owner_rank (array): the rank that records each turbine
+        rank (int): the rank of this process
+        num_values (int): number of actuator nodes per turbine
+        interval (int): number of steps buffered before writing to disk
+        convert_csv (bool): also write csv files when finalizing
+        num_blades (int): number of blades per rotor, used to label the csv columns
+    """
+    def __init__(self, aoa_files, force_files, owner_rank, rank, num_values, interval, convert_csv=True, num_blades=3):
+        self.files = [[aoa_files[i]]+list(force_files[i]) for i in range(len(aoa_files))]
+        self.owned = [int(owner) == rank for owner in owner_rank]
+        self.interval = max(int(interval), 1)
+        self.convert_csv = convert_csv
+        self.num_blades = num_blades
+
+        ### Each row holds the time followed by the value at every actuator node ###
+        num_turbs = len(self.files)
+        self.buffer = np.zeros((num_turbs, 4, self.interval, 1+num_values))
+        self.count = np.zeros(num_turbs, dtype=int)
+        self.last_step = -np.ones(num_turbs, dtype=int)
+
+        ### Start from fresh files ###
+        for i in range(num_turbs):
+            if self.owned[i]:
+                for path in self.files[i]:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def Record(self, turb_i, step, simTime, aoa, rotor_plane_force):
+        if not self.owned[turb_i]:
+            return
+
+        ### A repeated call for the same step replaces the previous row ###
+        if step != self.last_step[turb_i] or self.count[turb_i] == 0:
+            if self.count[turb_i] == self.interval:
+                self.Flush(turb_i)
+            self.count[turb_i] += 1
+            self.last_step[turb_i] = step
+
+        row = self.buffer[turb_i, :, self.count[turb_i]-1]
+        row[:, 0] = simTime
+        row[0, 1:] = np.ravel(aoa)
+        for j in range(3):
+            row[j+1, 1:] = np.ravel(rotor_plane_force[..., j])
+
+    def Flush(self, turb_i=None):
+        if turb_i is None:
+            for i in range(len(self.files)):
+                self.Flush(i)
+            return
+
+        if not self.owned[turb_i] or self.count[turb_i] == 0:
+            return
+
+        for j, path in enumerate(self.files[turb_i]):
+            with open(path, 'ab') as fp:
+                np.save(fp, self.buffer[turb_i, j, :self.count[turb_i]])
+        self.count[turb_i] = 0
+
+    def Finalize(self):
+        self.Flush()
+
+        if self.convert_csv:
+            for i in range(len(self.files)):
+                if self.owned[i]:
+                    for path in self.files[i]:
+                        if os.path.exists(path):
+                            ConvertALMDiagnosticsToCSV(path, num_blades=self.num_blades)
+
+
+def ConvertALMDiagnosticsToCSV(npy_file, csv_file=None, num_blades=3):
+    """
+    Converts an alm diagnostics file written by :meth:`ActuatorLineDiagnostics`
+    into the csv layout used for the angle of attack and rotor force output.
+
+    Args:
+        npy_file (str): the file containing the npy records
+        csv_file (str): the output location, defaults to npy_file with a .csv extension
+        num_blades (int): the number of blades per rotor
+    """
+    if csv_file is None:
+        csv_file = os.path.splitext(npy_file)[0]+".csv"
+
+    ### Read every block appended to the file ###
+    blocks = []
+    file_size = os.path.getsize(npy_file)
+    with open(npy_file, 'rb') as fp:
+        while fp.tell() < file_size:
+            blocks.append(np.load(fp))
+    data = np.vstack(blocks)
+
+    num_blade_segments = int((np.shape(data)[1]-1)/num_blades)
+    header = 'time, '
+    for j in range(num_blades):
+        for k in range(num_blade_segments):
+            header += 'r%d_n%03d, ' % (j, k)
+
+    fp = open(csv_file, 'w')
+    fp.write(header+'\n')
+    for row in data:
+        fp.write(''.join('%.5f, ' % (val) for val in row)+'\n')
+    fp.close()
+
+
+#================================================================
 
+def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_i, dfd=None, verbose=False, project=True):
 
-    fa = open(problem.aoa_files[turb_i], 'a')
-    fx = open(problem.force_files[turb_i][0], 'a')
-    fy = open(problem.force_files[turb_i][1], 'a')
-    fz = open(problem.force_files[turb_i][2], 'a')
 
-    fa.write('%.5f, ' % (simTime))
-    fx.write('%.5f, ' % (simTime))
-    fy.write('%.5f, ' % (simTime))
-    fz.write('%.5f, ' % (simTime))
 
+    simTime = problem.alm_history.Time(simTime_id)
+    # print("debug data:", simTime,  mpi_u_fluid_constant.values())
 
 
     if verbose:
@@ -391,13 +1357,6 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
 
         return Rx
 
-    def rot_y(theta):
-        Ry = np.array([[np.cos(theta), 0, np.sin(theta)],
-                       [0, 1, 0],
-                       [-np.sin(theta), 0, np.cos(theta)]])
-        
-        return Ry
-
     def rot_z(theta):
         Rz = np.array([[np.cos(theta), -np.sin(theta), 0],
                        [np.sin(theta), np.cos(theta), 0],
@@ -405,120 +1364,31 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
         
         return Rz
 
-    def write_lift_and_drag(fn, simTime, theta, forceVec):
-        fp = open('./output/%s/nodal_%s.csv' % (problem.params.name, fn), 'a')
-        fp.write('%.5e, %.5e, ' % (simTime, theta))
-
-        N = np.size(forceVec)
-
-        for j in range(N):
-            if j < N-1:
-                fp.write('%.5e, ' % (forceVec[j]))
-            else:
-                fp.write('%.5e\n' % (forceVec[j]))
-        fp.close()
-
-    def save_derivative_file(folder,filename, deriv_array):
-
-        dolfin_function = Function(problem.fs.V)
-
-        fp = File(folder+'%s.pvd' % (filename))
-
-        for k in range(problem.num_blade_segments):
-            vec = np.copy(deriv_array[:, k])
-
-            # Zero-out all very small values (<1e-12)
-            vec[np.abs(vec) < 1e-12] = 0.0
-
-            # Set the values of the dolfin function being saved
-            dolfin_function.vector()[:] = vec
-
-            # Rename the function for ParaView naming consistency
-            dolfin_function.rename(filename, filename)
-
-            # Save the function            
-            fp << (dolfin_function, k)
-
-    def build_lift_and_drag(problem, u_rel, blade_unit_vec, rdim, twist, c):
-
-        def get_angle_between_vectors(a, b, n):
-            a_x_b = np.dot(np.cross(n, a), b)
+    def d_rot_z(theta):
+        dRz = np.array([[-np.sin(theta), -np.cos(theta), 0],
+                        [np.cos(theta), -np.sin(theta), 0],
+                        [0, 0, 0]])
 
-            norm_a = np.sqrt(a[0]*a[0] + a[1]*a[1] + a[2]*a[2])
-            norm_b = np.sqrt(b[0]*b[0] + b[1]*b[1] + b[2]*b[2])
+        return dRz
 
-            c1 = a_x_b/(norm_a*norm_b)
-            c1 = np.clip(c1, -1.0, 1.0)
-            aoa_1 = np.arcsin(c1)
+    def gaussian_support(node_pos):
+        # Find the mesh points within the truncation radius of any actuator node,
+        # every other point receives a negligible force and can be skipped
+        support_radius = problem.farm.gauss_cutoff*eps
+        near_ids = problem.coords_tree.query_ball_point(node_pos.T, support_radius)
+        local_ids = np.unique(np.concatenate(near_ids)).astype(int)
+        local_coords = problem.coords[local_ids]
 
-            c2 = np.dot(a, b)/(norm_a*norm_b)
-            c2 = np.clip(c2, -1.0, 1.0)
-            aoa_2 = np.arccos(c2)
-            
-            if aoa_2 > np.pi/2.0:
-                if aoa_1 < 0:
-                    aoa_1 = -np.pi - aoa_1
-                else:
-                    aoa_1 = np.pi - aoa_1
-            
-            aoa_1_deg = aoa_1/np.pi*180.0
-            
-            return aoa_1
+        # Squared distance between every nearby mesh point and every actuator node, [numLocalPts x num_nodes]
+        dist2 = ((local_coords[:, 0:1] - node_pos[0])**2 +
+                 (local_coords[:, 1:2] - node_pos[1])**2 +
+                 (local_coords[:, 2:3] - node_pos[2])**2)
 
+        # Calculate the kernel weight at every nearby mesh point due to every node [numLocalPts x num_nodes]
+        gaussian = np.exp(-dist2/eps**2)
+        gaussian[dist2 > support_radius**2] = 0.0
 
-        # If this is the first time calling the function...
-        # if problem.first_call_to_alm: # This breaks in parallel, use the version below
-
-        if not hasattr(problem, 'interp_lift'):
-            # build the lift-drag table interpolators
-            rdim_all = np.linspace(0, rdim[-1], np.shape(problem.lift_table)[1])
-            problem.interp_lift = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.lift_table)
-            problem.interp_drag = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.drag_table)
-
-
-        # Initialize the real cl and cd profiles
-        real_cl = np.zeros(problem.num_blade_segments)
-        real_cd = np.zeros(problem.num_blade_segments)
-
-        # fp = open(problem.aoa_file, 'a')
-
-        tip_loss = np.zeros(problem.num_blade_segments)
-
-        for k in range(problem.num_blade_segments):
-            # Get the relative wind velocity at this node
-            wind_vec = u_rel[:, k]
-
-            # Remove the component in the radial direction (along the blade span)
-            wind_vec -= np.dot(wind_vec, blade_unit_vec[:, 1])*blade_unit_vec[:, 1]
-
-            # aoa = get_angle_between_vectors(arg1, arg2, arg3)
-            # arg1 = in-plane vector pointing opposite rotation (blade sweep direction)
-            # arg2 = relative wind vector at node k, including blade rotation effects (wind direction)
-            # arg3 = unit vector normal to plane of rotation, in this case, radially along span
-            aoa = get_angle_between_vectors(-blade_unit_vec[:, 2], wind_vec, -blade_unit_vec[:, 1])
-
-            # Compute tip-loss factor
-            if rdim[k] < 1e-12:
-                tip_loss[k] = 1.0
-            else:
-                loss_exponent = 3.0/2.0*(rdim[-1]-rdim[k])/(rdim[k]*np.sin(aoa))
-                acos_arg = np.exp(-loss_exponent)
-                acos_arg = np.clip(acos_arg, -1.0, 1.0)
-                tip_loss[k] = 2.0/np.pi*np.arccos(acos_arg)
-
-            # Remove the portion of the angle due to twist
-            aoa -= twist[k]
-
-            # Store the cl and cd by interpolating this (aoa, span) pair from the tables
-            real_cl[k] = problem.interp_lift(aoa, rdim[k])
-            real_cd[k] = problem.interp_drag(aoa, rdim[k])
-
-            # Write the aoa to a file for future reference
-            fa.write('%.5f, ' % (aoa/np.pi*180.0))
-
-        # fp.close()
-        return real_cl, real_cd, tip_loss
-
+        return local_ids, local_coords, gaussian
 
     #================================================================
     # Get Mesh Properties
@@ -526,12 +1396,8 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
 
     ndim = problem.dom.dim
 
-    # Initialize a cumulative turbine force function (contains all turbines)
-    tf = Function(problem.fs.V)
-    tf.vector()[:] = 0.0
-
-    # Initialize a cylindrical field function
-    cyld = Function(problem.fs.V)
+    # Buffers and constant geometry reused between calls
+    workspace = problem.alm_workspace
 
     #================================================================
     # Set Turbine and Fluid Properties
@@ -541,7 +1407,7 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
     rho = 1.0
 
     # Set the number of blades in the turbine
-    num_blades = 3
+    num_blades = workspace.num_blades
 
     # Width of Gaussian
     # Note: this sets the gaussian width to roughly twice the minimum cell length scale
@@ -550,6 +1416,10 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
     # initialize numpy torque
     rotor_torque_numpy_temp = 0.0
 
+    # Actuator nodes handed back when not projecting, empty if this turbine is too far away
+    node_pos = np.zeros((3, 0))
+    node_force = np.zeros((0, 3))
+
     # Blade length (turbine radius)
     L = problem.farm.radius[turb_i]
 
@@ -557,42 +1427,17 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
     # Set Derived Constants
     #================================================================
 
-    # Calculate the radial position of each actuator node
-    rdim = np.linspace(0.0, L, problem.num_blade_segments)
-
-    # Calculate width of an individual blade segment
-    # w = rdim[1] - rdim[0]
-    w = (rdim[1] - rdim[0])*np.ones(problem.num_blade_segments)
-    w[0] = w[0]/2.0
-    w[-1] = w[-1]/2.0
-
-    # Calculate an array describing the x, y, z position of each actuator node
-    # Note: The basic blade is oriented along the +y-axis
-    blade_pos_base = np.vstack((np.zeros(problem.num_blade_segments),
-                        rdim,
-                        np.zeros(problem.num_blade_segments)))
-
-    # Calculate the blade velocity
-    angular_velocity = 2.0*np.pi*problem.rpm/60.0
-    tip_speed = angular_velocity*L
-    # tip_speed = 9.0
-
-    # Specify the velocity vector at each actuator node
-    # Note: A blade with span oriented along the +y-axis moves in the +z direction
-    blade_vel_base = np.vstack((np.zeros(problem.num_blade_segments),
-                           np.zeros(problem.num_blade_segments),
-                           np.linspace(0.0, tip_speed, problem.num_blade_segments)))
+    # Radial position and width of each actuator node, and the position and velocity of the basic blade
+    rdim, w, blade_pos_base, blade_vel_base = workspace.Geometry(turb_i, L, problem.rpm)
 
     # Set the spacing pf each blade
-    theta_vec = np.linspace(0.0, 2.0*np.pi, num_blades, endpoint = False)
+    theta_vec = workspace.theta_vec
 
     # Create unit vectors aligned with blade geometry
     # blade_unit_vec_base[:, 0] = points along rotor shaft
     # blade_unit_vec_base[:, 1] = points along blade span axis
     # blade_unit_vec_base[:, 2] = points tangential to blade span axis (generates a torque about rotor shaft)
-    blade_unit_vec_base = np.array([[1.0, 0.0, 0.0],
-                               [0.0, 1.0, 0.0],
-                               [0.0, 0.0, 1.0]])
+    blade_unit_vec_base = workspace.blade_unit_vec_base
 
     #================================================================
     # Begin Calculating Turbine Forces
@@ -612,28 +1457,25 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
 
     # Initialze arrays depending on what this function will be returning
     if dfd is None:
-        tf_vec = np.zeros(np.size(problem.coords))
-        tf_vec_for_power = np.zeros(np.size(problem.coords))
-        lift_force = np.zeros((np.shape(problem.coords)[0], ndim))
-        drag_force = np.zeros((np.shape(problem.coords)[0], ndim))
+        if project:
+            tf = workspace.TurbineForceFunction(turb_i)
+            turbine_force = workspace.ResetTurbineForce()
 
-    elif dfd == 'c_lift':
-        cl = np.ones(problem.num_blade_segments)
-        dfd_c_lift = np.zeros((np.size(problem.coords), problem.num_blade_segments))
+    elif dfd in ['c_lift', 'c_drag', 'chord']:
+        if dfd == 'chord':
+            c = np.ones(problem.num_blade_segments)
+        dfd_array = np.zeros((np.size(problem.coords), problem.num_blade_segments))
 
-    elif dfd == 'c_drag':
-        cd = np.ones(problem.num_blade_segments)
-        dfd_c_drag = np.zeros((np.size(problem.coords), problem.num_blade_segments))
+    elif dfd == 'yaw':
+        dfd_array = np.zeros(np.size(problem.coords))
 
-    elif dfd == 'chord':
-        c = np.ones(problem.num_blade_segments)
-        dfd_chord = np.zeros((np.size(problem.coords), problem.num_blade_segments))
+    else:
+        raise ValueError("Cannot take the derivative with respect to: "+dfd)
 
 
     # Calculate the blade position based on current simTime and turbine RPM
-    period = 60.0/problem.rpm
     # theta_offset = simTime/period*2.0*np.pi
-    theta_offset = (simTime+0.5*dt)/period*2.0*np.pi
+    theta_offset = workspace.BladeAngle(simTime_id, dt)
     # theta_offset = 0.0
 
     # Convert the mpi_u_fluid Constant wrapper into a numpy array
@@ -642,1089 +1484,430 @@ def UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_
     mpi_u_fluid = mpi_u_fluid_buff.reshape(problem.farm.numturbs, -1)
 
 
-    # Treat each blade separately
-    for blade_ct, theta_0 in enumerate(theta_vec):
-        # If the minimum distance between this mesh and the turbine is >2*RD,
-        # don't need to account for this turbine
-        if problem.min_dist[turb_i] > 2.0*(2.0*L):
-            break
-
-        theta = theta_0 + theta_offset
+    # If the minimum distance between this mesh and the turbine is >2*RD,
+    # don't need to account for this turbine
+    if problem.min_dist[turb_i] <= 2.0*(2.0*L):
 
-        # Generate a rotation matrix for this turbine blade
-        Rx = rot_x(theta)
+        # Stack the rotation matrices of every blade, [num_blades x 3 x 3]
+        Rx = np.array([rot_x(theta_0 + theta_offset) for theta_0 in theta_vec])
         Rz = rot_z(float(problem.farm.myaw[turb_i]))
 
         # Rotate the blade velocity in the global x, y, z, coordinate system
         # Note: blade_vel_base is negative since we seek the velocity of the fluid relative to a stationary blade
         # and blade_vel_base is defined based on the movement of the blade
-        blade_vel = np.dot(Rz, np.dot(Rx, -blade_vel_base))
+        blade_vel = np.matmul(Rz, np.matmul(Rx, -blade_vel_base))
 
         # Rotate the blade unit vectors to be pointing in the rotated positions
-        blade_unit_vec = np.dot(Rz, np.dot(Rx, blade_unit_vec_base))
+        blade_unit_vec = np.matmul(Rz, np.matmul(Rx, blade_unit_vec_base))
 
-        # Rotate the entire [x; y; z] matrix using this matrix, then shift to the hub location
-        blade_pos = np.dot(Rz, np.dot(Rx, blade_pos_base))
-        blade_pos[0, :] += problem.farm.x[turb_i]
-        blade_pos[1, :] += problem.farm.y[turb_i]
-        blade_pos[2, :] += problem.farm.z[turb_i]
+        # Rotate the entire [x; y; z] matrix of every blade, then shift to the hub location
+        blade_pos = np.matmul(Rz, np.matmul(Rx, blade_pos_base))
+        blade_pos[:, 0, :] += problem.farm.x[turb_i]
+        blade_pos[:, 1, :] += problem.farm.y[turb_i]
+        blade_pos[:, 2, :] += problem.farm.z[turb_i]
 
-        time_offset = 1
-        if simTime_id < time_offset:
-            theta_behind = theta_0 + 0.5*(problem.simTime_list[simTime_id]+simTime)/period*2.0*np.pi
-        else:
-            theta_behind = theta_0 + 0.5*(problem.simTime_list[simTime_id-time_offset]+simTime)/period*2.0*np.pi
-            # if blade_ct == 0:
-            #     print('SimTime = %f, using %f' % (simTime, problem.simTime_list[-time_offset]))
-
-        Rx_alt = rot_x(theta_behind)
-        blade_pos_alt = np.dot(Rz, np.dot(Rx_alt, blade_pos_base))
-        blade_pos_alt[0, :] += problem.farm.x[turb_i]
-        blade_pos_alt[1, :] += problem.farm.y[turb_i]
-        blade_pos_alt[2, :] += problem.farm.z[turb_i]
-
-        # Initialize space to hold the fluid velocity at each actuator node
-        u_fluid = np.zeros((3, problem.num_blade_segments))
+        for blade_ct in range(num_blades):
+            problem.blade_pos_previous[blade_ct] = blade_pos[blade_ct]
 
         # Read values from mpi_u_fluid (a [num_turbs x 3_dim*3_rotors*num_blade_segments] numpy array)
-        start_pt = blade_ct*3*problem.num_blade_segments
-        end_pt = start_pt + 3*problem.num_blade_segments
-        u_fluid = mpi_u_fluid[turb_i, start_pt:end_pt]
-        u_fluid = np.reshape(u_fluid, (3, -1), 'F')
-
-        # Print u_fluid and verify it's the same as from dev (or can be made the same)
-        # u_fluid[0, :] = 10.0
-        # u_fluid[1, :] = 0.0
-        # u_fluid[2, :] = 0.0
-
-        for k in range(problem.num_blade_segments):
-            u_fluid[:, k] -= np.dot(u_fluid[:, k], blade_unit_vec[:, 1])*blade_unit_vec[:, 1]
-
-        # print(u_fluid)
-        # print('MPI sim time = %.15e' % (simTime))
+        # and arrange them as [num_blades x 3 x num_blade_segments]
+        u_fluid = mpi_u_fluid[turb_i].reshape(num_blades, problem.num_blade_segments, 3)
+        u_fluid = np.transpose(u_fluid, (0, 2, 1))
+        u_fluid_sampled = u_fluid
+
+        # Remove the component of the fluid velocity along the blade span
+        # Note: a stacked matmul evaluates each 3-component dot product exactly like np.dot
+        span_unit_vec = blade_unit_vec[:, :, 1]
+        u_fluid_span = np.matmul(np.transpose(u_fluid, (0, 2, 1))[:, :, np.newaxis, :],
+                                 span_unit_vec[:, np.newaxis, :, np.newaxis])[:, :, 0, 0]
+        u_fluid = u_fluid - u_fluid_span[:, np.newaxis, :]*span_unit_vec[:, :, np.newaxis]
 
-        problem.blade_pos_previous[blade_ct] = blade_pos
-                        
         # Form the total relative velocity vector (including velocity from rotating blade)
         u_rel = u_fluid + blade_vel
 
-
-        u_rel_mag = np.linalg.norm(u_rel, axis=0)
+        u_rel_mag = np.linalg.norm(u_rel, axis=1)
         u_rel_mag[u_rel_mag < 1e-6] = 1e-6
-        u_unit_vec = u_rel/u_rel_mag
-        
+        u_unit_vec = u_rel/u_rel_mag[:, np.newaxis, :]
 
-        cl, cd, tip_loss = build_lift_and_drag(problem, u_rel, blade_unit_vec, rdim, twist, c)
+        if dfd == 'yaw':
+            # Carry the derivative with respect to yaw forward through every step below
+            # Note: the hub and the sampled fluid velocities do not move with yaw
+            dRz = d_rot_z(float(problem.farm.myaw[turb_i]))
+            d_blade_vel = np.matmul(dRz, np.matmul(Rx, -blade_vel_base))
+            d_blade_unit_vec = np.matmul(dRz, np.matmul(Rx, blade_unit_vec_base))
+            d_blade_pos = np.matmul(dRz, np.matmul(Rx, blade_pos_base))
 
-        
-        # Calculate the lift and drag forces using the relative velocity magnitude
-        lift = tip_loss*(0.5*cl*rho*c*w*u_rel_mag**2)
-        drag = tip_loss*(0.5*cd*rho*c*w*u_rel_mag**2)
+            d_span_unit_vec = d_blade_unit_vec[:, :, 1]
+            d_u_fluid_span = np.einsum('bik,bi->bk', u_fluid_sampled, d_span_unit_vec)
+            d_u_fluid = -(d_u_fluid_span[:, np.newaxis, :]*span_unit_vec[:, :, np.newaxis] +
+                          u_fluid_span[:, np.newaxis, :]*d_span_unit_vec[:, :, np.newaxis])
 
-        # Tile the blade coordinates for every mesh point, [numGridPts*ndim x problem.num_blade_segments]
-        blade_pos_full = np.tile(blade_pos, (np.shape(problem.coords)[0], 1))
+            d_u_rel = d_u_fluid + d_blade_vel
+            d_u_rel_mag = np.sum(u_rel*d_u_rel, axis=1)/u_rel_mag
+            d_u_unit_vec = (d_u_rel - u_unit_vec*d_u_rel_mag[:, np.newaxis, :])/u_rel_mag[:, np.newaxis, :]
 
-        # Subtract and square to get the dx^2 values in the x, y, and z directions
-        dx_full = (problem.coordsLinear - blade_pos_full)**2
+            aoa, cl, cd, tip_loss, d_aoa, d_cl, d_cd, d_tip_loss = BladeElementCoefficients(
+                problem, u_rel, blade_unit_vec, rdim, L, twist, d_u_rel=d_u_rel, d_blade_unit_vec=d_blade_unit_vec)
 
-        # Add together to get |x^2 + y^2 + z^2|^2
-        dist2 = dx_full[0::ndim] + dx_full[1::ndim] + dx_full[2::ndim]
+            d_lift = 0.5*rho*c*w*((d_tip_loss*cl + tip_loss*d_cl)*u_rel_mag**2 + 2.0*tip_loss*cl*u_rel_mag*d_u_rel_mag)
+            d_drag = 0.5*rho*c*w*((d_tip_loss*cd + tip_loss*d_cd)*u_rel_mag**2 + 2.0*tip_loss*cd*u_rel_mag*d_u_rel_mag)
 
-        # Calculate the force magnitude at every mesh point due to every node [numGridPts x NumActuators]
-        nodal_lift = lift*np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
-        nodal_drag = drag*np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
+        else:
+            # Look up the lift and drag coefficients of every segment of every blade, [num_blades x num_blade_segments]
+            aoa, cl, cd, tip_loss = BladeElementCoefficients(problem, u_rel, blade_unit_vec, rdim, L, twist)
 
-        for k in range(problem.num_blade_segments):
-            # The drag unit simply points opposite the relative velocity unit vector
-            drag_unit_vec = -np.copy(u_unit_vec[:, k])
-            
-            # The lift is normal to the plane generated by the blade and relative velocity
-            lift_unit_vec = np.cross(drag_unit_vec, blade_unit_vec[:, 1])
 
-            # All force magnitudes get multiplied by the correctly-oriented unit vector
-            vector_nodal_lift = np.outer(nodal_lift[:, k], lift_unit_vec)
-            vector_nodal_drag = np.outer(nodal_drag[:, k], drag_unit_vec)
+        # Calculate the lift and drag forces using the relative velocity magnitude
+        lift = tip_loss*(0.5*cl*rho*c*w*u_rel_mag**2)
+        drag = tip_loss*(0.5*cd*rho*c*w*u_rel_mag**2)
 
-            # print('MPI vec norm = %.15e' % np.linalg.norm(vector_nodal_lift))
-            # print('MPI vec norm = %.15e' % np.linalg.norm(vector_nodal_drag))
+        # The drag unit simply points opposite the relative velocity unit vector
+        # and the lift is normal to the plane generated by the blade and relative velocity,
+        # [num_blades x num_blade_segments x 3]
+        drag_unit_vec = -np.transpose(u_unit_vec, (0, 2, 1))
+        lift_unit_vec = np.cross(drag_unit_vec, span_unit_vec[:, np.newaxis, :])
+
+        # Compute the total force vector [x, y, z] at each actuator node
+        # Note: since this will be used to define the force (torque) from fluid -> blade
+        # we reverse the direction that otherwise gives the turbine force from blade -> fluid
+        actuator_force = -(lift[:, :, np.newaxis]*lift_unit_vec + drag[:, :, np.newaxis]*drag_unit_vec)
+
+        # Express the actuator forces in the blade-aligned coordinate system, [num_blades x num_blade_segments x 3]
+        rotor_plane_force = np.matmul(actuator_force, blade_unit_vec)
+
+        # Record the aoa and rotor forces of the forward solve for future reference
+        if dfd == None:
+            problem.alm_diagnostics.Record(turb_i, simTime_id, simTime, aoa/np.pi*180.0, rotor_plane_force)
+
+        # Multiply the tangential component by the distance away from the hub to get the torque
+        rotor_torque_numpy_temp = np.sum(rotor_plane_force[:, :, 2]*rdim)
+
+        # Flatten the actuator nodes of every blade into a single list, [3 x num_blades*num_blade_segments]
+        num_nodes = num_blades*problem.num_blade_segments
+        node_pos = np.transpose(blade_pos, (1, 0, 2)).reshape(3, num_nodes)
+
+        if project:
+            # Calculate the force magnitude at every nearby mesh point due to every node [numLocalPts x num_nodes]
+            local_ids, local_coords, gaussian = gaussian_support(node_pos)
+            nodal_lift = lift.reshape(num_nodes)*gaussian/(eps**3 * np.pi**1.5)
+            nodal_drag = drag.reshape(num_nodes)*gaussian/(eps**3 * np.pi**1.5)
+
+        if dfd == None and not project:
+            # Leave the projection to the caller, which only needs the total force of each node [num_nodes x 3]
+            node_force = (lift[:, :, np.newaxis]*lift_unit_vec + drag[:, :, np.newaxis]*drag_unit_vec).reshape(num_nodes, 3)
+
+        elif dfd == None:
+            # Project every node onto the mesh with a single product over the node axis, [numLocalPts x ndim]
+            lift_force = nodal_lift @ lift_unit_vec.reshape(num_nodes, 3)
+            drag_force = nodal_drag @ drag_unit_vec.reshape(num_nodes, 3)
+
+            # The total turbine force is the sum of lift and drag effects, remove near-zero values
+            local_force = drag_force + lift_force
+            local_force[np.abs(local_force) < 1e-12] = 0.0
+            turbine_force[local_ids] = local_force
+            workspace.touched_ids = local_ids
+
+        elif dfd == 'yaw':
+            # Differentiate the unit vectors and the gaussian weights through the rotated node positions
+            d_drag_unit_vec = -np.transpose(d_u_unit_vec, (0, 2, 1))
+            d_lift_unit_vec = (np.cross(d_drag_unit_vec, span_unit_vec[:, np.newaxis, :]) +
+                               np.cross(drag_unit_vec, d_span_unit_vec[:, np.newaxis, :]))
+
+            d_node_pos = np.transpose(d_blade_pos, (1, 0, 2)).reshape(3, num_nodes)
+            d_dist2 = -2.0*((local_coords[:, 0:1] - node_pos[0])*d_node_pos[0] +
+                            (local_coords[:, 1:2] - node_pos[1])*d_node_pos[1] +
+                            (local_coords[:, 2:3] - node_pos[2])*d_node_pos[2])
+            d_gaussian = -gaussian*d_dist2/eps**2
+
+            d_nodal_lift = (d_lift.reshape(num_nodes)*gaussian + lift.reshape(num_nodes)*d_gaussian)/(eps**3 * np.pi**1.5)
+            d_nodal_drag = (d_drag.reshape(num_nodes)*gaussian + drag.reshape(num_nodes)*d_gaussian)/(eps**3 * np.pi**1.5)
+
+            # Project the derivative of every node onto the mesh, [numLocalPts x ndim]
+            dfd_array.reshape(-1, ndim)[local_ids] = (np.dot(d_nodal_lift, lift_unit_vec.reshape(num_nodes, 3)) +
+                                                      np.dot(nodal_lift, d_lift_unit_vec.reshape(num_nodes, 3)) +
+                                                      np.dot(d_nodal_drag, drag_unit_vec.reshape(num_nodes, 3)) +
+                                                      np.dot(nodal_drag, d_drag_unit_vec.reshape(num_nodes, 3)))
 
-            if dfd == None:
-                lift_force += vector_nodal_lift
-                drag_force += vector_nodal_drag
+        else:
+            # Keep each segment separate and sum over the blades, [numLocalPts x num_blades x ndim x num_blade_segments]
+            nodal_lift = nodal_lift.reshape(-1, num_blades, 1, problem.num_blade_segments)
+            nodal_drag = nodal_drag.reshape(-1, num_blades, 1, problem.num_blade_segments)
+            lift_unit_seg = np.transpose(lift_unit_vec, (0, 2, 1))[np.newaxis, :, :, :]
+            drag_unit_seg = np.transpose(drag_unit_vec, (0, 2, 1))[np.newaxis, :, :, :]
 
-            elif dfd == 'c_lift':
-                for j in range(ndim):
-                    dfd_c_lift[j::ndim, k] += vector_nodal_lift[:, j]
+            if dfd == 'c_lift':
+                dfd_nodal = np.sum(nodal_lift*lift_unit_seg, axis=1)
 
             elif dfd == 'c_drag':
-                for j in range(ndim):
-                    dfd_c_drag[j::ndim, k] += vector_nodal_drag[:, j]
+                dfd_nodal = np.sum(nodal_drag*drag_unit_seg, axis=1)
 
             elif dfd == 'chord':
-                for j in range(ndim):
-                    dfd_chord[j::ndim, k] += vector_nodal_lift[:, j] + vector_nodal_drag[:, j]
-
-            # Compute the total force vector [x, y, z] at a single actuator node
-            actuator_lift = lift[k]*lift_unit_vec
-            actuator_drag = drag[k]*drag_unit_vec
-
-            # Note: since this will be used to define the force (torque) from fluid -> blade
-            # we reverse the direction that otherwise gives the turbine force from blade -> fluid
-            actuator_force = -(actuator_lift + actuator_drag)
-            # actuator_force = -(actuator_lift - actuator_drag)
-
-            # Find the component in the direction tangential to the blade
-            tangential_actuator_force = np.dot(actuator_force, blade_unit_vec[:, 2])
-
-            rotor_plane_force = np.dot(actuator_force, blade_unit_vec)
-            fx.write('%.5f, ' % (rotor_plane_force[0]))
-            fy.write('%.5f, ' % (rotor_plane_force[1]))
-            fz.write('%.5f, ' % (rotor_plane_force[2]))
-
-            # Multiply by the distance away from the hub to get a torque
-            actuator_torque = tangential_actuator_force*rdim[k]
-
-            # Add to the total torque
-            rotor_torque_numpy_temp += actuator_torque  ### Should this be an output?
+                dfd_nodal = np.sum(nodal_lift*lift_unit_seg + nodal_drag*drag_unit_seg, axis=1)
 
+            # Riffle the x-, y-, and z-components into rows, [numGridPts*ndim x num_blade_segments]
+            dfd_array.reshape(-1, ndim, problem.num_blade_segments)[local_ids] = dfd_nodal
 
 
-    fx.write('\n')
-    fy.write('\n')
-    fz.write('\n')
-    fa.write('\n')
-    fx.close()
-    fy.close()
-    fz.close()
-    fa.close()
-
-    # Output the numpy version of rotor_torque
-    problem.rotor_torque[turb_i] = rotor_torque_numpy_temp
-    if rotor_torque_numpy_temp > 0:
-        problem.rotor_torque_count[turb_i] = 1
-
 
     if dfd == None:
-        # The total turbine force is the sum of lift and drag effects
-        turbine_force = drag_force + lift_force
-        turbine_force_for_power = -drag_force + lift_force
-
-        # print('MPI vec norm = %.15e' % np.linalg.norm(vector_nodal_lift))
-        # print('MPI vec norm = %.15e' % np.linalg.norm(turbine_force))
-
-        # Riffle-shuffle the x-, y-, and z-column force components
-        for k in range(ndim):
-            tf_vec[k::ndim] = turbine_force[:, k]
-            tf_vec_for_power[k::ndim] = turbine_force_for_power[:, k]
-
-        # Remove near-zero values
-        tf_vec[np.abs(tf_vec) < 1e-12] = 0.0
-
-        # Add to the cumulative turbine force
-        tf.vector()[:] += tf_vec
-
-        # Create a cylindrical expression aligned with the position of this turbine
-        cyld_expr = Expression(('sin(yaw)*(x[2]-zs)', '-cos(yaw)*(x[2]-zs)', '(x[1]-ys)*cos(yaw)-(x[0]-xs)*sin(yaw)'),
-            degree=1,
-            yaw=problem.farm.myaw[turb_i],
-            xs=problem.farm.mx[turb_i],
-            ys=problem.farm.my[turb_i],
-            zs=problem.farm.z[turb_i])
-
-
-        temp_tor = assemble(dot(-tf, cyld_expr)*dx)
-        problem.rotor_torque_dolfin[turb_i] = temp_tor
-        problem.rotor_torque_dolfin_time[simTime_id] = temp_tor
-
-
-        problem.cyld_expr_list[turb_i] = cyld_expr
-        problem.cyld = cyld
+        # Output the numpy version of rotor_torque
+        problem.rotor_torque[turb_i] = rotor_torque_numpy_temp
+        if rotor_torque_numpy_temp > 0:
+            problem.rotor_torque_count[turb_i] = 1
 
     problem.first_call_to_alm = False
 
-    tf.vector().update_ghost_values()
-
-    if dfd == None:
-
-        return tf
-
-    elif dfd == 'c_lift':
-        save_c_lift = False
-
-        if save_c_lift:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdcl', dfd_c_lift)
-
-        return dfd_c_lift
+    if dfd == None and not project:
 
-    elif dfd == 'c_drag':
-        save_c_drag = False
+        return node_pos, node_force
 
-        if save_c_drag:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdcd', dfd_c_drag)
+    elif dfd == None:
+        # Riffle-shuffle the x-, y-, and z-column force components into the turbine force
+        tf.vector()[:] = turbine_force.reshape(-1)
 
-        return dfd_c_drag
+        RecordActuatorLineTorque(problem, tf, simTime_id, turb_i)
 
-    elif dfd == 'chord':
-        save_chord = False
+        tf.vector().update_ghost_values()
 
-        if save_chord:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdchord', dfd_chord)
+        return tf
 
-        return dfd_chord
+    else:
+        return dfd_array
 
 
 #================================================================
 
-def UpdateActuatorLineForce_deprecated(problem, u_local, simTime_id, dt, turb_i, mpi_u_fluid, dfd=None, verbose=False):
-
-    simTime = problem.simTime_list[simTime_id]
-
-    fa = open(problem.aoa_files[turb_i], 'a')
-    fx = open(problem.force_files[turb_i][0], 'a')
-    fy = open(problem.force_files[turb_i][1], 'a')
-    fz = open(problem.force_files[turb_i][2], 'a')
-
-    fa.write('%.5f, ' % (simTime))
-    fx.write('%.5f, ' % (simTime))
-    fy.write('%.5f, ' % (simTime))
-    fz.write('%.5f, ' % (simTime))
-
-    if verbose:
-        print("Current Optimization Time: "+repr(simTime)+", Turbine #"+repr(turb_i))
-        sys.stdout.flush()
-
-    def rot_x(theta):
-        Rx = np.array([[1, 0, 0],
-                       [0, np.cos(theta), -np.sin(theta)],
-                       [0, np.sin(theta), np.cos(theta)]])
-
-        return Rx
-
-    def rot_y(theta):
-        Ry = np.array([[np.cos(theta), 0, np.sin(theta)],
-                       [0, 1, 0],
-                       [-np.sin(theta), 0, np.cos(theta)]])
-        
-        return Ry
-
-    def rot_z(theta):
-        Rz = np.array([[np.cos(theta), -np.sin(theta), 0],
-                       [np.sin(theta), np.cos(theta), 0],
-                       [0, 0, 1]])
-        
-        return Rz
-
-    def write_lift_and_drag(fn, simTime, theta, forceVec):
-        fp = open('./output/%s/nodal_%s.csv' % (problem.params.name, fn), 'a')
-        fp.write('%.5e, %.5e, ' % (simTime, theta))
-
-        N = np.size(forceVec)
-
-        for j in range(N):
-            if j < N-1:
-                fp.write('%.5e, ' % (forceVec[j]))
-            else:
-                fp.write('%.5e\n' % (forceVec[j]))
-        fp.close()
-
-    def save_derivative_file(folder,filename, deriv_array):
-
-        dolfin_function = Function(problem.fs.V)
-
-        fp = File(folder+'%s.pvd' % (filename))
-
-        for k in range(problem.num_blade_segments):
-            vec = np.copy(deriv_array[:, k])
-
-            # Zero-out all very small values (<1e-12)
-            vec[np.abs(vec) < 1e-12] = 0.0
-
-            # Set the values of the dolfin function being saved
-            dolfin_function.vector()[:] = vec
-
-            # Rename the function for ParaView naming consistency
-            dolfin_function.rename(filename, filename)
-
-            # Save the function            
-            fp << (dolfin_function, k)
-
-    # def merge_interpolated(global_interp, data_in, ni):
-
-    #     for k in range(ni):
-    #         if not np.isnan(data_in[0, k]):
-    #             global_interp[:, k] = data_in[:, k]
-
-    #     return global_interp
-
-
-    # def build_parallel_u_fluid(blade_pos, problem, using_local_velocity, comm, rank, num_procs):
-
-    #     ni = np.shape(blade_pos)[1]
-
-    #     # An empty array to store the fluid velocities at each actuator node
-    #     interp_values = np.empty((3, ni))
-
-    #     for k in range(ni):
-
-    #         if using_local_velocity:
-    #             xi = blade_pos[0, k]
-    #         else:
-    #             xi = problem.dom.x_range[0]
-
-    #         yi = blade_pos[1, k]
-    #         zi = blade_pos[2, k]
-
-    #         # Try to access the fluid velocity at this actuator point
-    #         # If this rank doesn't own that point, an error will occur,
-    #         # in which case NaN should be reported
-    #         try:
-    #             fn_val = problem.u_k1(xi, yi, zi)
-    #         except:
-    #             fn_val = [np.nan, np.nan, np.nan]
-
-    #         # Store the interpolated value (even if NaN)
-    #         interp_values[:, k] = fn_val
-
-    #     # print('rank %d found:\n' % (rank), interp_values)
-
-    #     if num_procs > 1:
-    #         # Initialize empty array to hold everything
-    #         global_interp = np.zeros((3, ni))
-
-    #         if rank == 0:
-    #             for k in range(num_procs):
-    #                 if k == 0:
-    #                     # Add fluid velocities owned by rank zero
-    #                     global_interp = merge_interpolated(global_interp, interp_values, ni)
-
-    #                 else:
-    #                     # Receive values from rank k
-    #                     data_in = np.zeros((3, ni), dtype = float)
-    #                     comm.Recv(data_in, source = k)
-
-    #                     # Add fluid velocities owned by rank k
-    #                     global_interp = merge_interpolated(global_interp, data_in, ni)
-
-    #         else:
-    #             # Send interpolated values (even if NaN) to root
-    #             data_out = np.copy(interp_values)
-    #             comm.Send(data_out, dest = 0)
-
-    #         # Distribute the finished global array to all ranks from zero
-    #         comm.Bcast(global_interp, root=0)
-    #     else:
-    #         global_interp = np.copy(interp_values)
-
-
-    #     return global_interp
-
-    def build_lift_and_drag(problem, u_rel, blade_unit_vec, rdim, twist, c):
-
-        def get_angle_between_vectors(a, b, n):
-            a_x_b = np.dot(np.cross(n, a), b)
-
-            norm_a = np.sqrt(a[0]*a[0] + a[1]*a[1] + a[2]*a[2])
-            norm_b = np.sqrt(b[0]*b[0] + b[1]*b[1] + b[2]*b[2])
-
-            c1 = a_x_b/(norm_a*norm_b)
-            c1 = np.clip(c1, -1.0, 1.0)
-            aoa_1 = np.arcsin(c1)
-
-            c2 = np.dot(a, b)/(norm_a*norm_b)
-            c2 = np.clip(c2, -1.0, 1.0)
-            aoa_2 = np.arccos(c2)
-            
-            if aoa_2 > np.pi/2.0:
-                if aoa_1 < 0:
-                    aoa_1 = -np.pi - aoa_1
-                else:
-                    aoa_1 = np.pi - aoa_1
-            
-            aoa_1_deg = aoa_1/np.pi*180.0
-            
-            return aoa_1
-
-
-        # If this is the first time calling the function...
-        # if problem.first_call_to_alm: # This breaks in parallel, use the version below
-
-        if not hasattr(problem, 'interp_lift'):
-            # build the lift-drag table interpolators
-            rdim_all = np.linspace(0, rdim[-1], np.shape(problem.lift_table)[1])
-            problem.interp_lift = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.lift_table)
-            problem.interp_drag = interp.RectBivariateSpline(problem.interp_angles, rdim_all, problem.drag_table)
-
-
-        # Initialize the real cl and cd profiles
-        real_cl = np.zeros(problem.num_blade_segments)
-        real_cd = np.zeros(problem.num_blade_segments)
-
-
-
-        tip_loss = np.zeros(problem.num_blade_segments)
-
-        for k in range(problem.num_blade_segments):
-            # Get the relative wind velocity at this node
-            wind_vec = u_rel[:, k]
-
-            # Remove the component in the radial direction (along the blade span)
-            wind_vec -= np.dot(wind_vec, blade_unit_vec[:, 1])*blade_unit_vec[:, 1]
-
-            # aoa = get_angle_between_vectors(arg1, arg2, arg3)
-            # arg1 = in-plane vector pointing opposite rotation (blade sweep direction)
-            # arg2 = relative wind vector at node k, including blade rotation effects (wind direction)
-            # arg3 = unit vector normal to plane of rotation, in this case, radially along span
-            aoa = get_angle_between_vectors(-blade_unit_vec[:, 2], wind_vec, -blade_unit_vec[:, 1])
-
-            # Compute tip-loss factor
-            if rdim[k] < 1e-12:
-                tip_loss[k] = 1.0
-            else:
-                loss_exponent = 3.0/2.0*(rdim[-1]-rdim[k])/(rdim[k]*np.sin(aoa))
-                acos_arg = np.exp(-loss_exponent)
-                acos_arg = np.clip(acos_arg, -1.0, 1.0)
-                tip_loss[k] = 2.0/np.pi*np.arccos(acos_arg)
-
-            # Remove the portion of the angle due to twist
-            aoa -= twist[k]
-
-
-            # if np.abs(problem.farm.baseline_chord[k] - c[k]) > 1e-6:
-            #     # print('Chord differs from baseline at node %d:' % (k))
-            #     c_factor = c[k]/problem.farm.baseline_chord[k]
-
-            #     # Penalize by 10 degrees if the chord is doubled
-            #     penalty = c_factor*(np.pi*5.0/180.0)
-
-            #     aoa -= penalty
-
-            #     # real_cd[k] *= c_factor
-
-
-            # Store the cl and cd by interpolating this (aoa, span) pair from the tables
-            real_cl[k] = problem.interp_lift(aoa, rdim[k])
-            real_cd[k] = problem.interp_drag(aoa, rdim[k])
-
-
-
-            # Write the aoa to a file for future reference
-            fa.write('%.5f, ' % (aoa/np.pi*180.0))
-
-        return real_cl, real_cd, tip_loss
+def RecordActuatorLineTorque(problem, tf, simTime_id, turb_i, reduce=True):
+    """
+    Computes the torque that the force of turbine turb_i exerts about its
+    hub and stores the cylindrical expression used to do so. The integral
+    of dot(-tf, cyld_expr) reduces to a dot product with the turbine's
+    lumped lever-arm weights. With reduce=False only this rank's share is
+    stored, and :meth:`ReduceActuatorLineTorque` sums it later together
+    with the other turbines.
+    """
+    workspace = problem.alm_workspace
 
+    cyld_expr, torque_weights = workspace.LeverArm(turb_i)
+    workspace.local_torque[turb_i] = -np.dot(torque_weights, tf.vector().get_local())
 
-    #================================================================
-    # Get Mesh Properties
-    #================================================================
-
-    ndim = problem.dom.dim
-
-    # Get the coordinates of the vector function space
-    coords = problem.fs.V.tabulate_dof_coordinates()
-    coords = np.copy(coords[0::problem.dom.dim, :])
+    if reduce:
+        ReduceActuatorLineTorque(problem, simTime_id, [turb_i])
 
-    # Resape a linear copy of the coordinates for every mesh point
-    coordsLinear = np.copy(coords.reshape(-1, 1))
+    problem.cyld_expr_list[turb_i] = cyld_expr
+    problem.cyld = workspace.cyld
 
-    # Initialize a single turbine force function (contains only a single turbine for power calculations)
-    tf_individual = Function(problem.fs.V)
 
-    # Initialize a cumulative turbine force function (contains all turbines)
-    tf = Function(problem.fs.V)
-    tf.vector()[:] = 0.0
+def ReduceActuatorLineTorque(problem, simTime_id, turb_ids):
+    """
+    Sums the torque of the listed turbines over all ranks in one reduction.
+    """
+    local_torque = problem.alm_workspace.local_torque[turb_ids]
+    torque = np.zeros(len(local_torque))
+    problem.params.comm.Allreduce(local_torque, torque)
 
-    gaussian_fn = Function(problem.fs.Q)
-    gaussian_fn.vector()[:] = 0.0
+    problem.rotor_torque_dolfin[turb_ids] = torque
+    problem.alm_history.SetTorque(simTime_id, turb_ids, torque)
 
-    # Initialize a cylindrical field function
-    cyld = Function(problem.fs.V)
 
-    #================================================================
-    # Set Turbine and Fluid Properties
-    #================================================================
+def GaussianProjectionWeights(problem, node_pos):
+    """
+    Evaluates the truncated gaussian kernel of every actuator node at the
+    nearby mesh points.
 
-    # Set the density
-    rho = 1.0
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the coordinates
+        node_pos (array): position of every actuator node, [3 x num_nodes]
 
-    # Set the number of blades in the turbine
-    num_blades = 3
-
-    # Width of Gaussian
-    # Note: this sets the gaussian width to roughly twice the minimum cell length scale
+    Returns:
+        rows, cols, weights (arrays): the mesh point, node, and kernel weight of each nonzero
+    """
     eps = problem.gaussian_width
+    support_radius = problem.farm.gauss_cutoff*eps
 
-    # Initialize the sum of the torque on the rotor shaft to zero
-    # problem.rotor_torque = 0.0
-    # if not hasattr(problem,"rotor_torque"):
-    #     problem.rotor_torque = np.zeros(problem.farm.numturbs)
-    #     problem.rotor_torque_count = np.zeros(problem.farm.numturbs)
-    #     problem.rotor_torque_dolfin = np.zeros(problem.farm.numturbs)
-
-
-    # initialize numpy torque
-    rotor_torque_numpy_temp = 0.0
-
-    # for turb_i in range(problem.farm.numturbs):
-    # for turb_i in turb_index:
-    # print(turb_i)
-
-    # # Set the hub height
-    # hub_height = problem.farm.HH[turb_i]
-
-    # # Set the yaw of the turbine
-    # yaw = problem.farm.yaw[turb_i]
-
-    # Blade length (turbine radius)
-    L = problem.farm.radius[turb_i]
-
-    #================================================================
-    # Set Derived Constants
-    #================================================================
-
-    # Calculate the radial position of each actuator node
-    rdim = np.linspace(0.0, L, problem.num_blade_segments)
-
-    # Calculate width of an individual blade segment
-    # w = rdim[1] - rdim[0]
-    w = (rdim[1] - rdim[0])*np.ones(problem.num_blade_segments)
-    w[0] = w[0]/2.0
-    w[-1] = w[-1]/2.0
-
-    # Calculate an array describing the x, y, z position of each actuator node
-    # Note: The basic blade is oriented along the +y-axis
-    blade_pos_base = np.vstack((np.zeros(problem.num_blade_segments),
-                        rdim,
-                        np.zeros(problem.num_blade_segments)))
-
-    # Calculate the blade velocity
-    angular_velocity = 2.0*np.pi*problem.rpm/60.0
-    tip_speed = angular_velocity*L
-    # tip_speed = 9.0
-
-    # Specify the velocity vector at each actuator node
-    # Note: A blade with span oriented along the +y-axis moves in the +z direction
-    blade_vel_base = np.vstack((np.zeros(problem.num_blade_segments),
-                           np.zeros(problem.num_blade_segments),
-                           np.linspace(0.0, tip_speed, problem.num_blade_segments)))
-
-    # Set the spacing pf each blade
-    theta_vec = np.linspace(0.0, 2.0*np.pi, num_blades, endpoint = False)
-
-    # Create unit vectors aligned with blade geometry
-    # blade_unit_vec_base[:, 0] = points along rotor shaft
-    # blade_unit_vec_base[:, 1] = points along blade span axis
-    # blade_unit_vec_base[:, 2] = points tangential to blade span axis (generates a torque about rotor shaft)
-    blade_unit_vec_base = np.array([[1.0, 0.0, 0.0],
-                               [0.0, 1.0, 0.0],
-                               [0.0, 0.0, 1.0]])
-
-    #================================================================
-    # Begin Calculating Turbine Forces
-    #================================================================
-
-    # Lift and drag coefficient (could be an array and you interpolate the value based on R)
-    # cl_dolf = Constant((np.linspace(1.5, 0.5, problem.num_blade_segments)))
-    # cd_dolf = Constant((np.ones(problem.num_blade_segments)))
-    # cl = cl_dolf.values()
-    # cd = cd_dolf.values()
-
-    # Read cl and cd from the values specified in problem manager
-    twist = np.array(problem.mtwist[turb_i], dtype = float)
-
-    cl = np.array(problem.mcl[turb_i], dtype = float)
-    cd = np.array(problem.mcd[turb_i], dtype = float)
-    tip_loss = np.ones(problem.num_blade_segments)
-
-
-    # if problem.first_call_to_alm:
-    #     print('twist', twist)
-    #     print('lift-table', problem.lift_table)
-    #     print('drag-table', problem.drag_table)
-
-    # cl = np.ones(problem.num_blade_segments)
-    # cd = np.ones(problem.num_blade_segments)
-
-    # Read the chord length from the values specified in the problem manager
-    # c = L/20.0
-    c = np.array(problem.mchord[turb_i], dtype = float)
-
-
-    # print()
-    # print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-    # print("current controls from helper")
-    # print(np.array(c,dtype=float))
-    # print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-    # print()
-
-
-    # Initialze arrays depending on what this function will be returning
-    if dfd is None:
-        tf_vec = np.zeros(np.size(coords))
-        tf_vec_for_power = np.zeros(np.size(coords))
-        lift_force = np.zeros((np.shape(coords)[0], ndim))
-        drag_force = np.zeros((np.shape(coords)[0], ndim))
-
-    elif dfd == 'c_lift':
-        cl = np.ones(problem.num_blade_segments)
-        dfd_c_lift = np.zeros((np.size(coords), problem.num_blade_segments))
-
-    elif dfd == 'c_drag':
-        cd = np.ones(problem.num_blade_segments)
-        dfd_c_drag = np.zeros((np.size(coords), problem.num_blade_segments))
-
-    elif dfd == 'chord':
-        c = np.ones(problem.num_blade_segments)
-        dfd_chord = np.zeros((np.size(coords), problem.num_blade_segments))
-
-    save_safety_switch_files = False
-
-    if save_safety_switch_files:
-        blade_pos_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        lift_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        drag_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        torque_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        torque_force_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        u_fluid_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        u_blade_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        u_rel_paraview = np.zeros((problem.num_blade_segments*num_blades, 3))
-        chord_paraview = np.hstack((c, c, c))
-
-        # print('k-1/2, measuring fluid at  : ', 0.5*(problem.simTime_list[-1] + simTime))
-        # print('k    , simTime:              ', simTime)
-        # print('k+1/2, calculating force at: ', simTime+0.5*problem.dt)
-        # print('k+1  , next sim Time:        ', simTime+problem.dt)
-
-
-    # Calculate the blade position based on current simTime and turbine RPM
-    period = 60.0/problem.rpm
-    # theta_offset = simTime/period*2.0*np.pi
-    theta_offset = (simTime+0.5*dt)/period*2.0*np.pi
-    # theta_offset = 0.0
-
-    baseline_chord = problem.farm.baseline_chord
-
-
-    baseleline_chord_vols = np.pi*(baseline_chord/2.0)**2*w
-    c_vols = np.pi*(c/2.0)**2*w
-    # baseleline_chord_vols = 4.0/3.0*np.pi*(baseline_chord/2.0)**3
-    # c_vols = 4.0/3.0*np.pi*(c/2.0)**3
-
-    c0 = np.dot(baseleline_chord_vols, rdim)
-    c1 = np.dot(c_vols, rdim)
-    baseline_omega = 2.0*np.pi*10.6/60.0
-    w_new = np.sqrt((baseline_omega**2*c0)/c1)
-    rpm_new = w_new*60.0/(2.0*np.pi)
-
-    # print(c)
-
-
-    # print('Turbine currently spinning at %.3f RPM' % (problem.rpm))
-    # print('Turbine should be spinning at %.3f RPM' % (rpm_new))
-    # print('To match centripetal forces from baseline case.')
-
-    # print("Current Yaw:   "+repr(float(problem.farm.myaw[turb_i])))
-    # print("Current Chord: "+str(np.array(problem.mchord[turb_i],dtype=float)))
-
-    bbox = problem.dom.mesh.bounding_box_tree()
-    turbine_loc_point = Point(problem.farm.x[turb_i], problem.farm.y[turb_i], problem.farm.z[turb_i])
-    min_dist_node_id, min_dist = bbox.compute_closest_entity(turbine_loc_point)
-
-    # Treat each blade separately
-    for blade_ct, theta_0 in enumerate(theta_vec):
-        # If the minimum distance between this mesh and the turbine is >2*RD,
-        # don't need to account for this turbine
-        if min_dist > 2.0*(2.0*L):
-            break
-
-        theta = theta_0 + theta_offset
-
-        # Generate a rotation matrix for this turbine blade
-        Rx = rot_x(theta)
-        Rz = rot_z(float(problem.farm.myaw[turb_i]))
-
-        # Rotate the blade velocity in the global x, y, z, coordinate system
-        # Note: blade_vel_base is negative since we seek the velocity of the fluid relative to a stationary blade
-        # and blade_vel_base is defined based on the movement of the blade
-        blade_vel = np.dot(Rz, np.dot(Rx, -blade_vel_base))
-
-        # Rotate the blade unit vectors to be pointing in the rotated positions
-        blade_unit_vec = np.dot(Rz, np.dot(Rx, blade_unit_vec_base))
-
-        # Rotate the entire [x; y; z] matrix using this matrix, then shift to the hub location
-        blade_pos = np.dot(Rz, np.dot(Rx, blade_pos_base))
-        blade_pos[0, :] += problem.farm.x[turb_i]
-        blade_pos[1, :] += problem.farm.y[turb_i]
-        blade_pos[2, :] += problem.farm.z[turb_i]
-
-        # time_offset = 1
-        # if len(problem.simTime_list) < time_offset:
-        #     theta_behind = theta_0 + problem.simTime_list[0]/period*2.0*np.pi
-        # else:
-        #     theta_behind = theta_0 + problem.simTime_list[-time_offset]/period*2.0*np.pi
-
-        time_offset = 1
-        if simTime_id < time_offset:
-            theta_behind = theta_0 + 0.5*(problem.simTime_list[simTime_id]+simTime)/period*2.0*np.pi
-        else:
-            theta_behind = theta_0 + 0.5*(problem.simTime_list[simTime_id-time_offset]+simTime)/period*2.0*np.pi
-            # if blade_ct == 0:
-            #     print('SimTime = %f, using %f' % (simTime, problem.simTime_list[-time_offset]))
-
-        Rx_alt = rot_x(theta_behind)
-        blade_pos_alt = np.dot(Rz, np.dot(Rx_alt, blade_pos_base))
-        blade_pos_alt[0, :] += problem.farm.x[turb_i]
-        blade_pos_alt[1, :] += problem.farm.y[turb_i]
-        blade_pos_alt[2, :] += problem.farm.z[turb_i]
-
-        # print('turbine %d x-pos = %f, y-pos = %f, hh = %f, yaw = %f' % (turb_i,
-        #     problem.farm.x[turb_i], problem.farm.y[turb_i], problem.farm.HH[turb_i], problem.farm.yaw[turb_i]))
-
-        # Initialize space to hold the fluid velocity at each actuator node
-        u_fluid = np.zeros((3, problem.num_blade_segments))
-
-        # Set if using local velocity around inidividual nodes
-        # using_local_velocity = True
-
-        MPI_TESTING_SWITCH = True
-
-        if MPI_TESTING_SWITCH:
-
-            # u_fluid = build_parallel_u_fluid(blade_pos_alt, problem, problem.farm.use_local_velocity, comm, rank, num_procs)
-
-            start_pt = blade_ct*3*problem.num_blade_segments
-            end_pt = start_pt + 3*problem.num_blade_segments
-
-            u_fluid = mpi_u_fluid[turb_i, start_pt:end_pt]
-            u_fluid = np.reshape(u_fluid, (3, -1), 'F')
-
-            for k in range(problem.num_blade_segments):
-                u_fluid[:, k] -= np.dot(u_fluid[:, k], blade_unit_vec[:, 1])*blade_unit_vec[:, 1]
-
-        else:
-            if problem.farm.use_local_velocity:
-                # Generate the fluid velocity from the actual node locations in the flow
-                for k in range(problem.num_blade_segments):
-
-                    u_fluid[:, k] = u_local(blade_pos_alt[0, k],
-                             blade_pos_alt[1, k],
-                             blade_pos_alt[2, k])
-
-                    u_fluid[:, k] -= np.dot(u_fluid[:, k], blade_unit_vec[:, 1])*blade_unit_vec[:, 1]
-
-            else:
-                # Generate the fluid velocity using the inlet velocity (x-pos = x_range[0])        
-                for k in range(problem.num_blade_segments):
-                    # u_fluid[:, k] = [problem.bd.HH_vel,0,0]
-
-                    u_fluid[:, k] = problem.bd.bc_velocity(problem.dom.x_range[0],
-                                                 blade_pos_alt[1, k],
-                                                 blade_pos_alt[2, k])
-
-                    u_fluid[1, k] = 0.0
-                    u_fluid[2, k] = 0.0
-                    # Force inlet velocity (1, 0, 0) for safe_mode
-                    # u_fluid[:, k] = np.array([1, 0, 0])
-
-        # print("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
-        # print(u_fluid)
-        # print("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
-
-
-        problem.blade_pos_previous[blade_ct] = blade_pos
-
-                        
-        # Form the total relative velocity vector (including velocity from rotating blade)
-        u_rel = u_fluid + blade_vel
-
-        # Force fluid-only relative velocity for safe_mode
-        # u_rel = u_fluid
-
-        # Create unit vectors in the direction of u_rel
-
-
-        # u_rel_mag = np.sqrt(u_rel[0]**2.0+u_rel[1]**2.0+u_rel[2]**2.0)
-        # u_rel_mag = u_rel[0]**2.0+u_rel[1]**2.0+u_rel[2]**2.0
-
-        u_rel_mag = np.linalg.norm(u_rel, axis=0)
-        u_rel_mag[u_rel_mag < 1e-6] = 1e-6
-        u_unit_vec = u_rel/u_rel_mag
-        
-        # Calculate the lift and drag forces using the relative velocity magnitude
-        # if dfd == "u":
-        #     d_u_rel_mag = 2*u_rel[0]+2*u_rel[1]+2*u_rel[2]
-        #     lift = (0.5*cl*rho*c*w*2*u_rel_mag*d_u_rel_mag)
-        # else:
-        using_lift_and_drag_tables = True
-
-        if using_lift_and_drag_tables:
-            cl, cd, tip_loss = build_lift_and_drag(problem, u_rel, blade_unit_vec, rdim, twist, c)
-
-        
-        # Calculate the lift and drag forces using the relative velocity magnitude
-        lift = tip_loss*(0.5*cl*rho*c*w*u_rel_mag**2)
-        drag = tip_loss*(0.5*cd*rho*c*w*u_rel_mag**2)
-
-        # Write the lift and drag magnitude at each actuator node to a CSV file
-        write_lift_and_drag('lift', simTime, theta, lift)
-        write_lift_and_drag('drag', simTime, theta, drag)
-
-
-        # Tile the blade coordinates for every mesh point, [numGridPts*ndim x problem.num_blade_segments]
-        blade_pos_full = np.tile(blade_pos, (np.shape(coords)[0], 1))
-
-        # Subtract and square to get the dx^2 values in the x, y, and z directions
-        dx_full = (coordsLinear - blade_pos_full)**2
-
-        # Add together to get |x^2 + y^2 + z^2|^2
-        dist2 = dx_full[0::ndim] + dx_full[1::ndim] + dx_full[2::ndim]
-
-
-        # gaussian_field = np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
-        # gauss_add = np.sum(gaussian_field, axis=1)
-        # gauss_add[np.abs(gauss_add) < 1e-12] = 0.0
-        # gaussian_fn.vector()[:] += gauss_add
-
-        # Calculate the force magnitude at every mesh point due to every node [numGridPts x NumActuators]
-        nodal_lift = lift*np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
-        nodal_drag = drag*np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
-
-
-        
-        for k in range(problem.num_blade_segments):
-            # The drag unit simply points opposite the relative velocity unit vector
-            drag_unit_vec = -np.copy(u_unit_vec[:, k])
-            
-            # The lift is normal to the plane generated by the blade and relative velocity
-            lift_unit_vec = np.cross(drag_unit_vec, blade_unit_vec[:, 1])
-
-            # lift_unit_mag = np.linalg.norm(lift_unit_vec)
-            # if lift_unit_mag < 1e-6:
-            #     lift_unit_mag = 1e-6
-            # lift_unit_vec = lift_unit_vec/lift_unit_mag
-
-            # All force magnitudes get multiplied by the correctly-oriented unit vector
-            vector_nodal_lift = np.outer(nodal_lift[:, k], lift_unit_vec)
-            vector_nodal_drag = np.outer(nodal_drag[:, k], drag_unit_vec)
-
-            # print('Scalar Lift/Summed Lift = %.6e' % (lift[k]/np.sum(nodal_lift[:, k])))
-            # print('Scalar Drag/Summed Drag = %.6e' % (drag[k]/np.sum(nodal_drag[:, k])))
-            # print('sum_gauss = %.6e' % (np.sum(gaussian_field[:, k])))
-
-            if dfd == None:
-                lift_force += vector_nodal_lift
-                drag_force += vector_nodal_drag
-
-            elif dfd == 'c_lift':
-                for j in range(ndim):
-                    dfd_c_lift[j::ndim, k] += vector_nodal_lift[:, j]
-
-            elif dfd == 'c_drag':
-                for j in range(ndim):
-                    dfd_c_drag[j::ndim, k] += vector_nodal_drag[:, j]
-
-            elif dfd == 'chord':
-                for j in range(ndim):
-                    dfd_chord[j::ndim, k] += vector_nodal_lift[:, j] + vector_nodal_drag[:, j]
-
-            # Compute the total force vector [x, y, z] at a single actuator node
-            actuator_lift = lift[k]*lift_unit_vec
-            actuator_drag = drag[k]*drag_unit_vec
-
-            # Note: since this will be used to define the force (torque) from fluid -> blade
-            # we reverse the direction that otherwise gives the turbine force from blade -> fluid
-            actuator_force = -(actuator_lift + actuator_drag)
-            # actuator_force = -(actuator_lift - actuator_drag)
-
-            # Find the component in the direction tangential to the blade
-            tangential_actuator_force = np.dot(actuator_force, blade_unit_vec[:, 1])
-            rotor_plane_force = np.dot(actuator_force, blade_unit_vec)
-            fx.write('%.5f, ' % (rotor_plane_force[0]))
-            fy.write('%.5f, ' % (rotor_plane_force[1]))
-            fz.write('%.5f, ' % (rotor_plane_force[2]))
-
-            # Multiply by the distance away from the hub to get a torque
-            actuator_torque = tangential_actuator_force*rdim[k]
-
-            # Add to the total torque
-            rotor_torque_numpy_temp += actuator_torque  ### Should this be an output?
-
-            if save_safety_switch_files:
-                idx = problem.num_blade_segments*blade_ct + k
-                blade_pos_paraview[idx, :] = blade_pos[:, k]
-                lift_paraview[idx, :] = actuator_lift
-                drag_paraview[idx, :] = actuator_drag
-                torque_paraview[idx, :] = tangential_actuator_force*blade_unit_vec[:, 2]
-                torque_force_paraview[idx, :] = -actuator_force
-
-                u_rel_paraview[idx, :] = u_rel[:, k]
-                u_blade_paraview[idx, :] = blade_vel[:, k]
-                u_fluid_paraview[idx, :] = u_fluid[:, k]
-
-    fx.close()
-    fy.close()
-    fz.close()
-    fa.close()
-
-    # Output the numpy version of rotor_torque
-    problem.rotor_torque[turb_i] = rotor_torque_numpy_temp
-    if rotor_torque_numpy_temp > 0:
-        problem.rotor_torque_count[turb_i] = 1
-
-
-    if save_safety_switch_files:
-        folder_string = problem.params.folder+"timeSeries/"
-        if not os.path.exists(folder_string) and problem.params.rank == 0: os.makedirs(folder_string)
-        
-        fp = open(folder_string +('actuatorForces%05d.vtk' % (problem.num_times_called)), 'w')
-        fp.write('# vtk DataFile Version 2.0\n')
-        fp.write('Lift, Drag, and Torque Forces\n')
-        fp.write('ASCII\n')
-        fp.write('DATASET UNSTRUCTURED_GRID\n')
-
-        def write_paraview_vector(name, data, scalar_data=False):
-            num_points = np.shape(data)[0]
-
-            if scalar_data:
-                fp.write('SCALARS %s float\n' % (name))
-                fp.write('LOOKUP_TABLE default\n')
-
-                for k in range(num_points):
-                    if k < num_points-1:
-                        fp.write('%.3e ' % (data[k]))
-                    else:
-                        fp.write('%.3e \n\n' % (data[k]))
-
-            else:
-                if name is None:
-                    fp.write('POINTS %d float\n' % (num_points))
-                else:        
-                    fp.write('VECTORS %s float\n' % (name))
-
-                for k in range(num_points):
-                    x_val = data[k, 0]
-                    y_val = data[k, 1]
-                    z_val = data[k, 2]
-                    if k < num_points-1:
-                        fp.write('%.3e %.3e %.3e  ' % (x_val, y_val, z_val))
-                    else:
-                        fp.write('%.3e %.3e %.3e\n\n' % (x_val, y_val, z_val))
-                        
-                if name is None:
-                    fp.write('POINT_DATA %d\n' % (num_points))
-
-        write_paraview_vector(None, blade_pos_paraview)
-        write_paraview_vector('Chord', chord_paraview, scalar_data=True)
-
-        write_paraview_vector('Lift', lift_paraview)
-        write_paraview_vector('Drag', drag_paraview)
-        write_paraview_vector('Torque', torque_paraview)
-        write_paraview_vector('Torque_force', torque_force_paraview)
-
-        write_paraview_vector('u_rel', u_rel_paraview)
-        write_paraview_vector('u_fluid', u_fluid_paraview)
-        write_paraview_vector('u_blade', u_blade_paraview)
-        
-        fp.close()
-
-
-    if dfd == None:
-        # The total turbine force is the sum of lift and drag effects
-        turbine_force = drag_force + lift_force
-        turbine_force_for_power = -drag_force + lift_force
-
-        # Riffle-shuffle the x-, y-, and z-column force components
-        for k in range(ndim):
-            tf_vec[k::ndim] = turbine_force[:, k]
-            tf_vec_for_power[k::ndim] = turbine_force_for_power[:, k]
-
-        # Remove near-zero values
-        tf_vec[np.abs(tf_vec) < 1e-12] = 0.0
-
-        # Assign the individual turbine force
-        tf_individual.vector()[:] = tf_vec#_for_power
-
-        # Create a cylindrical expression aligned with the position of this turbine
-        cyld_expr = Expression(('sin(yaw)*(x[2]-zs)', '-cos(yaw)*(x[2]-zs)', '(x[1]-ys)*cos(yaw)-(x[0]-xs)*sin(yaw)'),
-            degree=1,
-            yaw=problem.farm.myaw[turb_i],
-            xs=problem.farm.mx[turb_i],
-            ys=problem.farm.my[turb_i],
-            zs=problem.farm.z[turb_i])
-
-        # cyld.interpolate(cyld_expr)
-
-        # Integrate dot(Force, In-Plane-Vector) to get total torque
-        # problem.rotor_torque_dolfin[turb_i] = assemble(dot(-tf_individual, cyld_expr)*dx)
-        temp_tor = assemble(dot(-tf_individual, cyld_expr)*dx)
-        problem.rotor_torque_dolfin[turb_i] = temp_tor
-        problem.rotor_torque_dolfin_time[simTime_id] = temp_tor
-
-        # Add to the cumulative turbine force
-        tf.vector()[:] += tf_vec
-
-        # if turb_i == 0:
-        #     # Initialize turbine force (tf) dolfin function
-        #     tf = Function(problem.fs.V)
-
-        #     # Set the dolfin vector values
-        #     tf.vector()[:] = tf_vec
-            
-        # else:
-        #     tf.vector()[:] += tf_vec
-
-        # Test storing them here for objective function calc
-        # problem.tf_individual = tf_individual
-        problem.cyld_expr_list[turb_i] = cyld_expr
-        problem.cyld = cyld
-        # print('just saved turb %.0d at x = %f, y = %.0f, yaw = %.4f' % (turb_i, problem.farm.x[turb_i], problem.farm.y[turb_i], problem.farm.yaw[turb_i]))
-
-    fp = open(problem.aoa_files[turb_i], 'a')
-    fp.write('\n')
-    fp.close()
-    fp = open(problem.force_files[turb_i][0], 'a')
-    fp.write('\n')
-    fp.close()
-    fp = open(problem.force_files[turb_i][1], 'a')
-    fp.write('\n')
-    fp.close()
-    fp = open(problem.force_files[turb_i][2], 'a')
-    fp.write('\n')
-    fp.close()
-
-    problem.num_times_called += 1
-    problem.first_call_to_alm = False
-
-    tf.vector().update_ghost_values()
-
-    # fp = File('%s/timeSeries/gauss.pvd' % (problem.params.folder))
-    # gaussian_fn.rename('gauss', 'gauss')
-    # fp << (gaussian_fn, len(problem.simTime_list))
-
-    if dfd == None:
-
-        return tf
-
-    elif dfd == 'c_lift':
-        save_c_lift = False
-
-        if save_c_lift:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdcl', dfd_c_lift)
-
-        return dfd_c_lift
-
-    elif dfd == 'c_drag':
-        save_c_drag = False
-
-        if save_c_drag:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdcd', dfd_c_drag)
-
-        return dfd_c_drag
-
-    elif dfd == 'chord':
-        save_chord = False
+    near_ids = problem.coords_tree.query_ball_point(node_pos.T, support_radius)
+    counts = [len(ids) for ids in near_ids]
+    if sum(counts) > 0:
+        rows = np.concatenate(near_ids).astype(np.int32)
+    else:
+        rows = np.zeros(0, dtype=np.int32)
+    cols = np.repeat(np.arange(np.shape(node_pos)[1], dtype=np.int32), counts)
+    dist2 = np.sum((problem.coords[rows] - node_pos.T[cols])**2, axis=1)
+    weights = np.exp(-dist2/eps**2)/(eps**3 * np.pi**1.5)
+
+    return rows, cols, weights
+
+
+def UpdateActuatorLineForces(problem, mpi_u_fluid_constant, simTime_id, dt):
+    """
+    Computes the force of every alm turbine together. The actuator nodes of
+    all turbines are stacked and projected onto the mesh with a single
+    sparse matrix product whose columns keep the turbines apart, so the
+    cost follows the total number of actuator nodes rather than the number
+    of turbines times the mesh size. Only the forward force can be computed
+    this way, the derivatives still go through :meth:`UpdateActuatorLineForce`.
+    If the workspace has a projection cache, each rotor's projection is
+    interpolated from its tabulated blade angles instead of recomputed.
+    When alm_subcycle is above 1, the nodal loads are also held for
+    :meth:`AdvanceActuatorLineForces`.
+
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the alm data
+        mpi_u_fluid_constant (Constant): the fluid velocity at every actuator node
+        simTime_id (int): index of the current time step
+        dt (float): the current time step size
+
+    Returns:
+        tf_list (list): the force Function of each turbine
+    """
+    workspace = problem.alm_workspace
+    numturbs = problem.farm.numturbs
+    ndim = problem.dom.dim
 
-        if save_chord:
-            save_derivative_file(problem.params.folder+"timeSeries/",'dfdchord', dfd_chord)
+    def evaluate_turbine(turb_i):
+        # Compute the actuator nodes of one turbine and, unless it comes from the cache, their projection
+        turb_pos, turb_force = UpdateActuatorLineForce(problem, mpi_u_fluid_constant, simTime_id, dt, turb_i, project=False)
+        if workspace.projection_cache is None:
+            return turb_pos, turb_force, GaussianProjectionWeights(problem, turb_pos)
+        return turb_pos, turb_force, None
+
+    # The first evaluation builds the shared airfoil interpolants, so let it finish before the others start
+    first = 0 if hasattr(problem, 'interp_lift') else min(1, numturbs)
+    results = [evaluate_turbine(turb_i) for turb_i in range(first)]
+    results += workspace.Map(evaluate_turbine, range(first, numturbs))
+
+    # Hold on to the nodal loads if the following steps are sub-cycled
+    theta_offset = workspace.BladeAngle(simTime_id, dt)
+    workspace.HoldLoads(simTime_id, theta_offset, results)
+
+    return ProjectActuatorLineForces(problem, results, simTime_id, theta_offset)
+
+
+def AdvanceActuatorLineForces(problem, simTime_id, dt):
+    """
+    Advances the force of every alm turbine over a sub-cycled step without
+    sampling the fluid. The nodal loads of the last full update, linearly
+    extrapolated from the one before when possible, are held fixed in the
+    frame of each blade and rotated to the current blade positions before
+    being projected like in :meth:`UpdateActuatorLineForces`. The aoa
+    diagnostics are only recorded during full updates.
+
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the alm data
+        simTime_id (int): index of the current time step
+        dt (float): the current time step size
+
+    Returns:
+        tf_list (list): the force Function of each turbine
+    """
+    workspace = problem.alm_workspace
+    simTime = problem.alm_history.Time(simTime_id)
+    theta_offset = workspace.BladeAngle(simTime_id, dt)
+
+    def advance_turbine(turb_i):
+        loads = workspace.HeldLoads(turb_i, simTime)
+        if loads is None:
+            return np.zeros((3, 0)), np.zeros((0, 3)), None
+
+        # Rotate the held loads with the blades, [num_nodes x 3]
+        turb_pos, blade_unit_vec = workspace.RotorFrames(turb_i, theta_offset)
+        turb_force = np.matmul(loads, np.transpose(blade_unit_vec, (0, 2, 1))).reshape(-1, 3)
+
+        # The held loads act on the fluid, so the rotor feels the opposite tangential force
+        rdim = workspace.Geometry(turb_i, problem.farm.radius[turb_i], problem.rpm)[0]
+        rotor_torque = -np.sum(loads[:, :, 2]*rdim)
+        problem.rotor_torque[turb_i] = rotor_torque
+        if rotor_torque > 0:
+            problem.rotor_torque_count[turb_i] = 1
+
+        if workspace.projection_cache is None:
+            return turb_pos, turb_force, GaussianProjectionWeights(problem, turb_pos)
+        return turb_pos, turb_force, None
+
+    results = workspace.Map(advance_turbine, range(problem.farm.numturbs))
+
+    return ProjectActuatorLineForces(problem, results, simTime_id, theta_offset)
+
+
+def ProjectActuatorLineForces(problem, results, simTime_id, theta_offset):
+    """
+    Projects the actuator nodes of every alm turbine onto the mesh with a
+    single sparse matrix product and records the resulting torques.
+
+    Args:
+        problem (:meth:`windse.ProblemManager.GenericProblem`): the problem holding the alm data
+        results (list): the node positions, node forces, and projection (or None to use the cache) of each turbine
+        simTime_id (int): index of the current time step
+        theta_offset (float): rotation of the blades during the current step
+
+    Returns:
+        tf_list (list): the force Function of each turbine
+    """
+    workspace = problem.alm_workspace
+    numturbs = problem.farm.numturbs
+    ndim = problem.dom.dim
 
-        return dfd_chord
+    # Collect the actuator nodes of every turbine in turbine order, so the result does not
+    # depend on the number of threads, [3 x total_nodes] and [total_nodes x 3]
+    node_pos = np.hstack([turb_pos for turb_pos, turb_force, turb_projection in results])
+    node_force = np.vstack([turb_force for turb_pos, turb_force, turb_projection in results])
+    node_turb = np.concatenate([np.full(np.shape(turb_pos)[1], turb_i, dtype=int) for turb_i, (turb_pos, turb_force, turb_projection) in enumerate(results)])
+    total_nodes = np.shape(node_pos)[1]
+
+    # Build the truncated gaussian projection from every node to the nearby mesh points, [numGridPts x total_nodes]
+    rows = [np.zeros(0, dtype=int)]
+    cols = [np.zeros(0, dtype=int)]
+    weights = [np.zeros(0)]
+    node_offset = 0
+    for turb_i, (turb_pos, turb_force, turb_projection) in enumerate(results):
+        num_nodes = np.shape(turb_pos)[1]
+        if num_nodes > 0:
+            if turb_projection is None:
+                # Interpolate the projection of this rotor from its tabulated blade angles
+                turb_projection = workspace.projection_cache.Projection(turb_i, theta_offset)
+            rows.append(turb_projection[0])
+            cols.append(turb_projection[1] + node_offset)
+            weights.append(turb_projection[2])
+        node_offset += num_nodes
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    weights = np.concatenate(weights)
+
+    projection = sparse.csr_matrix((weights, (rows, cols)), shape=(np.shape(problem.coords)[0], total_nodes))
+
+    # Place the force of each node in the columns of its own turbine, [total_nodes x ndim*numturbs]
+    force_rows = np.repeat(np.arange(total_nodes), ndim)
+    force_cols = (ndim*node_turb[:, np.newaxis] + np.arange(ndim)).reshape(-1)
+    turbine_nodes = sparse.csr_matrix((node_force.reshape(-1), (force_rows, force_cols)), shape=(total_nodes, ndim*numturbs))
+
+    # Project every turbine at once, [numGridPts x ndim*numturbs]
+    projected = (projection*turbine_nodes).tocoo()
+    projected_turb = projected.col//ndim
+    order = np.argsort(projected_turb, kind='stable')
+    bounds = np.searchsorted(projected_turb[order], np.arange(numturbs+1))
+
+    # Split the result into the force Function of each turbine
+    tf_list = []
+    for turb_i in range(numturbs):
+        ids = order[bounds[turb_i]:bounds[turb_i+1]]
+        values = projected.data[ids]
+        values[np.abs(values) < 1e-12] = 0.0
+
+        turbine_force = workspace.ResetTurbineForce()
+        turbine_force[projected.row[ids], projected.col[ids] % ndim] = values
+        workspace.touched_ids = np.unique(projected.row[ids])
+
+        tf = workspace.TurbineForceFunction(turb_i)
+        tf.vector()[:] = turbine_force.reshape(-1)
+
+        RecordActuatorLineTorque(problem, tf, simTime_id, turb_i, reduce=False)
+
+        tf.vector().update_ghost_values()
+        tf_list.append(tf)
+
+    # Sum the torque of every turbine over all ranks at once
+    ReduceActuatorLineTorque(problem, simTime_id, list(range(numturbs)))
+
+    return tf_list
 
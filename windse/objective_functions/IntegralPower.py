@@ -67,15 +67,35 @@ def objective(solver, inflow_angle = 0.0, first_call=False, annotate=True, **kwa
         J_list[0]=solver.iter_val
         J_list[1]=solver.simTime
         if getattr(solver.problem.farm,"actuator_disks_list",None) is not None:
-            for i in range(solver.problem.farm.numturbs):
-                yaw = solver.problem.farm.myaw[i]+inflow_angle
-                tf1 = solver.problem.farm.actuator_disks_list[i] * cos(yaw)**2
-                tf2 = solver.problem.farm.actuator_disks_list[i] * sin(yaw)**2
-                tf3 = solver.problem.farm.actuator_disks_list[i] * 2.0 * cos(yaw) * sin(yaw)
-                tf = tf1*solver.problem.u_k[0]**2+tf2*solver.problem.u_k[1]**2+tf3*solver.problem.u_k[0]*solver.problem.u_k[1]
-                J_list[i+2] = assemble(dot(-tf,solver.problem.u_k)*dx,**solver.extra_kwarg)
+            problem = solver.problem
+            actuator_disks_list = problem.farm.actuator_disks_list
+            u = problem.u_k
+            yaw = np.array(problem.farm.myaw,dtype=float)+float(inflow_angle)
+
+            if hasattr(actuator_disks_list,"actuator_array"):
+                ### Each turbine's power is linear in its sparse force, so three assemblies serve every turbine ###
+                w = TestFunction(problem.fs.tf_V)
+                b1 = assemble(dot(w,u)*u[0]**2*dx,**solver.extra_kwarg).get_local()
+                b2 = assemble(dot(w,u)*u[1]**2*dx,**solver.extra_kwarg).get_local()
+                b3 = assemble(dot(w,u)*u[0]*u[1]*dx,**solver.extra_kwarg).get_local()
+
+                ### Dot the force of each turbine with its weighted velocity and sum over all ranks at once ###
+                actuator_array = actuator_disks_list.actuator_array
+                local_power = -(np.cos(yaw)**2*(actuator_array @ b1) +
+                                np.sin(yaw)**2*(actuator_array @ b2) +
+                                2.0*np.cos(yaw)*np.sin(yaw)*(actuator_array @ b3))
+                turb_power = np.zeros(problem.farm.numturbs)
+                solver.params.comm.Allreduce(local_power,turb_power)
+                J_list[2:-1] = turb_power
             else:
-                print("WARNING: missing individual turbine actuator disk, only able to report full farm power")
+                for i in range(problem.farm.numturbs):
+                    tf1 = actuator_disks_list[i] * np.cos(yaw[i])**2
+                    tf2 = actuator_disks_list[i] * np.sin(yaw[i])**2
+                    tf3 = actuator_disks_list[i] * 2.0 * np.cos(yaw[i]) * np.sin(yaw[i])
+                    tf = tf1*u[0]**2+tf2*u[1]**2+tf3*u[0]*u[1]
+                    J_list[i+2] = assemble(dot(-tf,u)*dx,**solver.extra_kwarg)
+        else:
+            print("WARNING: missing individual turbine actuator disk, only able to report full farm power")
 
         J_list[-1]=float(J)
 